@@ -0,0 +1,381 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+################################################################################
+# Offline micro-benchmarks for the hot paths
+################################################################################
+# Runs without MySQL: every database benchmark uses a temporary SQLite file
+# with the same tables/views as db.sql, filled with synthetic fixtures.
+#
+#   python benchmarks/run_benchmarks.py                           run and print
+#   python benchmarks/run_benchmarks.py --output results.json     also save results
+#   python benchmarks/run_benchmarks.py --save-baseline           store as the baseline
+#   python benchmarks/run_benchmarks.py --compare                 exit 1 on regressions
+#
+# The baseline (benchmarks/baseline.json) is machine specific: record it on the
+# machine that runs the comparison. A benchmark regresses when its median is
+# more than --tolerance (default 25%) slower than the baseline median.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, "www-react", "backend")
+SCRIPTS_DIR = os.path.join(ROOT, "scripts")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# database_utils/scoring/trial_bundles exist in both directories (identical copies)
+sys.path[:0] = [BACKEND_DIR, SCRIPTS_DIR]
+
+_SCHEMA = """
+CREATE TABLE participants (id INTEGER PRIMARY KEY AUTOINCREMENT, participant_name VARCHAR(255));
+CREATE INDEX idx_participants_name ON participants (participant_name);
+CREATE TABLE resources (id INTEGER PRIMARY KEY AUTOINCREMENT, filenames VARCHAR(255),
+    folder_paths VARCHAR(255), descriptions VARCHAR(255));
+CREATE TABLE sequences (id INTEGER PRIMARY KEY AUTOINCREMENT, sequence_id INT NOT NULL,
+    stimuli_id INT NOT NULL, trial INT NOT NULL, index_order INT NOT NULL);
+CREATE INDEX idx_sequences_sequence ON sequences (sequence_id, trial, index_order);
+CREATE TABLE sequence_info (id INTEGER PRIMARY KEY AUTOINCREMENT, sequence_id INT NOT NULL UNIQUE,
+    sequence_name VARCHAR(255), time_created DATETIME NOT NULL, folder_path VARCHAR(255) NOT NULL,
+    choice_set_size INT NOT NULL, n_trials INT NOT NULL);
+CREATE VIEW sequence_view AS
+SELECT si.id AS sequence_info_pk, si.sequence_id, si.sequence_name, si.time_created, si.folder_path,
+    si.choice_set_size, si.n_trials, s.id AS sequences_pk, s.trial, s.index_order, s.stimuli_id,
+    r.id AS resource_id, r.filenames AS resource_filenames, r.folder_paths AS resource_folder_paths,
+    r.descriptions AS resource_descriptions
+FROM sequence_info si
+JOIN sequences s ON si.sequence_id = s.sequence_id
+JOIN resources r ON s.stimuli_id = r.id;
+CREATE TABLE trial_results (id INTEGER PRIMARY KEY AUTOINCREMENT, participant_id INT NOT NULL,
+    sequence_id INT NOT NULL, trial_index INT NOT NULL, best_stimulus INT NULL, worst_stimulus INT NULL,
+    submitted_at DATETIME NOT NULL);
+CREATE UNIQUE INDEX idx_trial_results_participant_sequence ON trial_results (participant_id, sequence_id, trial_index)
+"""
+
+FOLDER = "https://dataset-guitar.s3.ap-southeast-1.amazonaws.com/Guitar/"
+
+
+################################################################################
+# Fixtures
+################################################################################
+def build_fixture_db(path, n_resources=1000, n_trials=600, set_size=5, seed=0):
+    """SQLite file with db.sql-shaped tables and one fixed sequence (id 7)."""
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        for statement in _SCHEMA.strip().split(";\n"):
+            conn.execute(text(statement))
+
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({
+        "filenames": [f"note_{i:05d}.wav" for i in range(n_resources)],
+        "folder_paths": [f"{FOLDER}note_{i:05d}.wav" for i in range(n_resources)],
+        "descriptions": "benchmark fixture",
+    }).to_sql("resources", engine, if_exists="append", index=False)
+
+    rows = [
+        (7, int(res_id) + 1, trial, order)
+        for trial in range(n_trials)
+        for order, res_id in enumerate(rng.choice(n_resources, set_size, replace=False))
+    ]
+    pd.DataFrame(rows, columns=["sequence_id", "stimuli_id", "trial", "index_order"]).to_sql(
+        "sequences", engine, if_exists="append", index=False)
+    pd.DataFrame([{
+        "sequence_id": 7, "sequence_name": "benchmark", "time_created": datetime.now(),
+        "folder_path": FOLDER, "choice_set_size": set_size, "n_trials": n_trials,
+    }]).to_sql("sequence_info", engine, if_exists="append", index=False)
+    engine.dispose()
+
+
+def make_db_manager(path):
+    from database_utils import DBManager
+    db_manager = DBManager(primary_uri=f"sqlite:///{path}", replica_uris=[])
+    db_manager.connect()
+    return db_manager
+
+
+def load_backend_app(path, cache_path):
+    """Import the Flask app against the fixture database (no MySQL needed)."""
+    for name in ("DB_HOST", "DB_PORT", "DB_NAME", "DB_USER", "DB_PASSWORD"):
+        os.environ.setdefault(name, "benchmark")
+    os.environ["CACHE_PATH"] = cache_path
+    import app as app_module
+    app_module.db_manager.connection_uri = f"sqlite:///{path}"
+    app_module.db_manager.replica_uris = []
+    app_module.db_manager.close()
+    app_module.db_manager.connect()
+    return app_module
+
+
+def synthetic_choices(n_items, n_sets, set_size, seed=0):
+    """Random designs with answers drawn from known utilities."""
+    rng = np.random.default_rng(seed)
+    sets = np.argsort(rng.random((n_sets, n_items)), axis=1)[:, :set_size]
+    utilities = rng.normal(size=n_items)
+    u = utilities[sets]
+    best = sets[np.arange(n_sets), np.argmax(u + rng.gumbel(size=u.shape), axis=1)]
+    worst = sets[np.arange(n_sets), np.argmin(u - rng.gumbel(size=u.shape), axis=1)]
+    return sets, best, worst
+
+
+################################################################################
+# Benchmarks: each returns a zero-argument callable to time (setup excluded)
+################################################################################
+def bench_trial_payload(ctx):
+    from trial_bundles import load_trials
+    return lambda: load_trials(ctx["db_manager"], 7)
+
+
+def bench_compact_payload(ctx):
+    from trial_bundles import load_trials
+    from wire_format import compact_trials
+    trials, audio_map = load_trials(ctx["db_manager"], 7)
+    return lambda: compact_trials(trials, audio_map)
+
+
+def bench_participant_new(ctx):
+    app_module = ctx["app"]
+    counter = iter(range(10 ** 9))
+    return lambda: app_module.get_or_create_participant(f"bench-new-{next(counter)}")
+
+
+def bench_participant_existing(ctx):
+    # Returning participant whose id is not cached (another worker's, or
+    # evicted): drop the cached id so every call does the indexed DB lookup
+    app_module = ctx["app"]
+    app_module.get_or_create_participant("bench-existing")
+
+    def run():
+        app_module.cache.delete("participant:bench-existing")
+        return app_module.get_or_create_participant("bench-existing")
+    return run
+
+
+def make_bench_create_sets(n_stimuli):
+    def bench(ctx):
+        import random
+        from sequence_generator import create_sets_of_stimuli
+        random.seed(0)
+        stimuli = list(range(n_stimuli))
+        return lambda: create_sets_of_stimuli(stimuli, repeats=3, set_size=5)
+    return bench
+
+
+def bench_scoring_update(ctx):
+    from scoring import DeltaRuleScorer
+    sets, best, worst = synthetic_choices(500, 1000, 5)
+    scorer = DeltaRuleScorer(np.arange(500), alpha=0.1)
+    trials = sets.tolist()
+
+    def run():
+        for trial, b, w in zip(trials, best, worst):
+            scorer.update(trial, int(b), int(w))
+    return run
+
+
+def bench_scoring_replay(ctx):
+    from scoring import DeltaRuleScorer
+    sets, best, worst = synthetic_choices(500, 20000, 5)
+    trials = sets.tolist()
+    return lambda: DeltaRuleScorer(np.arange(500), alpha=0.1).replay(trials, best, worst)
+
+
+def bench_finalize_fit(ctx):
+    from maxdiff import choice_data_from_arrays, fit_maxdiff
+    sets, best, worst = synthetic_choices(200, 20000, 5)
+    n_sets, set_size = sets.shape
+    data = choice_data_from_arrays(
+        np.repeat(np.arange(n_sets), set_size),
+        np.zeros(n_sets * set_size, dtype=np.int64),
+        sets.ravel(),
+        np.repeat(best, set_size).astype(float),
+        np.repeat(worst, set_size).astype(float),
+    )
+    return lambda: fit_maxdiff(data)
+
+
+def simulate_adaptive_session(n_stimuli, set_size=5, seed=0):
+    """An adaptive session run to its end, answered from known utilities."""
+    from adaptive import AdaptiveSession
+    rng = np.random.default_rng(seed)
+    utilities = rng.normal(scale=1.5, size=n_stimuli)
+    session = AdaptiveSession(np.arange(n_stimuli) + 1, set_size, seed=seed)
+    while True:
+        trial = session.next_set()
+        if trial is None:
+            return session
+        u = utilities[np.asarray(trial) - 1]
+        best = int(np.argmax(u + rng.gumbel(size=set_size)))
+        worst_u = u - rng.gumbel(size=set_size)
+        worst_u[best] = np.inf
+        session.observe(trial, trial[best], trial[int(np.argmin(worst_u))])
+
+
+def make_bench_adaptive_session(n_stimuli):
+    def bench(ctx):
+        # The stopping rule has to end sessions, not the max_trials safety cap
+        session = simulate_adaptive_session(n_stimuli)
+        if session.trial_count >= session.max_trials:
+            raise RuntimeError(f"Adaptive session over {n_stimuli} stimuli ran to max_trials={session.max_trials}")
+        return lambda: simulate_adaptive_session(n_stimuli)
+    return bench
+
+
+# Every append (over all append benchmarks) writes trial indexes no earlier
+# append used, as the UNIQUE (participant, sequence, trial_index) key requires
+_append_batches = itertools.count()
+
+
+def make_bench_append(method, n_rows=20000):
+    def bench(ctx):
+        db_manager = ctx["db_manager"]
+        df = pd.DataFrame({
+            "participant_id": np.arange(n_rows) % 50 + 1,
+            "sequence_id": 7,
+            "trial_index": np.arange(n_rows),
+            "best_stimulus": np.arange(n_rows) % 1000 + 1,
+            "worst_stimulus": (np.arange(n_rows) + 1) % 1000 + 1,
+            "submitted_at": datetime(2025, 1, 1),
+        })
+        trial_index = df["trial_index"].to_numpy()
+
+        def run():
+            batch = df.assign(trial_index=trial_index + next(_append_batches) * n_rows)
+            return db_manager.append_table("trial_results", batch, method=method, chunksize=1000)
+        return run
+    return bench
+
+
+BENCHMARKS = {
+    "trial_payload.load_trials": (bench_trial_payload, {}),
+    "trial_payload.compact": (bench_compact_payload, {}),
+    "participant.create": (bench_participant_new, {}),
+    "participant.existing": (bench_participant_existing, {}),
+    "sequence.create_sets_100": (make_bench_create_sets(100), {}),
+    "sequence.create_sets_1000": (make_bench_create_sets(1000), {}),
+    "sequence.create_sets_10000": (make_bench_create_sets(10000), {"repeat": 3}),
+    "scoring.update_1000_trials": (bench_scoring_update, {}),
+    "scoring.replay_20000_trials": (bench_scoring_replay, {}),
+    "finalize.fit_maxdiff_20000_sets": (bench_finalize_fit, {"repeat": 3}),
+    "adaptive.session_100_stimuli": (make_bench_adaptive_session(100), {}),
+    "adaptive.session_500_stimuli": (make_bench_adaptive_session(500), {"repeat": 3}),
+    "db.append_table_20000_rows": (make_bench_append(None), {"repeat": 3, "unit_count": 20000}),
+    "db.append_table_20000_rows_multi": (make_bench_append("multi"), {"repeat": 3, "unit_count": 20000}),
+}
+
+
+################################################################################
+# Runner
+################################################################################
+def time_callable(fn, repeat=7, min_time=0.2):
+    """
+    Median/min seconds per call. Each of `repeat` samples runs the callable
+    enough times to last about `min_time` seconds (calibrated on one call).
+    """
+    started = time.perf_counter()
+    fn()  # warm-up, also calibrates
+    first = time.perf_counter() - started
+    number = max(1, int(min_time / first)) if first > 0 else 1000
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) / number)
+    return {"median_s": statistics.median(samples), "min_s": min(samples),
+            "number": number, "repeat": repeat}
+
+
+def run(selected, repeat):
+    import logging
+    logging.disable(logging.INFO)  # DBManager logs every append
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "fixture.sqlite3")
+        build_fixture_db(db_path)
+        ctx = {"db_manager": make_db_manager(db_path)}
+        ctx["app"] = load_backend_app(db_path, os.path.join(tmp, "cache.sqlite3"))
+        try:
+            for name in selected:
+                factory, options = BENCHMARKS[name]
+                fn = factory(ctx)
+                result = time_callable(fn, repeat=options.get("repeat", repeat))
+                if "unit_count" in options:
+                    result["units_per_s"] = options["unit_count"] / result["median_s"]
+                results[name] = result
+                print(f"{name:<40} {result['median_s'] * 1e3:10.3f} ms  (min {result['min_s'] * 1e3:.3f} ms, "
+                      f"{result['number']}x{result['repeat']})", flush=True)
+        finally:
+            ctx["db_manager"].close()
+            ctx["app"].db_manager.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Names of the benchmarks whose median regressed beyond `tolerance`."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        ratio = result["median_s"] / reference["median_s"]
+        flag = "REGRESSION" if ratio > 1 + tolerance else ("faster" if ratio < 1 - tolerance else "ok")
+        print(f"{name:<40} {ratio:6.2f}x baseline  {flag}")
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks with baseline comparison.")
+    parser.add_argument("-k", "--filter", default=None, help="Only run benchmarks whose name contains this.")
+    parser.add_argument("--repeat", type=int, default=7, help="Samples per benchmark.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline.")
+    parser.add_argument("--compare", action="store_true", help="Compare with the baseline; exit 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown (0.25 = 25%%).")
+    args = parser.parse_args()
+
+    selected = [name for name in BENCHMARKS if args.filter is None or args.filter in name]
+    if not selected:
+        parser.error(f"No benchmark matches {args.filter!r}")
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": run(selected, args.repeat),
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\nNo baseline at {args.baseline}; run with --save-baseline first.")
+            sys.exit(2)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with baseline from {baseline.get('created_at')} (tolerance {args.tolerance:.0%}):")
+        regressions = compare(report["results"], baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
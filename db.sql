@@ -90,3 +90,191 @@ CREATE TABLE IF NOT EXISTS final_scores (
     FOREIGN KEY (resource_id) REFERENCES resources(id),
     FOREIGN KEY (sequence_id) REFERENCES sequence_info(sequence_id)
 );
+
+-- Choice sets handed out in adaptive mode (sequence_info.n_trials = 0).
+-- Answers still go to trial_results with the same (participant, sequence, trial_index).
+CREATE TABLE IF NOT EXISTS adaptive_trials (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    participant_id INT NOT NULL,
+    sequence_id INT NOT NULL,
+    trial_index INT NOT NULL,
+    stimuli_id INT NOT NULL,
+    index_order INT NOT NULL,
+    INDEX idx_adaptive_trials_participant_sequence (participant_id, sequence_id, trial_index),
+    FOREIGN KEY (participant_id) REFERENCES participants(id),
+    FOREIGN KEY (stimuli_id) REFERENCES resources(id),
+    FOREIGN KEY (sequence_id) REFERENCES sequence_info(sequence_id)
+);
+
+-- Uncertainty for final_score (bootstrap/jackknife, see scripts/bootstrap_scores.py).
+-- participant_id NULL = scores pooled over all participants of the sequence.
+ALTER TABLE final_scores
+    MODIFY participant_id INT NULL,
+    ADD COLUMN ci_lower FLOAT NULL,
+    ADD COLUMN ci_upper FLOAT NULL,
+    ADD COLUMN ci_method VARCHAR(64) NULL;
+
+-- One row per alternative shown in an answered trial, for fixed and adaptive trials
+CREATE OR REPLACE VIEW trial_choice_sets AS
+SELECT
+    tr.id AS trial_result_id,
+    tr.participant_id,
+    tr.sequence_id,
+    tr.trial_index,
+    tr.best_stimulus,
+    tr.worst_stimulus,
+    tr.submitted_at,
+    s.stimuli_id,
+    s.index_order
+FROM trial_results tr
+JOIN sequences s ON s.sequence_id = tr.sequence_id AND s.trial = tr.trial_index
+UNION ALL
+SELECT
+    tr.id AS trial_result_id,
+    tr.participant_id,
+    tr.sequence_id,
+    tr.trial_index,
+    tr.best_stimulus,
+    tr.worst_stimulus,
+    tr.submitted_at,
+    a.stimuli_id,
+    a.index_order
+FROM trial_results tr
+JOIN adaptive_trials a
+    ON a.sequence_id = tr.sequence_id
+    AND a.participant_id = tr.participant_id
+    AND a.trial_index = tr.trial_index;
+
+-- S3 ingest bookkeeping (scripts/fetch_audio_s3.py): skip objects already ingested
+ALTER TABLE resources
+    ADD COLUMN etag VARCHAR(64) NULL,
+    ADD COLUMN size_bytes BIGINT NULL,
+    ADD INDEX idx_resources_folder_paths (folder_paths);
+
+-- Local folder ingest (scripts/ingest_folder.py): stat info to skip unchanged
+-- files, and a content hash so identical files are stored once
+ALTER TABLE resources
+    ADD COLUMN mtime_ns BIGINT NULL,
+    ADD COLUMN content_hash CHAR(64) NULL,
+    ADD UNIQUE INDEX idx_resources_content_hash (content_hash);
+
+-- Parquet export (scripts/export_parquet.py): ingest updates resources in
+-- place, so the export detects changes by time instead of by id
+ALTER TABLE resources
+    ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ADD INDEX idx_resources_updated_at (updated_at);
+
+-- Files the folder ingest skipped because their content is already stored
+-- under another path (one resources row per content hash): their stat info,
+-- so an unchanged duplicate is skipped by stat instead of hashed on every scan
+CREATE TABLE IF NOT EXISTS resource_duplicates (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    folder_paths VARCHAR(255) NOT NULL,
+    filenames VARCHAR(255) NOT NULL,
+    size_bytes BIGINT NOT NULL,
+    mtime_ns BIGINT NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    UNIQUE INDEX idx_resource_duplicates_path (folder_paths, filenames)
+);
+
+-- Resume lookups: one index lookup per (participant, sequence). UNIQUE, so a
+-- trial cannot be stored twice (double clicks, concurrent retries); the backend
+-- answers the duplicate-key error with 409. Existing duplicates (keep the
+-- first answer) have to go before the index can be built.
+DELETE later FROM trial_results later
+JOIN trial_results earlier
+    ON earlier.participant_id = later.participant_id
+    AND earlier.sequence_id = later.sequence_id
+    AND earlier.trial_index = later.trial_index
+    AND earlier.id < later.id;
+CREATE UNIQUE INDEX idx_trial_results_participant_sequence
+    ON trial_results (participant_id, sequence_id, trial_index);
+CREATE INDEX idx_participants_name ON participants (participant_name);
+
+-- Archival of completed studies (scripts/archive_study.py).
+-- The hot tables keep their foreign keys and only hold active studies; archived
+-- studies move to compressed archive tables, partitioned by sequence_id so a
+-- query for one study prunes to one partition. (InnoDB cannot partition tables
+-- with foreign keys, and the partition column must be part of the primary key.)
+ALTER TABLE sequence_info
+    ADD COLUMN archived_at DATETIME NULL,
+    ADD COLUMN archive_location VARCHAR(255) NULL;  -- 'table' or the Parquet directory
+
+CREATE TABLE IF NOT EXISTS trial_results_archive (
+    id INT NOT NULL,
+    participant_id INT NOT NULL,
+    sequence_id INT NOT NULL,
+    trial_index INT NOT NULL,
+    best_stimulus INT NULL,
+    worst_stimulus INT NULL,
+    submitted_at DATETIME NOT NULL,
+    PRIMARY KEY (id, sequence_id),
+    INDEX idx_trial_results_archive_participant_sequence (participant_id, sequence_id, trial_index)
+) ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8
+  PARTITION BY KEY (sequence_id) PARTITIONS 16;
+
+CREATE TABLE IF NOT EXISTS final_scores_archive (
+    id INT NOT NULL,
+    participant_id INT NULL,
+    sequence_id INT NOT NULL,
+    resource_id INT NOT NULL,
+    final_score FLOAT NOT NULL,
+    rank_position INT NOT NULL,
+    computed_at DATETIME NOT NULL,
+    ci_lower FLOAT NULL,
+    ci_upper FLOAT NULL,
+    ci_method VARCHAR(64) NULL,
+    PRIMARY KEY (id, sequence_id)
+) ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8
+  PARTITION BY KEY (sequence_id) PARTITIONS 16;
+
+-- Unified reads over active and archived studies (studies archived to Parquet
+-- are read from files, see archive_study.read_results)
+CREATE OR REPLACE VIEW trial_results_all AS
+SELECT id, participant_id, sequence_id, trial_index, best_stimulus, worst_stimulus, submitted_at
+FROM trial_results
+UNION ALL
+SELECT id, participant_id, sequence_id, trial_index, best_stimulus, worst_stimulus, submitted_at
+FROM trial_results_archive;
+
+CREATE OR REPLACE VIEW final_scores_all AS
+SELECT id, participant_id, sequence_id, resource_id, final_score, rank_position, computed_at,
+       ci_lower, ci_upper, ci_method
+FROM final_scores
+UNION ALL
+SELECT id, participant_id, sequence_id, resource_id, final_score, rank_position, computed_at,
+       ci_lower, ci_upper, ci_method
+FROM final_scores_archive;
+
+-- trial_choice_sets over active and table-archived studies
+CREATE OR REPLACE VIEW trial_choice_sets_all AS
+SELECT * FROM trial_choice_sets
+UNION ALL
+SELECT
+    tr.id AS trial_result_id,
+    tr.participant_id,
+    tr.sequence_id,
+    tr.trial_index,
+    tr.best_stimulus,
+    tr.worst_stimulus,
+    tr.submitted_at,
+    s.stimuli_id,
+    s.index_order
+FROM trial_results_archive tr
+JOIN sequences s ON s.sequence_id = tr.sequence_id AND s.trial = tr.trial_index
+UNION ALL
+SELECT
+    tr.id AS trial_result_id,
+    tr.participant_id,
+    tr.sequence_id,
+    tr.trial_index,
+    tr.best_stimulus,
+    tr.worst_stimulus,
+    tr.submitted_at,
+    a.stimuli_id,
+    a.index_order
+FROM trial_results_archive tr
+JOIN adaptive_trials a
+    ON a.sequence_id = tr.sequence_id
+    AND a.participant_id = tr.participant_id
+    AND a.trial_index = tr.trial_index;
@@ -0,0 +1,312 @@
+import argparse
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from database_utils import DBManager
+from export_parquet import EXPORT_TABLES, chunk_to_arrow
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Archival of completed studies
+################################################################################
+# trial_results and final_scores only ever grow. Completed studies (no new
+# submissions for --min-idle-days) are moved out of the hot tables, either
+#
+#   --to table     into trial_results_archive / final_scores_archive
+#                  (compressed, partitioned by sequence_id, see db.sql), or
+#   --to parquet   into <dir>/<table>/sequence_id=<id>/date=<day>/*.parquet
+#                  (same layout as export_parquet.py)
+#
+# in one transaction per study, and sequence_info.archived_at/archive_location
+# record where they went. The backend and the live scores only ever query the
+# hot tables; read_results() reads a study wherever it lives.
+
+ARCHIVED_TABLES = {
+    "trial_results": [
+        "id", "participant_id", "sequence_id", "trial_index",
+        "best_stimulus", "worst_stimulus", "submitted_at",
+    ],
+    "final_scores": [
+        "id", "participant_id", "sequence_id", "resource_id", "final_score",
+        "rank_position", "computed_at", "ci_lower", "ci_upper", "ci_method",
+    ],
+}
+
+
+def study_status(db_manager, sequence_id):
+    """
+    Row counts in the hot tables, last submission time and archive state of a study.
+
+    Returns:
+        dict, or None if the sequence does not exist.
+    """
+    df_info = db_manager.read_query(
+        "SELECT archived_at, archive_location FROM sequence_info WHERE sequence_id = :sequence_id",
+        params={"sequence_id": sequence_id}, use_primary=True,
+    )
+    if df_info.empty:
+        return None
+    df_results = db_manager.read_query(
+        "SELECT COUNT(*) AS n_rows, MAX(submitted_at) AS last_submitted_at "
+        "FROM trial_results WHERE sequence_id = :sequence_id",
+        params={"sequence_id": sequence_id}, use_primary=True,
+    )
+    df_scores = db_manager.read_query(
+        "SELECT COUNT(*) AS n_rows FROM final_scores WHERE sequence_id = :sequence_id",
+        params={"sequence_id": sequence_id}, use_primary=True,
+    )
+    last = df_results.iloc[0]["last_submitted_at"]
+    archived_at = df_info.iloc[0]["archived_at"]
+    return {
+        "trial_results": int(df_results.iloc[0]["n_rows"]),
+        "final_scores": int(df_scores.iloc[0]["n_rows"]),
+        "last_submitted_at": None if pd.isna(last) else pd.Timestamp(last).to_pydatetime(),
+        "archived_at": None if pd.isna(archived_at) else archived_at,
+        "archive_location": df_info.iloc[0]["archive_location"],
+    }
+
+
+def _max_ids(db_manager, sequence_id):
+    """
+    Highest id of the study in each hot table (0 if none). Only rows up to
+    these ids are archived and deleted, so rows committed meanwhile stay hot.
+    """
+    max_ids = {}
+    for table in ARCHIVED_TABLES:
+        df = db_manager.read_query(
+            f"SELECT MAX(id) AS max_id FROM {table} WHERE sequence_id = :sequence_id",
+            params={"sequence_id": sequence_id}, use_primary=True,
+        )
+        max_id = df.iloc[0]["max_id"]
+        max_ids[table] = 0 if pd.isna(max_id) else int(max_id)
+    return max_ids
+
+
+def _move_out_statements(sequence_id, location, max_ids):
+    """Delete the archived rows from the hot tables and record where they went."""
+    statements = [
+        (f"DELETE FROM {table} WHERE sequence_id = :sequence_id AND id <= :max_id",
+         {"sequence_id": sequence_id, "max_id": max_ids[table]})
+        for table in ARCHIVED_TABLES
+    ]
+    statements.append((
+        "UPDATE sequence_info SET archived_at = :archived_at, archive_location = :location "
+        "WHERE sequence_id = :sequence_id",
+        {"sequence_id": sequence_id, "archived_at": datetime.now(), "location": location},
+    ))
+    return statements
+
+
+def archive_to_table(db_manager, sequence_id):
+    """
+    Copy the study into the archive tables and delete it from the hot tables,
+    in one transaction.
+
+    Returns:
+        dict: Rows moved per table.
+    """
+    max_ids = _max_ids(db_manager, sequence_id)
+    statements = []
+    for table, columns in ARCHIVED_TABLES.items():
+        col_str = ", ".join(columns)
+        statements.append((
+            f"INSERT INTO {table}_archive ({col_str}) "
+            f"SELECT {col_str} FROM {table} WHERE sequence_id = :sequence_id AND id <= :max_id",
+            {"sequence_id": sequence_id, "max_id": max_ids[table]},
+        ))
+    counts = db_manager.execute_transaction(statements + _move_out_statements(sequence_id, "table", max_ids))
+    return dict(zip(ARCHIVED_TABLES, counts))
+
+
+def _publish_staged(staging_dir, dataset_dir):
+    """Move staged Parquet files into the dataset, next to any existing ones."""
+    for root, _, files in os.walk(staging_dir):
+        target_dir = os.path.join(dataset_dir, os.path.relpath(root, staging_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in files:
+            os.replace(os.path.join(root, name), os.path.join(target_dir, name))
+
+
+def archive_to_parquet(db_manager, sequence_id, parquet_dir, chunksize=100000):
+    """
+    Write the study to a staging directory, check the files read back
+    complete, move them into the Parquet archive (existing files of the study
+    are kept), then delete the archived rows from the hot tables (one
+    transaction). Rows already in the archive, e.g. from a run interrupted
+    before its delete, are not written twice.
+
+    Returns:
+        dict: Rows moved per table.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    staging_root = os.path.join(parquet_dir, f"_staging-{sequence_id}-{run_id}")
+    max_ids = _max_ids(db_manager, sequence_id)
+    counts = {}
+    try:
+        for table in ARCHIVED_TABLES:
+            spec = EXPORT_TABLES[table]
+            staging_dir = os.path.join(staging_root, table)
+            archived_ids = set(_read_parquet(parquet_dir, table, [sequence_id], ["id"])["id"].tolist())
+
+            n_rows = 0
+            n_written = 0
+            query = (f"SELECT * FROM {table} WHERE sequence_id = :sequence_id AND id <= :max_id ORDER BY id")
+            params = {"sequence_id": sequence_id, "max_id": max_ids[table]}
+            chunks = db_manager.read_query_chunks(query, params, chunksize, use_primary=True)
+            for chunk_no, df in enumerate(chunks):
+                n_rows += len(df)
+                df = df[~df["id"].isin(archived_ids)]
+                if df.empty:
+                    continue
+                pq.write_to_dataset(
+                    chunk_to_arrow(df, spec),
+                    root_path=staging_dir,
+                    partition_cols=spec["partition_cols"],
+                    basename_template=f"archive-{sequence_id}-{run_id}-{chunk_no:05d}-{{i}}.parquet",
+                    compression="zstd",
+                )
+                n_written += len(df)
+
+            staged = _read_parquet(staging_root, table, [sequence_id], ["id"])
+            if len(staged) != n_written:
+                raise RuntimeError(
+                    f"{table}: wrote {n_written} rows for sequence {sequence_id} but read back {len(staged)}; "
+                    f"hot rows left in place."
+                )
+            counts[table] = n_rows
+
+        for table in ARCHIVED_TABLES:
+            _publish_staged(os.path.join(staging_root, table), os.path.join(parquet_dir, table))
+    finally:
+        shutil.rmtree(staging_root, ignore_errors=True)
+
+    db_manager.execute_transaction(_move_out_statements(sequence_id, os.path.abspath(parquet_dir), max_ids))
+    return counts
+
+
+def archive_study(db_manager, sequence_id, to="table", parquet_dir=None, min_idle_days=7, force=False):
+    """
+    Archive one study if it is complete (no submission for `min_idle_days`).
+
+    Returns:
+        dict: Rows moved per table, or None if the study was skipped.
+    """
+    status = study_status(db_manager, sequence_id)
+    if status is None:
+        logger.warning(f"sequence_id={sequence_id} does not exist, skipped.")
+        return None
+    if status["archived_at"] is not None:
+        if not (status["trial_results"] or status["final_scores"]):
+            logger.info(f"sequence_id={sequence_id} already archived ({status['archive_location']}), skipped.")
+            return None
+        # New rows after archiving: they may only join the existing archive,
+        # otherwise read_results() would lose track of one of the two places
+        location = "table" if to == "table" else os.path.abspath(parquet_dir)
+        if status["archive_location"] != location:
+            logger.warning(f"sequence_id={sequence_id} is archived in {status['archive_location']}; "
+                           f"not archiving its new rows to {location}.")
+            return None
+    last = status["last_submitted_at"]
+    if not force and last is not None and last > datetime.now() - timedelta(days=min_idle_days):
+        logger.warning(f"sequence_id={sequence_id} had submissions on {last:%Y-%m-%d %H:%M}; "
+                       f"not archived (use --force).")
+        return None
+
+    started = time.perf_counter()
+    if to == "parquet":
+        counts = archive_to_parquet(db_manager, sequence_id, parquet_dir)
+    else:
+        counts = archive_to_table(db_manager, sequence_id)
+    logger.info(f"sequence_id={sequence_id}: archived {counts} to {to} in {time.perf_counter() - started:.1f}s")
+    return counts
+
+
+################################################################################
+# Unified read API
+################################################################################
+def _read_parquet(parquet_dir, table, sequence_ids=None, columns=None):
+    dataset_dir = os.path.join(parquet_dir, table)
+    if not os.path.isdir(dataset_dir):
+        return pd.DataFrame(columns=columns or ARCHIVED_TABLES[table])
+    dataset = ds.dataset(dataset_dir, format="parquet", partitioning="hive")
+    filter_expr = None if sequence_ids is None else ds.field("sequence_id").isin(list(sequence_ids))
+    df = dataset.to_table(columns=columns or ARCHIVED_TABLES[table], filter=filter_expr).to_pandas()
+    for name in df.columns:
+        if isinstance(df[name].dtype, pd.CategoricalDtype):  # dictionary-encoded strings
+            df[name] = df[name].astype(object)
+    return df
+
+
+def read_results(db_manager, table, sequence_ids=None, parquet_dir=None, columns=None):
+    """
+    Read `table` ("trial_results" or "final_scores") for the given studies,
+    wherever they live: hot table, archive table, or the Parquet archive.
+
+    Parameters:
+        db_manager (DBManager): Connected database manager.
+        table (str): "trial_results" or "final_scores".
+        sequence_ids (list of int, optional): Studies to read (default: all).
+        parquet_dir (str, optional): Root of the Parquet archive to include.
+        columns (list of str, optional): Columns to return (default: all).
+
+    Returns:
+        pd.DataFrame: Rows ordered by id.
+    """
+    columns = columns or ARCHIVED_TABLES[table]
+    query = f"SELECT {', '.join(columns)} FROM {table}_all"
+    params = {}
+    if sequence_ids is not None:
+        names = [f"s{i}" for i in range(len(sequence_ids))]
+        query += f" WHERE sequence_id IN ({', '.join(':' + n for n in names)})" if names else " WHERE 1 = 0"
+        params = {n: int(v) for n, v in zip(names, sequence_ids)}
+    frames = [db_manager.read_query(query, params=params)]
+    if parquet_dir:
+        frames.append(_read_parquet(parquet_dir, table, sequence_ids, columns))
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True).sort_values("id", kind="stable").reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move completed studies out of the hot result tables.")
+    parser.add_argument("sequence_ids", type=int, nargs="+")
+    parser.add_argument("--to", choices=["table", "parquet"], default="table",
+                        help="Archive tables in MySQL (default) or Parquet files.")
+    parser.add_argument("--parquet-dir", default=None, help="Root of the Parquet archive (--to parquet).")
+    parser.add_argument("--min-idle-days", type=float, default=7,
+                        help="Only archive studies without submissions for this many days.")
+    parser.add_argument("--force", action="store_true", help="Archive even if the study is still active.")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the status of each study.")
+    args = parser.parse_args()
+
+    if args.to == "parquet" and not args.parquet_dir:
+        parser.error("--to parquet needs --parquet-dir")
+
+    db_manager = DBManager()
+    try:
+        db_manager.connect()
+        for sequence_id in args.sequence_ids:
+            if args.dry_run:
+                print(f"sequence_id={sequence_id}: {study_status(db_manager, sequence_id)}")
+                continue
+            counts = archive_study(db_manager, sequence_id, args.to, args.parquet_dir,
+                                   args.min_idle_days, args.force)
+            if counts is not None:
+                print(f"sequence_id={sequence_id}: moved {counts}")
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,176 @@
+import io
+import logging
+import queue
+import threading
+import time
+import urllib.request
+import wave
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Preloaded, decoded audio for the desktop client
+################################################################################
+# The experiment client must start a stimulus the moment Play is clicked, so
+# the WAV files of the current and the next trial are read (local file or
+# http(s) URL) and decoded to raw PCM on a background thread ahead of time.
+# Decoded clips live in an LRU bounded by their total PCM size.
+#
+# get() runs on the UI thread, so it never loads anything itself: it returns
+# a cached clip at once, waits at most DEFAULT_WAIT for a load already in
+# flight, and otherwise returns None (the caller streams the file instead)
+# after queueing it for the preloader. Failed loads (unreachable, not a WAV
+# file) are remembered for DEFAULT_FAILURE_TTL seconds and not retried
+# before that.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_WAIT = 0.05          # seconds get() waits for a load in flight
+DEFAULT_FAILURE_TTL = 300.0  # seconds a failed path is not loaded again
+
+
+class AudioClip:
+    """Decoded PCM samples and their format (as read from the WAV header)."""
+    __slots__ = ("pcm", "channels", "sample_width", "sample_rate")
+
+    def __init__(self, pcm, channels, sample_width, sample_rate):
+        self.pcm = pcm
+        self.channels = channels
+        self.sample_width = sample_width
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self):
+        return len(self.pcm) / (self.channels * self.sample_width * self.sample_rate)
+
+
+def read_source(path):
+    """Raw bytes of a local file or an http(s) URL."""
+    if path.startswith(("http://", "https://")):
+        with urllib.request.urlopen(path, timeout=30) as response:
+            return response.read()
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def decode_wav(data):
+    """
+    Decode WAV bytes into an AudioClip.
+
+    Raises:
+        wave.Error, EOFError: If the data is not an uncompressed PCM WAV file.
+    """
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        return AudioClip(
+            wav.readframes(wav.getnframes()),
+            wav.getnchannels(),
+            wav.getsampwidth(),
+            wav.getframerate(),
+        )
+
+
+class AudioCache:
+    """
+    Thread-safe LRU of path -> AudioClip with a background preloader.
+
+    Parameters:
+        max_bytes (int): Budget for the decoded PCM kept in memory.
+        loader (callable, optional): path -> AudioClip (default: read and decode a WAV).
+        failure_ttl (float): Seconds a path that failed to load is not tried again.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, loader=None, failure_ttl=DEFAULT_FAILURE_TTL):
+        self.max_bytes = max_bytes
+        self.loader = loader or (lambda path: decode_wav(read_source(path)))
+        self.failure_ttl = failure_ttl
+        self._clips = OrderedDict()
+        self._bytes = 0
+        self._in_flight = {}  # path -> threading.Event, set once the load finished
+        self._failed = {}     # path -> time.monotonic() of the failed load
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="audio-preloader", daemon=True)
+        self._thread.start()
+
+    def prefetch(self, paths):
+        """Queue `paths` for background loading, in order (already cached ones are skipped)."""
+        for path in paths:
+            self._queue.put(path)
+
+    def get(self, path, timeout=DEFAULT_WAIT):
+        """
+        Decoded clip of `path`, or None if it is not ready within `timeout`
+        seconds or failed to load recently. A path that is neither cached nor
+        loading is queued for the preloader.
+        """
+        with self._lock:
+            clip = self._cached(path)
+            if clip is not None or self._recently_failed(path):
+                return clip
+            event = self._in_flight.get(path)
+        if event is None:
+            self._queue.put(path)
+            return None
+        event.wait(timeout)
+        with self._lock:
+            return self._cached(path)
+
+    def close(self):
+        self._queue.put(None)
+
+    def _cached(self, path):
+        clip = self._clips.get(path)
+        if clip is not None:
+            self._clips.move_to_end(path)
+        return clip
+
+    def _recently_failed(self, path):
+        failed_at = self._failed.get(path)
+        if failed_at is None:
+            return False
+        if time.monotonic() - failed_at < self.failure_ttl:
+            return True
+        del self._failed[path]
+        return False
+
+    def _load(self, path):
+        """Load `path` into the cache (preloader thread)."""
+        with self._lock:
+            if path in self._clips or path in self._in_flight or self._recently_failed(path):
+                return
+            self._in_flight[path] = event = threading.Event()
+        try:
+            clip = self.loader(path)
+        except Exception:
+            with self._lock:
+                self._failed[path] = time.monotonic()
+            raise
+        else:
+            with self._lock:
+                self._store(path, clip)
+        finally:
+            with self._lock:
+                self._in_flight.pop(path, None)
+            event.set()
+
+    def _store(self, path, clip):
+        size = len(clip.pcm)
+        if size > self.max_bytes:
+            return  # never cache a clip that would evict everything else
+        old = self._clips.pop(path, None)
+        if old is not None:
+            self._bytes -= len(old.pcm)
+        self._clips[path] = clip
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._clips.popitem(last=False)
+            self._bytes -= len(evicted.pcm)
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            try:
+                self._load(path)
+            except Exception as e:
+                logger.warning(f"Could not preload {path}: {e}")
@@ -0,0 +1,186 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy.stats import norm
+
+from database_utils import DBManager
+from maxdiff import ChoiceData, fit_maxdiff, load_choice_data, rank_scores
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Bootstrap / jackknife confidence intervals for MaxDiff scores
+################################################################################
+# Every resample is a weighted refit of the same data: resampling trials or
+# participants only changes the weight of each choice set, so the choice arrays
+# are put into shared memory once and every worker process attaches to them
+# without copying. Each refit is warm-started from the full-data estimate.
+
+_worker_data = None
+_worker_shm = []
+
+
+def _share_arrays(arrays):
+    """Copy arrays into shared memory; return (specs, segments)."""
+    specs, segments = {}, []
+    for name, arr in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        specs[name] = (shm.name, arr.shape, arr.dtype.str)
+        segments.append(shm)
+    return specs, segments
+
+
+def _attach(specs):
+    """Worker initializer: attach to the shared arrays once per process."""
+    global _worker_data, _worker_shm
+    arrays = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _worker_shm.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _worker_data = ChoiceData(**arrays)
+
+
+def _resample_weights(data, unit, rng):
+    if unit == "participant":
+        counts = rng.multinomial(data.n_participants, np.full(data.n_participants, 1.0 / data.n_participants))
+        return counts[data.participant].astype(np.float64)
+    return rng.multinomial(data.n_sets, np.full(data.n_sets, 1.0 / data.n_sets)).astype(np.float64)
+
+
+def _bootstrap_chunk(seed, n_resamples, unit, init, ridge):
+    data = _worker_data
+    rng = np.random.default_rng(seed)
+    out = np.empty((n_resamples, data.n_items))
+    for i in range(n_resamples):
+        weights = _resample_weights(data, unit, rng)
+        out[i] = fit_maxdiff(data, weights=weights, init=init, ridge=ridge)
+    return out
+
+
+def _jackknife_chunk(groups, unit, init, ridge):
+    data = _worker_data
+    group_of_set = data.participant if unit == "participant" else np.arange(data.n_sets)
+    out = np.empty((len(groups), data.n_items))
+    for i, g in enumerate(groups):
+        weights = (group_of_set != g).astype(np.float64)
+        out[i] = fit_maxdiff(data, weights=weights, init=init, ridge=ridge)
+    return out
+
+
+def confidence_intervals(data, method="bootstrap", unit="trial", n_resamples=2000,
+                         level=0.95, workers=None, ridge=1e-3, seed=None):
+    """
+    Fit MaxDiff scores and compute per-resource confidence intervals.
+
+    Parameters:
+        data (ChoiceData): Answered trials.
+        method (str): "bootstrap" (percentile intervals) or "jackknife" (normal intervals).
+        unit (str): Resample "trial"s or whole "participant"s.
+        n_resamples (int): Number of bootstrap resamples (ignored for jackknife).
+        level (float): Confidence level.
+        workers (int, optional): Worker processes. Defaults to os.cpu_count().
+        ridge (float): L2 penalty passed to fit_maxdiff.
+        seed (int, optional): Seed for reproducible resampling.
+
+    Returns:
+        pd.DataFrame: resource_id, final_score, rank_position, ci_lower, ci_upper.
+    """
+    estimate = fit_maxdiff(data, ridge=ridge)
+    workers = workers or os.cpu_count() or 1
+
+    specs, segments = _share_arrays(data.arrays())
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(specs,)) as pool:
+            if method == "jackknife":
+                n_groups = data.n_participants if unit == "participant" else data.n_sets
+                chunks = np.array_split(np.arange(n_groups), workers)
+                futures = [
+                    pool.submit(_jackknife_chunk, chunk, unit, estimate, ridge)
+                    for chunk in chunks if len(chunk)
+                ]
+            else:
+                seeds = np.random.SeedSequence(seed).spawn(workers)
+                sizes = [len(c) for c in np.array_split(np.arange(n_resamples), workers)]
+                futures = [
+                    pool.submit(_bootstrap_chunk, s, size, unit, estimate, ridge)
+                    for s, size in zip(seeds, sizes) if size
+                ]
+            replicates = np.vstack([f.result() for f in futures])
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+
+    if method == "jackknife":
+        n = len(replicates)
+        se = np.sqrt((n - 1) / n * ((replicates - replicates.mean(axis=0)) ** 2).sum(axis=0))
+        z = norm.ppf(0.5 + level / 2)
+        lower, upper = estimate - z * se, estimate + z * se
+    else:
+        tail = 100 * (1 - level) / 2
+        lower, upper = np.percentile(replicates, [tail, 100 - tail], axis=0)
+
+    df_scores = rank_scores(data.resource_ids, estimate)
+    order = np.argsort(-estimate, kind="stable")
+    df_scores["ci_lower"] = lower[order]
+    df_scores["ci_upper"] = upper[order]
+    return df_scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MaxDiff scores with bootstrap/jackknife confidence intervals.")
+    parser.add_argument("sequence_id", type=int)
+    parser.add_argument("--participant-id", type=int, default=None,
+                        help="Score one participant (default: all participants pooled).")
+    parser.add_argument("--method", choices=["bootstrap", "jackknife"], default="bootstrap")
+    parser.add_argument("--unit", choices=["trial", "participant"], default=None,
+                        help="Resampling unit (default: participant when pooled, trial otherwise).")
+    parser.add_argument("--n-resamples", type=int, default=2000)
+    parser.add_argument("--level", type=float, default=0.95)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--save", action="store_true", help="Append the scores to final_scores.")
+    parser.add_argument("--output", default=None, help="Also write the scores to this CSV file.")
+    args = parser.parse_args()
+
+    unit = args.unit or ("trial" if args.participant_id is not None else "participant")
+
+    db_manager = DBManager()
+    try:
+        db_manager.connect()
+        data = load_choice_data(db_manager, args.sequence_id, args.participant_id)
+        if data.n_sets == 0:
+            print(f"No answered trials found for sequence_id={args.sequence_id}")
+            return
+
+        logger.info(f"{data.n_sets} trials, {data.n_items} resources, {data.n_participants} participants")
+        df_scores = confidence_intervals(
+            data, method=args.method, unit=unit, n_resamples=args.n_resamples,
+            level=args.level, workers=args.workers, seed=args.seed,
+        )
+        print(df_scores.to_string(index=False))
+
+        if args.output:
+            df_scores.to_csv(args.output, index=False)
+
+        if args.save:
+            # participant_id NULL = pooled over all participants of the sequence
+            df_scores.insert(0, "participant_id", args.participant_id)
+            df_scores.insert(1, "sequence_id", args.sequence_id)
+            df_scores["ci_method"] = f"{args.method}-{unit}-{args.level:g}"
+            df_scores["computed_at"] = datetime.now()
+            db_manager.append_table("final_scores", df_scores)
+            print("\nScores appended to 'final_scores'.")
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
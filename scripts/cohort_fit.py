@@ -0,0 +1,246 @@
+import argparse
+import logging
+import time
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+
+from database_utils import DBManager
+from maxdiff import _segment_log_softmax, fit_maxdiff, load_choice_data, rank_scores
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Cohort-level MaxDiff fit over all participants of a sequence or folder
+################################################################################
+# Pooled model:           u[a] = beta[item(a)]
+# With random effects:    u[a] = beta[item(a)] + b[participant(a), item(a)]
+#
+# The random-effect columns only exist for (participant, item) pairs that were
+# actually shown, so the CSR design has at most two non-zeros per alternative
+# and memory grows with the number of responses, not participants x stimuli.
+# The b's get a Gaussian prior N(0, tau^2). tau^2 is estimated by EM-style
+# rounds: refit at the current tau, then tau^2 = mean(b_hat^2 + Var(b | data)),
+# with the posterior variances from the Laplace approximation (the inverse
+# Hessian of the penalised fit). Without the variance term the shrunken b_hat
+# would drive tau towards zero round by round.
+#
+# Only the mean variance is needed, i.e. trace(H^-1) / n_pairs. It is
+# estimated Hutchinson-style, trace(H^-1) ~ mean(z' H^-1 z) over random +-1
+# probes z, with the solves done by conjugate gradients on the sparse Hessian.
+# H = (choice information) + I / tau^2 has its eigenvalues in
+# [1 / tau^2, 2 + 1 / tau^2], so CG converges in a few dozen sparse products
+# no matter how many participants or stimuli there are.
+
+DEFAULT_RIDGE = 1e-3
+DEFAULT_SHRINKAGE_ROUNDS = 10
+DEFAULT_TRACE_PROBES = 32
+
+
+def random_effects_design(data):
+    """
+    CSR design [item one-hot | (participant, item) one-hot] and the pair index
+    of every random-effect column.
+
+    Returns:
+        (scipy.sparse.csr_matrix, np.ndarray, np.ndarray): design matrix, and
+        participant / item index of each random-effect column.
+    """
+    n_alts = len(data.items)
+    participant_of_alt = data.participant[data.set_of_alt].astype(np.int64)
+    pair_key = participant_of_alt * data.n_items + data.items
+    pairs, pair_col = np.unique(pair_key, return_inverse=True)
+
+    indices = np.empty(2 * n_alts, dtype=np.int64)
+    indices[0::2] = data.items
+    indices[1::2] = data.n_items + pair_col
+    design = sparse.csr_matrix(
+        (np.ones(2 * n_alts), indices, np.arange(0, 2 * n_alts + 1, 2)),
+        shape=(n_alts, data.n_items + len(pairs)),
+    )
+    return design, pairs // data.n_items, pairs % data.n_items
+
+
+def _solve_cg(matrix, rhs, tol=1e-6, max_iter=200):
+    """
+    Jacobi-preconditioned conjugate gradients for a symmetric positive
+    definite sparse `matrix`, one system per column of `rhs`.
+
+    Returns:
+        np.ndarray: Solution, same shape as `rhs`.
+    """
+    tiny = np.finfo(float).tiny
+    inv_diag = 1.0 / matrix.diagonal()[:, None]
+    x = np.zeros_like(rhs)
+    r = rhs.copy()
+    z = inv_diag * r
+    p = z.copy()
+    rz = np.einsum("ij,ij->j", r, z)
+    stop = tol * np.linalg.norm(rhs, axis=0)
+    for _ in range(max_iter):
+        hp = matrix @ p
+        alpha = rz / np.maximum(np.einsum("ij,ij->j", p, hp), tiny)
+        x += alpha * p
+        r -= alpha * hp
+        if np.all(np.linalg.norm(r, axis=0) <= stop):
+            break
+        z = inv_diag * r
+        rz_new = np.einsum("ij,ij->j", r, z)
+        p = z + (rz_new / np.maximum(rz, tiny)) * p
+        rz = rz_new
+    return x
+
+
+def mean_deviation_posterior_variance(data, design, theta, n_pairs, tau, n_probes=DEFAULT_TRACE_PROBES,
+                                      seed=0):
+    """
+    Laplace-approximation posterior variance of the random-effect columns,
+    averaged: trace(H^-1) / n_pairs for the penalised negative
+    log-likelihood's Hessian in the deviation block (the coupling through the
+    population utilities is ignored), estimated with `n_probes` probes.
+
+    Returns:
+        float: Mean variance per random-effect column.
+    """
+    u = design @ theta
+    p_best = np.exp(_segment_log_softmax(u, data))
+    v = -u
+    v[data.best_pos] = -np.inf
+    p_worst = np.exp(_segment_log_softmax(v, data))
+    pair_col = design.indices[1::2] - data.n_items  # second non-zero of each row
+
+    # Each set adds diag(p) - p p' for the best and the worst pick
+    rows, cols, vals = [], [], []
+    for size in np.unique(data.sizes):
+        alts = data.offsets[:-1][data.sizes == size][:, None] + np.arange(size)
+        p, q, c = p_best[alts], p_worst[alts], pair_col[alts]
+        block = -(p[:, :, None] * p[:, None, :] + q[:, :, None] * q[:, None, :])
+        block[:, np.arange(size), np.arange(size)] += p + q
+        rows.append(np.broadcast_to(c[:, :, None], block.shape).ravel())
+        cols.append(np.broadcast_to(c[:, None, :], block.shape).ravel())
+        vals.append(block.ravel())
+    hessian = sparse.coo_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(n_pairs, n_pairs)
+    ).tocsr() + sparse.identity(n_pairs, format="csr") / tau ** 2
+
+    # Fixed seed: the same data gives the same tau
+    probes = np.random.default_rng(seed).choice([-1.0, 1.0], size=(n_pairs, n_probes))
+    solved = _solve_cg(hessian, probes)
+    return float(np.mean(np.einsum("ij,ij->j", probes, solved))) / n_pairs
+
+
+def fit_cohort(data, random_effects=False, tau=None, ridge=DEFAULT_RIDGE,
+               shrinkage_rounds=DEFAULT_SHRINKAGE_ROUNDS):
+    """
+    Fit population utilities over every participant in `data`.
+
+    Parameters:
+        data (ChoiceData): Answered trials of the cohort.
+        random_effects (bool): Add per-participant deviations with shrinkage.
+        tau (float, optional): Prior SD of the deviations. Estimated from the
+            data (shrinkage_rounds refits) when not given; 0 pins every
+            deviation to zero (the pooled fit).
+        ridge (float): L2 penalty on the population utilities.
+        shrinkage_rounds (int): Refits used to estimate tau.
+
+    Returns:
+        dict: "scores" (population utilities, mean zero), "heterogeneity"
+        (per-item SD of participant deviations, or None) and "tau".
+    """
+    if tau is not None and tau < 0:
+        raise ValueError(f"tau must be >= 0, got {tau}")
+    beta = fit_maxdiff(data, ridge=ridge)
+    if not random_effects:
+        return {"scores": beta, "heterogeneity": None, "tau": None}
+    if tau == 0:
+        return {"scores": beta - beta.mean(), "heterogeneity": np.zeros(data.n_items), "tau": 0.0}
+
+    design, _, pair_item = random_effects_design(data)
+    n_pairs = len(pair_item)
+    theta = np.r_[beta, np.zeros(n_pairs)]
+
+    estimate_tau = tau is None
+    tau = tau if tau is not None else 1.0
+    for round_no in range(shrinkage_rounds if estimate_tau else 1):
+        penalty = np.r_[np.full(data.n_items, ridge), np.full(n_pairs, 1.0 / tau ** 2)]
+        theta = fit_maxdiff(data, init=theta, ridge=penalty, design=design)
+        deviations = theta[data.n_items:]
+        if estimate_tau:
+            variance = mean_deviation_posterior_variance(data, design, theta, n_pairs, tau)
+            new_tau = max(float(np.sqrt(np.mean(deviations ** 2) + variance)), 1e-3)
+            logger.info(f"Shrinkage round {round_no + 1}: tau={new_tau:.4f}")
+            converged = abs(new_tau - tau) < 1e-3 * tau
+            tau = new_tau
+            if converged:
+                break
+
+    scores = theta[:data.n_items]
+    scores = scores - scores.mean()
+    deviations = theta[data.n_items:]
+    counts = np.bincount(pair_item, minlength=data.n_items)
+    sq_sums = np.bincount(pair_item, weights=deviations ** 2, minlength=data.n_items)
+    heterogeneity = np.sqrt(sq_sums / np.maximum(counts, 1))
+    return {"scores": scores, "heterogeneity": heterogeneity, "tau": tau}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pooled MaxDiff fit over all participants.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--sequence-id", type=int)
+    group.add_argument("--folder-path", help="Pool every sequence with this sequence_info.folder_path.")
+    parser.add_argument("--random-effects", action="store_true",
+                        help="Add per-participant deviations with hierarchical shrinkage.")
+    parser.add_argument("--tau", type=float, default=None,
+                        help="Prior SD of the participant deviations (default: estimated).")
+    parser.add_argument("--include-archive", action="store_true",
+                        help="Also pool studies moved to the archive tables.")
+    parser.add_argument("--save", action="store_true",
+                        help="Append the population ranking to final_scores (requires --sequence-id).")
+    parser.add_argument("--output", default=None, help="Also write the ranking to this CSV file.")
+    args = parser.parse_args()
+
+    db_manager = DBManager()
+    try:
+        db_manager.connect()
+        started = time.perf_counter()
+        data = load_choice_data(db_manager, sequence_id=args.sequence_id, folder_path=args.folder_path,
+                                include_archive=args.include_archive)
+        if data.n_sets == 0:
+            print("No answered trials found.")
+            return
+        logger.info(
+            f"Loaded {data.n_sets} trials, {data.n_items} resources, {data.n_participants} participants "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+        started = time.perf_counter()
+        result = fit_cohort(data, random_effects=args.random_effects, tau=args.tau)
+        logger.info(f"Fitted in {time.perf_counter() - started:.1f}s")
+
+        df_scores = rank_scores(data.resource_ids, result["scores"])
+        if result["heterogeneity"] is not None:
+            order = np.argsort(-result["scores"], kind="stable")
+            df_scores["heterogeneity"] = result["heterogeneity"][order]
+            print(f"tau = {result['tau']:.4f}")
+        print(df_scores.to_string(index=False))
+
+        if args.output:
+            df_scores.to_csv(args.output, index=False)
+
+        if args.save:
+            if args.sequence_id is None:
+                print("\n--save needs --sequence-id (final_scores rows belong to one sequence).")
+                return
+            df_save = df_scores[["resource_id", "final_score", "rank_position"]].copy()
+            df_save.insert(0, "participant_id", None)  # NULL = pooled over participants
+            df_save.insert(1, "sequence_id", args.sequence_id)
+            df_save["computed_at"] = datetime.now()
+            db_manager.append_table("final_scores", df_save)
+            print("\nPopulation ranking appended to 'final_scores'.")
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import argparse
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.linalg import eigh_tridiagonal
+from scipy.sparse.csgraph import connected_components
+
+from database_utils import DBManager
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Design-efficiency evaluation of a generated sequence
+################################################################################
+# Reads the choice sets of a sequence (or takes them in memory, as produced by
+# create_sets_of_stimuli) and reports:
+#
+#   frequency   how often each stimulus is shown (min/max/CV)
+#   position    how often each stimulus sits at each index_order (chi-square
+#               against "equally often at every position")
+#   pairs       sparse pair co-occurrence counts (coverage, max repeats)
+#   components  connected components of the co-occurrence graph; stimuli in
+#               different components can never be compared with each other
+#   D-eff       D-efficiency of the MaxDiff (best-worst pair) model
+#
+# At zero utilities, one set of size k contributes 2/(k(k-1)) * L_S to the
+# information matrix, L_S being the Laplacian of the complete graph on the set.
+# The information of the whole design is therefore c * L with L the Laplacian
+# of the co-occurrence graph. Utilities are identified up to a constant, so
+# the D-criterion uses the n-1 non-zero eigenvalues, i.e. logdet(L + 11'/n).
+# D-efficiency is their geometric mean divided by their arithmetic mean (the
+# best achievable for the same number of sets; 1.0 for a balanced incomplete
+# block design). logdet is exact (dense slogdet) up to DENSE_MAX_ITEMS and
+# estimated by stochastic Lanczos quadrature above, so 10k-stimulus designs
+# take seconds.
+#
+# Exit code 0 = all gates passed, 1 = a gate failed, 2 = sequence not found.
+
+DENSE_MAX_ITEMS = 2000
+SLQ_PROBES = 32
+SLQ_STEPS = 40
+
+# Defaults that create_sets_of_stimuli meets whenever every stimulus is shown:
+# its leftovers make the frequencies uneven (CV up to ~0.3 for 20 stimuli), so
+# the CV gate is off unless asked for, and its D-efficiency stays above ~0.87.
+DEFAULT_MIN_D_EFFICIENCY = 0.8
+DEFAULT_MIN_APPEARANCES = 1
+DEFAULT_MAX_FREQUENCY_CV = None
+
+
+def load_design(db_manager, sequence_id):
+    """
+    Choice sets of a sequence, ordered by trial and index_order.
+
+    Returns:
+        np.ndarray: (n_trials, set_size) resource ids, or None if the sequence
+        has no rows or its trials are not all the same size.
+    """
+    df = db_manager.read_query(
+        "SELECT trial, index_order, stimuli_id FROM sequences "
+        "WHERE sequence_id = :sequence_id ORDER BY trial, index_order",
+        params={"sequence_id": sequence_id},
+    )
+    if df.empty:
+        return None
+    sizes = df.groupby("trial").size()
+    if sizes.nunique() != 1:
+        logger.warning(f"sequence_id={sequence_id} has trials of sizes {sorted(sizes.unique().tolist())}.")
+        return None
+    return df["stimuli_id"].to_numpy(dtype=np.int64).reshape(len(sizes), int(sizes.iloc[0]))
+
+
+################################################################################
+# Metrics
+################################################################################
+def frequency_balance(idx, n_items):
+    counts = np.bincount(idx.ravel(), minlength=n_items)
+    return {
+        "min": int(counts.min()),
+        "max": int(counts.max()),
+        "mean": float(counts.mean()),
+        "cv": float(counts.std() / counts.mean()),
+    }
+
+
+def position_balance(idx, n_items):
+    """Item x position counts against the expectation count_i / set_size."""
+    n_sets, set_size = idx.shape
+    counts = np.bincount(
+        (idx * set_size + np.arange(set_size)).ravel(), minlength=n_items * set_size
+    ).reshape(n_items, set_size)
+    expected = counts.sum(axis=1, keepdims=True) / set_size
+    deviation = counts - expected
+    shown = expected[:, 0] > 0  # stimuli never shown have no position to balance
+    return {
+        "chi2": float((deviation[shown] ** 2 / expected[shown]).sum()),
+        "dof": int(shown.sum()) * (set_size - 1),
+        "max_abs_deviation": float(np.abs(deviation).max()),
+        "per_position": np.bincount(np.tile(np.arange(set_size), n_sets), minlength=set_size).tolist(),
+    }
+
+
+def cooccurrence(idx, n_items):
+    """
+    Symmetric sparse pair co-occurrence counts (zero diagonal) and the number
+    of sets that contain the same stimulus more than once.
+    """
+    left, right = np.triu_indices(idx.shape[1], k=1)
+    a = idx[:, left].ravel()
+    b = idx[:, right].ravel()
+    repeated_in_set = int(np.any(idx[:, left] == idx[:, right], axis=1).sum())
+    off = a != b
+    lo, hi = np.minimum(a[off], b[off]), np.maximum(a[off], b[off])
+    upper = sparse.coo_matrix((np.ones(len(lo)), (lo, hi)), shape=(n_items, n_items)).tocsr()
+    upper.sum_duplicates()
+    return (upper + upper.T).tocsr(), repeated_in_set
+
+
+def pair_stats(counts, n_items):
+    upper = sparse.triu(counts, k=1)
+    n_possible = n_items * (n_items - 1) // 2
+    return {
+        "distinct": int(upper.nnz),
+        "coverage": float(upper.nnz / n_possible) if n_possible else 1.0,
+        "max_count": int(upper.data.max()) if upper.nnz else 0,
+        "repeated": int((upper.data > 1).sum()),
+    }
+
+
+def _lanczos_logdet(matvec, n, probes=SLQ_PROBES, steps=SLQ_STEPS, seed=0):
+    """
+    Stochastic Lanczos quadrature estimate of logdet(A) for a symmetric
+    positive definite A given by matvec (applied to an (n, probes) block, so
+    all probes advance together).
+    """
+    rng = np.random.default_rng(seed)
+    steps = min(steps, n)
+    v = rng.choice([-1.0, 1.0], size=(n, probes)) / np.sqrt(n)
+    v_prev = np.zeros_like(v)
+    alphas, betas = [], []
+    beta = np.zeros(probes)
+    for _ in range(steps):
+        w = matvec(v) - beta * v_prev
+        alpha = np.einsum("ij,ij->j", w, v)
+        w -= alpha * v
+        alphas.append(alpha)
+        beta = np.linalg.norm(w, axis=0)
+        if np.any(beta < 1e-10):  # invariant subspace found: the quadrature is exact
+            break
+        betas.append(beta)
+        v_prev, v = v, w / beta
+
+    alphas = np.array(alphas)
+    betas = np.array(betas[:len(alphas) - 1])
+    estimate = 0.0
+    for j in range(probes):
+        theta, vectors = eigh_tridiagonal(alphas[:, j], betas[:, j])
+        estimate += (vectors[0] ** 2) @ np.log(np.maximum(theta, 1e-300))
+    return n * estimate / probes
+
+
+def d_efficiency(counts, n_sets, set_size):
+    """
+    D-efficiency of the MaxDiff model (see above); 0.0 for a disconnected design.
+
+    Returns:
+        (float, str): efficiency and the method used ("dense" or "slq").
+    """
+    n_items = counts.shape[0]
+    if n_items < 2:
+        return 0.0, "dense"
+    degree = np.asarray(counts.sum(axis=1)).ravel()
+    laplacian = sparse.diags(degree) - counts
+    if n_items <= DENSE_MAX_ITEMS:
+        sign, logdet = np.linalg.slogdet(laplacian.toarray() + 1.0 / n_items)
+        method = "dense"
+        if sign <= 0:
+            return 0.0, method
+    else:
+        logdet = _lanczos_logdet(lambda x: laplacian @ x + x.mean(axis=0), n_items)
+        method = "slq"
+
+    # Information = scale * L; mean eigenvalue = trace / (n - 1) = 2 n_sets / (n - 1)
+    scale = 2.0 / (set_size * (set_size - 1))
+    log_geo_mean = np.log(scale) + logdet / (n_items - 1)
+    arith_mean = 2.0 * n_sets / (n_items - 1)
+    return float(min(np.exp(log_geo_mean) / arith_mean, 1.0)), method
+
+
+def evaluate_sets(sets, resource_ids=None):
+    """
+    Evaluate a design.
+
+    Parameters:
+        sets (array-like): (n_trials, set_size) resource ids, e.g. the all_sets
+            of create_sets_of_stimuli.
+        resource_ids (array-like, optional): Every stimulus that should be in
+            the design; ones that never appear count as unbalanced and disconnected.
+
+    Returns:
+        dict: The report (see module comment).
+    """
+    sets = np.asarray(sets, dtype=np.int64)
+    started = time.perf_counter()
+    ids = np.unique(sets) if resource_ids is None else np.unique(np.asarray(resource_ids, dtype=np.int64))
+    idx = np.searchsorted(ids, sets)
+    if np.any(idx >= len(ids)) or np.any(ids[np.minimum(idx, len(ids) - 1)] != sets):
+        raise ValueError("The design contains resource ids outside resource_ids.")
+    n_items = len(ids)
+    n_sets, set_size = sets.shape
+
+    counts, repeated_in_set = cooccurrence(idx, n_items)
+    n_components, labels = connected_components(counts, directed=False)
+    efficiency, method = d_efficiency(counts, n_sets, set_size) if n_components == 1 else (0.0, "disconnected")
+    return {
+        "n_items": n_items,
+        "n_sets": n_sets,
+        "set_size": set_size,
+        "frequency": frequency_balance(idx, n_items),
+        "position": position_balance(idx, n_items),
+        "pairs": pair_stats(counts, n_items),
+        "sets_with_repeated_item": repeated_in_set,
+        "components": int(n_components),
+        "largest_component": int(np.bincount(labels).max()),
+        "d_efficiency": efficiency,
+        "d_efficiency_method": method,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def check_report(report, min_d_efficiency=DEFAULT_MIN_D_EFFICIENCY, max_frequency_cv=DEFAULT_MAX_FREQUENCY_CV,
+                 min_appearances=DEFAULT_MIN_APPEARANCES):
+    """
+    Gate a report.
+
+    Returns:
+        list of str: Reasons the design is rejected (empty = acceptable).
+    """
+    failures = []
+    if report["sets_with_repeated_item"]:
+        failures.append(f"{report['sets_with_repeated_item']} set(s) contain the same stimulus twice")
+    if report["components"] != 1:
+        failures.append(f"co-occurrence graph has {report['components']} components "
+                        f"(largest {report['largest_component']} of {report['n_items']})")
+    if report["frequency"]["min"] < min_appearances:
+        failures.append(f"some stimuli are shown only {report['frequency']['min']} time(s) (< {min_appearances})")
+    if max_frequency_cv is not None and report["frequency"]["cv"] > max_frequency_cv:
+        failures.append(f"frequency CV {report['frequency']['cv']:.3f} > {max_frequency_cv}")
+    if report["d_efficiency"] < min_d_efficiency:
+        failures.append(f"D-efficiency {report['d_efficiency']:.3f} < {min_d_efficiency}")
+    return failures
+
+
+def format_report(report):
+    freq, pos, pairs = report["frequency"], report["position"], report["pairs"]
+    return "\n".join([
+        f"design      {report['n_sets']} sets x {report['set_size']}, {report['n_items']} stimuli",
+        f"frequency   min {freq['min']}  max {freq['max']}  mean {freq['mean']:.2f}  CV {freq['cv']:.3f}",
+        f"position    chi2 {pos['chi2']:.1f} (dof {pos['dof']})  max |dev| {pos['max_abs_deviation']:.2f}",
+        f"pairs       {pairs['distinct']} distinct ({pairs['coverage']:.2%} of all)  "
+        f"max {pairs['max_count']}  repeated {pairs['repeated']}",
+        f"components  {report['components']} (largest {report['largest_component']})",
+        f"D-eff       {report['d_efficiency']:.4f} ({report['d_efficiency_method']})",
+        f"evaluated in {report['seconds']:.2f}s",
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the design of a sequence; exit 1 if it fails the gates.")
+    parser.add_argument("sequence_id", type=int)
+    parser.add_argument("--min-d-efficiency", type=float, default=DEFAULT_MIN_D_EFFICIENCY)
+    parser.add_argument("--max-frequency-cv", type=float, default=DEFAULT_MAX_FREQUENCY_CV,
+                        help="Also gate on the CV of the stimulus frequencies (off by default).")
+    parser.add_argument("--min-appearances", type=int, default=DEFAULT_MIN_APPEARANCES,
+                        help="Times every stimulus must be shown.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    db_manager = DBManager()
+    try:
+        db_manager.connect()
+        sets = load_design(db_manager, args.sequence_id)
+    finally:
+        db_manager.close()
+    if sets is None:
+        print(f"sequence_id={args.sequence_id}: no usable design found.")
+        sys.exit(2)
+
+    report = evaluate_sets(sets)
+    failures = check_report(report, args.min_d_efficiency, args.max_frequency_cv, args.min_appearances)
+    if args.json:
+        print(json.dumps({**report, "failures": failures}, indent=2))
+    else:
+        print(format_report(report))
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
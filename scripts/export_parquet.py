@@ -0,0 +1,276 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from database_utils import DBManager
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Columnar export of experiment tables to partitioned Parquet
+################################################################################
+# Rows are streamed from MySQL in chunks (ordered by id) and appended as new
+# Parquet files to a hive-partitioned dataset per table:
+#
+#   <out>/trial_results/sequence_id=7/date=2025-03-01/part-<run>-<chunk>-0.parquet
+#
+# The highest exported id (and timestamp) per table is kept in
+# <out>/_export_state.json, so the next run only exports new rows.
+#
+# Rows do not commit in id order during a live study, so a high-water mark at
+# the highest id seen would skip a row that commits after a higher one. Each
+# run therefore only exports up to the settled id: the highest new id whose
+# row is older than --safety-lag (DEFAULT_SAFETY_LAG). Every lower id is
+# assumed committed by then, and newer rows wait for the next run.
+#
+# resources is updated in place (ingest refreshes size/mtime/hash), so it is
+# exported as a snapshot instead: rewritten whenever its row count or
+# MAX(updated_at) changed since the last run.
+
+STATE_FILE = "_export_state.json"
+DEFAULT_SAFETY_LAG = 300  # seconds
+
+_DICT_STRING = pa.dictionary(pa.int32(), pa.string())
+
+EXPORT_TABLES = {
+    "trial_results": {
+        "schema": pa.schema([
+            ("id", pa.int64()),
+            ("participant_id", pa.int32()),
+            ("sequence_id", pa.int32()),
+            ("trial_index", pa.int32()),
+            ("best_stimulus", pa.int32()),
+            ("worst_stimulus", pa.int32()),
+            ("submitted_at", pa.timestamp("us")),
+            ("date", pa.string()),
+        ]),
+        "time_column": "submitted_at",
+        "partition_cols": ["sequence_id", "date"],
+        "settled_query": (
+            "SELECT MAX(id) AS settled_id FROM trial_results "
+            "WHERE id > :high_water AND submitted_at < :cutoff"
+        ),
+    },
+    "final_scores": {
+        "schema": pa.schema([
+            ("id", pa.int64()),
+            ("participant_id", pa.int32()),
+            ("sequence_id", pa.int32()),
+            ("resource_id", pa.int32()),
+            ("final_score", pa.float32()),
+            ("rank_position", pa.int32()),
+            ("ci_lower", pa.float32()),
+            ("ci_upper", pa.float32()),
+            ("ci_method", _DICT_STRING),
+            ("computed_at", pa.timestamp("us")),
+            ("date", pa.string()),
+        ]),
+        "time_column": "computed_at",
+        "partition_cols": ["sequence_id", "date"],
+        "settled_query": (
+            "SELECT MAX(id) AS settled_id FROM final_scores "
+            "WHERE id > :high_water AND computed_at < :cutoff"
+        ),
+    },
+    "sequences": {
+        "schema": pa.schema([
+            ("id", pa.int64()),
+            ("sequence_id", pa.int32()),
+            ("stimuli_id", pa.int32()),
+            ("trial", pa.int32()),
+            ("index_order", pa.int16()),
+        ]),
+        "time_column": None,
+        "partition_cols": ["sequence_id"],
+        # A sequence's rows are written right after its sequence_info row
+        "settled_query": (
+            "SELECT MAX(s.id) AS settled_id FROM sequences s "
+            "JOIN sequence_info si ON si.sequence_id = s.sequence_id "
+            "WHERE s.id > :high_water AND si.time_created < :cutoff"
+        ),
+    },
+    "resources": {
+        "schema": pa.schema([
+            ("id", pa.int64()),
+            ("filenames", pa.string()),
+            ("folder_paths", _DICT_STRING),
+            ("descriptions", _DICT_STRING),
+            ("updated_at", pa.timestamp("us")),
+        ]),
+        "time_column": None,
+        "partition_cols": [],
+        "snapshot": True,  # updated in place: rewritten whenever it changed
+    },
+}
+
+
+def load_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(out_dir, state):
+    # Write-then-rename so an interrupted run never leaves a half-written state file
+    path = os.path.join(out_dir, STATE_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def chunk_to_arrow(df, spec):
+    """Convert one DataFrame chunk to an Arrow table with the table's schema."""
+    schema = spec["schema"]
+    if spec["time_column"]:
+        df[spec["time_column"]] = pd.to_datetime(df[spec["time_column"]])
+        df["date"] = df[spec["time_column"]].dt.strftime("%Y-%m-%d")
+    # Only keep the columns the schema knows, in schema order (tolerates extra DB columns)
+    columns = [name for name in schema.names if name in df.columns]
+    schema = pa.schema([schema.field(name) for name in columns])
+    return pa.Table.from_pandas(df[columns], schema=schema, preserve_index=False)
+
+
+def export_snapshot(db_manager, table, out_dir, state, chunksize=100000, full=False,
+                    safety_lag=DEFAULT_SAFETY_LAG):
+    """
+    Rewrite the dataset of a table that is updated in place, if it changed.
+
+    Returns:
+        int: Number of rows exported (0 if unchanged).
+    """
+    spec = EXPORT_TABLES[table]
+    df_version = db_manager.read_query(f"SELECT COUNT(*) AS n_rows, MAX(updated_at) AS updated_at FROM {table}")
+    n_total = int(df_version.iloc[0]["n_rows"])
+    updated_at = df_version.iloc[0]["updated_at"]
+    version = {"rows": n_total, "updated_at": None if pd.isna(updated_at) else pd.Timestamp(updated_at).isoformat()}
+    if not full and state.get(table) == version:
+        logger.info(f"{table}: unchanged since the last export")
+        return 0
+
+    run_id = uuid.uuid4().hex[:8]
+    dataset_dir = os.path.join(out_dir, table)
+    staging_dir = os.path.join(out_dir, f"_staging-{table}-{run_id}")
+    started = time.perf_counter()
+    n_rows = 0
+    for chunk_no, df in enumerate(db_manager.read_query_chunks(f"SELECT * FROM {table} ORDER BY id", {}, chunksize)):
+        if df.empty:
+            continue
+        pq.write_to_dataset(
+            chunk_to_arrow(df, spec),
+            root_path=staging_dir,
+            basename_template=f"part-{run_id}-{chunk_no:05d}-{{i}}.parquet",
+            compression="zstd",
+        )
+        n_rows += len(df)
+
+    # Swap the new snapshot in; the old one is removed only afterwards
+    old_dir = os.path.join(out_dir, f"_old-{table}-{run_id}")
+    if os.path.exists(dataset_dir):
+        os.rename(dataset_dir, old_dir)
+    if os.path.exists(staging_dir):
+        os.rename(staging_dir, dataset_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    # An update still committing within the lag may carry an updated_at the
+    # snapshot does not include yet: only remember settled versions
+    cutoff = datetime.now() - timedelta(seconds=safety_lag)
+    if updated_at is not None and not pd.isna(updated_at) and pd.Timestamp(updated_at) < cutoff:
+        state[table] = version
+    else:
+        state.pop(table, None)
+    save_state(out_dir, state)
+    logger.info(f"{table}: snapshot of {n_rows} rows in {time.perf_counter() - started:.1f}s")
+    return n_rows
+
+
+def export_table(db_manager, table, out_dir, state, chunksize=100000, full=False,
+                 safety_lag=DEFAULT_SAFETY_LAG):
+    """
+    Export rows of `table` with id above the stored high-water mark, up to
+    the settled id (see above). Snapshot tables are rewritten if changed.
+
+    Returns:
+        int: Number of rows exported.
+    """
+    spec = EXPORT_TABLES[table]
+    if spec.get("snapshot"):
+        return export_snapshot(db_manager, table, out_dir, state, chunksize, full, safety_lag)
+    table_state = {} if full else state.get(table, {})
+    high_water = table_state.get("id", 0)
+    run_id = uuid.uuid4().hex[:8]
+    dataset_dir = os.path.join(out_dir, table)
+
+    params = {"high_water": high_water, "cutoff": datetime.now() - timedelta(seconds=safety_lag)}
+    settled_id = db_manager.read_query(spec["settled_query"], params).iloc[0]["settled_id"]
+    if pd.isna(settled_id):
+        logger.info(f"{table}: no new rows older than {safety_lag}s")
+        return 0
+    params["settled_id"] = int(settled_id)
+
+    query = f"SELECT * FROM {table} WHERE id > :high_water AND id <= :settled_id ORDER BY id"
+    n_rows = 0
+    started = time.perf_counter()
+    for chunk_no, df in enumerate(db_manager.read_query_chunks(query, params, chunksize)):
+        if df.empty:
+            continue
+        arrow_table = chunk_to_arrow(df, spec)  # also normalises the time column
+        pq.write_to_dataset(
+            arrow_table,
+            root_path=dataset_dir,
+            partition_cols=spec["partition_cols"] or None,
+            basename_template=f"part-{run_id}-{chunk_no:05d}-{{i}}.parquet",
+            compression="zstd",
+        )
+
+        # Advance the high-water mark after every chunk that reached disk
+        table_state["id"] = int(df["id"].max())
+        if spec["time_column"]:
+            table_state[spec["time_column"]] = df[spec["time_column"]].max().isoformat()
+        state[table] = table_state
+        save_state(out_dir, state)
+        n_rows += len(df)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"{table}: exported {n_rows} rows in {elapsed:.1f}s (high-water id={table_state.get('id', 0)})")
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export experiment tables to partitioned Parquet.")
+    parser.add_argument("out_dir", help="Root directory of the Parquet datasets.")
+    parser.add_argument("--tables", nargs="+", choices=list(EXPORT_TABLES), default=list(EXPORT_TABLES))
+    parser.add_argument("--chunksize", type=int, default=100000)
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the stored high-water marks and export everything again (use an empty out_dir).")
+    parser.add_argument("--safety-lag", type=float, default=DEFAULT_SAFETY_LAG,
+                        help="Only export rows older than this many seconds (rows still committing).")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    state = load_state(args.out_dir)
+
+    db_manager = DBManager()
+    try:
+        db_manager.connect()
+        for table in args.tables:
+            n_rows = export_table(db_manager, table, args.out_dir, state, args.chunksize, args.full,
+                                  args.safety_lag)
+            print(f"{table}: {n_rows} new rows")
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
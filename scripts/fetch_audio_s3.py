@@ -1,4 +1,10 @@
-import os
+import argparse
+import posixpath
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import pandas as pd
 from database_utils import DBManager
@@ -11,55 +17,255 @@ prefix = "Guitar/"  # s3://dataset-guitar/Guitar/
 folder_name = "Guitar"
 description = "S3 file reference (no local download)"
 
-# Initialize S3 client
-s3 = boto3.client("s3")
+_DONE = object()    # put on the queue once every lister has finished
+_FAILED = object()  # (_FAILED, exception) from a lister that raised
+
+# Flat namespaces (all files directly under the prefix) are listed in key
+# ranges: shard i lists the keys k with bound[i] < k <= bound[i + 1] using
+# StartAfter, and stops once it pages past its upper bound.
+SHARD_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+def shard_bounds(root_prefix, shards):
+    """Upper key bounds splitting the keys under `root_prefix` into about `shards` ranges."""
+    if shards <= 1:
+        return []
+    step = len(SHARD_CHARS) / shards
+    chars = sorted({SHARD_CHARS[int(round(i * step))] for i in range(1, shards)})
+    return [root_prefix + c for c in chars]
+
+
+class _Listing:
+    """
+    Lister threads feeding one bounded queue. Listers block while the queue
+    is full and give up once `stop` is set, so a failing consumer never
+    leaves them hanging.
+    """
+    def __init__(self, s3, bucket, pool, queue_pages):
+        self.s3 = s3
+        self.bucket = bucket
+        self.pool = pool
+        self.pages = queue.Queue(maxsize=queue_pages)
+        self.stop = threading.Event()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self._pending += 1
+        self.pool.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            self._put((_FAILED, e))
+        finally:
+            self._finish()
 
-# 1. List objects in the specified S3 bucket and prefix
-objects_response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-if "Contents" not in objects_response:
-    print(f"No objects found at s3://{bucket_name}/{prefix}")
-    exit(0)
+    def _finish(self):
+        with self._lock:
+            self._pending -= 1
+            finished = self._pending == 0
+        if finished:
+            self._put(_DONE)
 
-records = []
-for obj in objects_response["Contents"]:
+    def list_range(self, root_prefix, start_after, stop_at):
+        """
+        Top-level listing (Delimiter="/") of the keys in (start_after, stop_at]:
+        objects go onto the queue page by page, sub-folders get their own lister.
+        """
+        kwargs = {"Bucket": self.bucket, "Prefix": root_prefix, "Delimiter": "/"}
+        if start_after is not None:
+            kwargs["StartAfter"] = start_after
+        for page in self.s3.get_paginator("list_objects_v2").paginate(**kwargs):
+            if self.stop.is_set():
+                return
+            contents = page.get("Contents", [])
+            sub_prefixes = [p["Prefix"] for p in page.get("CommonPrefixes", [])]
+            if stop_at is not None:
+                contents = [obj for obj in contents if obj["Key"] <= stop_at]
+                sub_prefixes = [p for p in sub_prefixes if p <= stop_at]
+            for sub_prefix in sub_prefixes:
+                self.submit(self.list_all, sub_prefix)
+            if contents and not self._put(contents):
+                return
+            last_keys = [obj["Key"] for obj in page.get("Contents", [])] + \
+                        [p["Prefix"] for p in page.get("CommonPrefixes", [])]
+            if stop_at is not None and last_keys and max(last_keys) > stop_at:
+                return  # paged past this shard
+
+    def list_all(self, list_prefix):
+        """Page through every object under `list_prefix` (1000 keys per page) onto the queue."""
+        for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=list_prefix):
+            if self.stop.is_set():
+                return
+            contents = page.get("Contents", [])
+            if contents and not self._put(contents):
+                return
+
+    def start(self, root_prefix, shards):
+        with self._lock:
+            self._pending += 1  # so _DONE cannot be sent before every shard is submitted
+        bounds = shard_bounds(root_prefix, shards)
+        for start_after, stop_at in zip([None] + bounds, bounds + [None]):
+            self.submit(self.list_range, root_prefix, start_after, stop_at)
+        self._finish()
+
+    def __iter__(self):
+        """Pages of object entries until every lister finished; re-raises lister errors."""
+        while True:
+            item = self.pages.get()
+            if item is _DONE:
+                return
+            if isinstance(item, tuple) and item[0] is _FAILED:
+                raise item[1]
+            yield item
+
+    def abort(self):
+        """Stop the listers and unblock any waiting on the full queue."""
+        self.stop.set()
+        while True:
+            try:
+                self.pages.get_nowait()
+            except queue.Empty:
+                break
+
+
+def to_record(obj, root_prefix, folder):
+    """Map an S3 object entry to a `resources` row, or None for "directory" placeholders."""
     key = obj["Key"]
-    # Skip "directory" placeholders ending with "/"
     if key.endswith("/"):
-        continue
-
-    # Example: if "Guitar/some-file.jpg", then:
-    #   filename = "some-file.jpg"
-    filename = os.path.basename(key)
-
-    # For the folder_path, you might store a full S3 URL, 
-    # or just a relative path. Choose whichever suits your needs.
-    #
-    # Option A: store full S3 URL
-    # folder_path = f"s3://{bucket_name}/{key}"
-    #
-    # Option B: store just the key
-    # folder_path = key
-    #
-    # Option C: mimic your original scheme (e.g. "resources/Guitar/myfile.jpg")
-    folder_path = os.path.join("resources", folder_name, filename)
-
-    records.append((filename, folder_path, description))
-
-# If no objects after skipping directories
-if not records:
-    print(f"No files found under prefix {prefix}.")
-    exit(0)
-
-# 2. Convert to DataFrame
-df_records = pd.DataFrame(records, columns=["filenames", "folder_paths", "descriptions"])
-
-# 3. Insert the records into the database
-db_manager = DBManager()
-engine = db_manager.connect()
-try:
-    db_manager.append_table("resources", df_records)
-    print("Files inserted successfully into the database.")
-except Exception as e:
-    print("Error inserting files into the database:", e)
-finally:
-    db_manager.close()
+        return None
+    # Same scheme as before ("resources/Guitar/myfile.wav"), keeping any sub-folders
+    relative_key = key[len(root_prefix):]
+    return {
+        "filenames": posixpath.basename(key),
+        "folder_paths": posixpath.join("resources", folder, relative_key),
+        "descriptions": description,
+        "etag": obj["ETag"].strip('"'),
+        "size_bytes": int(obj["Size"]),
+    }
+
+
+def load_existing(db_manager, folder):
+    """{ folder_paths: (etag, size_bytes) } of resources already ingested for this folder."""
+    df = db_manager.read_query(
+        "SELECT folder_paths, etag, size_bytes FROM resources WHERE folder_paths LIKE :pattern",
+        params={"pattern": posixpath.join("resources", folder, "%")},
+    )
+    return {
+        row.folder_paths: (row.etag, None if pd.isna(row.size_bytes) else int(row.size_bytes))
+        for row in df.itertuples(index=False)
+    }
+
+
+def flush(db_manager, new_rows, changed_rows, batch_size):
+    if new_rows:
+        db_manager.append_table("resources", pd.DataFrame(new_rows), method="multi", chunksize=batch_size)
+    if changed_rows:
+        db_manager.execute_query(
+            "UPDATE resources SET etag = :etag, size_bytes = :size_bytes WHERE folder_paths = :folder_paths",
+            changed_rows,
+        )
+
+
+def ingest(db_manager, s3, bucket, root_prefix, folder, batch_size=1000, workers=8, queue_pages=32, shards=16):
+    """
+    List every object under s3://bucket/root_prefix concurrently (the top level
+    in `shards` key ranges, plus one lister per sub-prefix) and insert new
+    objects into `resources` in bounded batches while the listing streams in.
+    Objects already ingested with the same ETag and size are skipped; objects
+    whose ETag or size changed get their stored etag/size updated.
+
+    Returns:
+        dict: Counts of listed, inserted, updated and skipped objects.
+    """
+    started = time.perf_counter()
+    existing = load_existing(db_manager, folder)
+
+    stats = {"listed": 0, "inserted": 0, "updated": 0, "skipped": 0}
+    new_rows, changed_rows = [], []
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    # Bounded queue: listers block when the DB writer falls behind
+    listing = _Listing(s3, bucket, pool, queue_pages)
+    try:
+        listing.start(root_prefix, shards)
+        for contents in listing:
+            for obj in contents:
+                record = to_record(obj, root_prefix, folder)
+                if record is None:
+                    continue
+                stats["listed"] += 1
+                previous = existing.get(record["folder_paths"])
+                if previous is None:
+                    new_rows.append(record)
+                    existing[record["folder_paths"]] = (record["etag"], record["size_bytes"])
+                elif previous != (record["etag"], record["size_bytes"]):
+                    changed_rows.append(record)
+                else:
+                    stats["skipped"] += 1
+
+            if len(new_rows) + len(changed_rows) >= batch_size:
+                flush(db_manager, new_rows, changed_rows, batch_size)
+                stats["inserted"] += len(new_rows)
+                stats["updated"] += len(changed_rows)
+                new_rows, changed_rows = [], []
+    except BaseException:
+        listing.abort()  # a failed insert or listing must not leave listers blocked on the queue
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    flush(db_manager, new_rows, changed_rows, batch_size)
+    stats["inserted"] += len(new_rows)
+    stats["updated"] += len(changed_rows)
+
+    elapsed = time.perf_counter() - started
+    stats["objects_per_second"] = stats["listed"] / elapsed if elapsed > 0 else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest S3 objects into the 'resources' table.")
+    parser.add_argument("--bucket", default=bucket_name)
+    parser.add_argument("--prefix", default=prefix)
+    parser.add_argument("--folder-name", default=folder_name,
+                        help="Folder name used in resources.folder_paths (resources/<folder>/...).")
+    parser.add_argument("--endpoint-url", default=None,
+                        help="S3-compatible endpoint, e.g. http://localhost:9000 for a local MinIO.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent listers.")
+    parser.add_argument("--shards", type=int, default=16,
+                        help="Key ranges the top level of the prefix is listed in.")
+    args = parser.parse_args()
+
+    s3 = boto3.client("s3", endpoint_url=args.endpoint_url)
+
+    db_manager = DBManager()
+    db_manager.connect()
+    try:
+        stats = ingest(db_manager, s3, args.bucket, args.prefix, args.folder_name,
+                       batch_size=args.batch_size, workers=args.workers, shards=args.shards)
+        print(
+            f"Listed {stats['listed']} objects ({stats['objects_per_second']:.0f} objects/s): "
+            f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['skipped']} already ingested."
+        )
+    except Exception as e:
+        print("Error inserting files into the database:", e)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
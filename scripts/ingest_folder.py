@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from database_utils import DBManager
+
+description = "File added from folder scanning"
+
+################################################################################
+# Incremental local folder ingest
+################################################################################
+# Non-interactive replacement for the prompt-and-listdir flow of test_append.py:
+#
+#   1. walk the tree with os.scandir (stat info comes for free with the entries)
+#   2. compare (size, mtime) with what is stored in `resources`, or in
+#      `resource_duplicates` for files whose content is stored under another path
+#   3. hash only new or changed files, in parallel worker processes via mmap
+#   4. insert / update in bulk; identical content (same SHA-256) is stored once,
+#      further copies are only recorded in `resource_duplicates`
+#
+# A re-scan of an unchanged library therefore only costs the directory walk.
+
+
+def scan_tree(root, extensions=None):
+    """
+    Recursively list files under `root`.
+
+    Returns:
+        list of (folder_path, filename, size_bytes, mtime_ns)
+    """
+    files = []
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    if extensions and os.path.splitext(entry.name)[1].lower() not in extensions:
+                        continue
+                    st = entry.stat()
+                    files.append((folder, entry.name, st.st_size, st.st_mtime_ns))
+    return files
+
+
+def hash_file(path):
+    """SHA-256 hex digest of a file, read through mmap."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256(b"").hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+
+def _stat_rows(db_manager, table, root):
+    """Rows of `table` under `root` (id, path, size, mtime, hash), keyed by (folder_paths, filenames)."""
+    # mtime_ns (~1.7e18) does not fit a float64 exactly, and pandas reads a BIGINT
+    # column holding NULLs as float64: fetch it as text and compare exact ints
+    df = db_manager.read_query(
+        "SELECT id, folder_paths, filenames, size_bytes, CAST(mtime_ns AS CHAR) AS mtime_ns, content_hash "
+        f"FROM {table} WHERE folder_paths = :root OR folder_paths LIKE :pattern",
+        params={"root": root, "pattern": os.path.join(root, "%")},
+    )
+    df["mtime_ns"] = pd.Series(
+        [None if pd.isna(value) else int(value) for value in df["mtime_ns"]], index=df.index, dtype=object,
+    )
+    return {
+        (row.folder_paths, row.filenames): row
+        for row in df.itertuples(index=False)
+    }
+
+
+def load_existing(db_manager, root):
+    """
+    Stored rows under `root` (resources and recorded duplicates), keyed by
+    (folder_paths, filenames), and every known content hash.
+    """
+    existing = _stat_rows(db_manager, "resources", root)
+    duplicates = _stat_rows(db_manager, "resource_duplicates", root)
+    df_hashes = db_manager.read_query(
+        "SELECT content_hash FROM resources WHERE content_hash IS NOT NULL"
+    )
+    return existing, duplicates, set(df_hashes["content_hash"])
+
+
+def _unchanged(row, size, mtime_ns):
+    return row is not None and row.size_bytes == size and row.mtime_ns == mtime_ns and row.content_hash is not None
+
+
+def ingest(db_manager, root, extensions=None, workers=None, batch_size=1000):
+    """
+    Bring `resources` up to date with the files under `root`.
+
+    Returns:
+        dict: Counts of scanned, hashed, inserted, updated, unchanged and duplicate files.
+    """
+    root = os.path.abspath(root)
+    started = time.perf_counter()
+    files = scan_tree(root, extensions)
+    existing, duplicates, known_hashes = load_existing(db_manager, root)
+
+    # Only files that are new, or whose size/mtime changed, need hashing
+    to_hash = []
+    for folder, name, size, mtime_ns in files:
+        key = (folder, name)
+        if not (_unchanged(existing.get(key), size, mtime_ns) or _unchanged(duplicates.get(key), size, mtime_ns)):
+            to_hash.append((folder, name, size, mtime_ns))
+
+    stats = {"scanned": len(files), "hashed": len(to_hash), "inserted": 0,
+             "updated": 0, "unchanged": len(files) - len(to_hash), "duplicates": 0}
+    if not to_hash:
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    paths = [os.path.join(folder, name) for folder, name, _, _ in to_hash]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        hashes = list(pool.map(hash_file, paths, chunksize=max(1, len(paths) // (8 * (workers or os.cpu_count() or 1)))))
+
+    new_rows, changed_rows = [], []
+    new_duplicates, changed_duplicates, stale_duplicates = [], [], []
+    for (folder, name, size, mtime_ns), content_hash in zip(to_hash, hashes):
+        row = existing.get((folder, name))
+        duplicate = duplicates.get((folder, name))
+        stat = {"size_bytes": size, "mtime_ns": mtime_ns, "content_hash": content_hash}
+        if row is not None and row.content_hash == content_hash:
+            # Touched but not modified: refresh the stat info only
+            changed_rows.append({"id": int(row.id), **stat})
+        elif content_hash in known_hashes:
+            # Stored under another path: only remember the stat info of this copy
+            stats["duplicates"] += 1
+            if duplicate is None:
+                new_duplicates.append({"folder_paths": folder, "filenames": name, **stat})
+            else:
+                changed_duplicates.append({"id": int(duplicate.id), **stat})
+            continue
+        else:
+            known_hashes.add(content_hash)
+            if row is None:
+                new_rows.append({"filenames": name, "folder_paths": folder, "descriptions": description, **stat})
+            else:
+                changed_rows.append({"id": int(row.id), **stat})
+        if duplicate is not None:  # the path holds stored content again
+            stale_duplicates.append({"id": int(duplicate.id)})
+
+    if new_rows:
+        db_manager.append_table("resources", pd.DataFrame(new_rows), method="multi", chunksize=batch_size)
+    if changed_rows:
+        db_manager.execute_query(
+            "UPDATE resources SET size_bytes = :size_bytes, mtime_ns = :mtime_ns, "
+            "content_hash = :content_hash WHERE id = :id",
+            changed_rows,
+        )
+    if new_duplicates:
+        db_manager.append_table("resource_duplicates", pd.DataFrame(new_duplicates),
+                                method="multi", chunksize=batch_size)
+    if changed_duplicates:
+        db_manager.execute_query(
+            "UPDATE resource_duplicates SET size_bytes = :size_bytes, mtime_ns = :mtime_ns, "
+            "content_hash = :content_hash WHERE id = :id",
+            changed_duplicates,
+        )
+    if stale_duplicates:
+        db_manager.execute_query("DELETE FROM resource_duplicates WHERE id = :id", stale_duplicates)
+    stats["inserted"] = len(new_rows)
+    stats["updated"] = len(changed_rows)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally ingest a local stimulus folder into 'resources'.")
+    parser.add_argument("folder", help="Root folder to scan recursively.")
+    parser.add_argument("--extensions", nargs="*", default=None,
+                        help="Only ingest these file extensions, e.g. .wav .flac")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing processes (default: CPU count).")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        print("Invalid folder path provided!")
+        exit(1)
+
+    extensions = {e.lower() if e.startswith(".") else f".{e.lower()}" for e in args.extensions or []}
+
+    db_manager = DBManager()
+    db_manager.connect()
+    try:
+        stats = ingest(db_manager, args.folder, extensions or None, args.workers, args.batch_size)
+        print(
+            f"Scanned {stats['scanned']} files in {stats['seconds']:.1f}s: hashed {stats['hashed']}, "
+            f"inserted {stats['inserted']}, updated {stats['updated']}, unchanged {stats['unchanged']}, "
+            f"skipped {stats['duplicates']} duplicates."
+        )
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import minimize
+
+################################################################################
+# MaxDiff (best-worst) multinomial logit
+################################################################################
+# Choice data is kept as flat arrays, one entry per alternative shown:
+#
+#   items[a]        dense stimulus index of alternative a
+#   offsets[t]      first alternative of choice set t (offsets[-1] == n_alternatives)
+#   best_pos[t]     absolute position (into items) of the best pick of set t
+#   worst_pos[t]    absolute position (into items) of the worst pick of set t
+#   participant[t]  dense participant index of set t
+#
+# Best is chosen with softmax(u) over the set, worst with softmax(-u) over the
+# remaining alternatives (sequential best-worst). Utilities are u = X @ beta
+# with X a one-hot CSR design matrix built straight from `items`.
+
+
+class ChoiceData:
+    """
+    Flat-array representation of answered best-worst trials.
+    """
+    def __init__(self, items, offsets, best_pos, worst_pos, participant,
+                 resource_ids, participant_ids):
+        self.items = np.asarray(items, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.best_pos = np.asarray(best_pos, dtype=np.int64)
+        self.worst_pos = np.asarray(worst_pos, dtype=np.int64)
+        self.participant = np.asarray(participant, dtype=np.int32)
+        self.resource_ids = np.asarray(resource_ids, dtype=np.int64)
+        self.participant_ids = np.asarray(participant_ids, dtype=np.int64)
+
+        self.sizes = np.diff(self.offsets)
+        self.set_of_alt = np.repeat(np.arange(self.n_sets), self.sizes)
+        # Common case: every set has the same size, so sets can be viewed as a 2-D array
+        self.uniform_size = int(self.sizes[0]) if len(self.sizes) and np.all(self.sizes == self.sizes[0]) else None
+        self._design = None
+
+    @property
+    def n_sets(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_items(self):
+        return len(self.resource_ids)
+
+    @property
+    def n_participants(self):
+        return len(self.participant_ids)
+
+    def arrays(self):
+        """The arrays needed to rebuild this object (e.g. in another process)."""
+        return {
+            "items": self.items,
+            "offsets": self.offsets,
+            "best_pos": self.best_pos,
+            "worst_pos": self.worst_pos,
+            "participant": self.participant,
+            "resource_ids": self.resource_ids,
+            "participant_ids": self.participant_ids,
+        }
+
+    def design(self):
+        """One-hot CSR design matrix, shape (n_alternatives, n_items)."""
+        if self._design is None:
+            n_alts = len(self.items)
+            self._design = sparse.csr_matrix(
+                (np.ones(n_alts), self.items, np.arange(n_alts + 1)),
+                shape=(n_alts, self.n_items),
+            )
+        return self._design
+
+
+def choice_data_from_long(df):
+    """
+    Build ChoiceData from long-format rows (one row per alternative shown),
+    ordered by trial_result_id then index_order, with columns
+    trial_result_id, participant_id, stimuli_id, best_stimulus, worst_stimulus.
+    """
+    return choice_data_from_arrays(
+        df["trial_result_id"].to_numpy(),
+        df["participant_id"].to_numpy(dtype=np.int64),
+        df["stimuli_id"].to_numpy(dtype=np.int64),
+        df["best_stimulus"].to_numpy(dtype=np.float64),
+        df["worst_stimulus"].to_numpy(dtype=np.float64),
+    )
+
+
+def choice_data_from_arrays(set_key, participants, stimuli, best, worst):
+    """
+    Build ChoiceData from aligned per-alternative arrays (see choice_data_from_long).
+    Skipped trials and trials whose best/worst are not exactly one
+    alternative of the set (or are the same alternative) are dropped.
+    """
+    if len(set_key) == 0:
+        return _empty_choice_data()
+
+    starts = np.flatnonzero(np.r_[True, set_key[1:] != set_key[:-1]])
+    is_best = stimuli == best
+    is_worst = stimuli == worst
+    valid = (
+        (np.add.reduceat(is_best, starts) == 1)
+        & (np.add.reduceat(is_worst, starts) == 1)
+        & (np.add.reduceat(is_best & is_worst, starts) == 0)
+    )
+    sizes = np.diff(np.r_[starts, len(set_key)])
+    keep = np.repeat(valid, sizes)
+    if not keep.any():
+        return _empty_choice_data()
+
+    resource_ids, items = np.unique(stimuli[keep], return_inverse=True)
+    participant_ids, participant = np.unique(participants[starts[valid]], return_inverse=True)
+
+    offsets = np.r_[0, np.cumsum(sizes[valid])]
+    return ChoiceData(
+        items=items,
+        offsets=offsets,
+        best_pos=np.flatnonzero(is_best[keep]),
+        worst_pos=np.flatnonzero(is_worst[keep]),
+        participant=participant,
+        resource_ids=resource_ids,
+        participant_ids=participant_ids,
+    )
+
+
+def _empty_choice_data():
+    return ChoiceData([], [0], [], [], [], [], [])
+
+
+def load_choice_data(db_manager, sequence_id=None, participant_id=None, folder_path=None,
+                     chunksize=500000, include_archive=False):
+    """
+    Load answered trials from the trial_choice_sets view (fixed and adaptive
+    trials) for one sequence, or for every sequence of a folder_path.
+    Rows are streamed in chunks into compact arrays, so memory stays bounded
+    by the arrays themselves rather than by pandas frames.
+
+    Parameters:
+        db_manager (DBManager): Connected database manager.
+        sequence_id (int, optional): Restrict to one sequence.
+        participant_id (int, optional): Restrict to one participant.
+        folder_path (str, optional): Restrict to sequences whose sequence_info.folder_path matches.
+        chunksize (int): Rows per streamed chunk.
+        include_archive (bool): Also read studies moved to the archive tables
+            (trial_choice_sets_all, see archive_study.py).
+
+    Returns:
+        ChoiceData
+    """
+    conditions, params = [], {}
+    if sequence_id is not None:
+        conditions.append("c.sequence_id = :sequence_id")
+        params["sequence_id"] = sequence_id
+    if participant_id is not None:
+        conditions.append("c.participant_id = :participant_id")
+        params["participant_id"] = participant_id
+    if folder_path is not None:
+        conditions.append("si.folder_path = :folder_path")
+        params["folder_path"] = folder_path
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    query = f"""
+        SELECT c.trial_result_id, c.participant_id, c.stimuli_id,
+               c.best_stimulus, c.worst_stimulus
+        FROM {"trial_choice_sets_all" if include_archive else "trial_choice_sets"} c
+        JOIN sequence_info si ON si.sequence_id = c.sequence_id
+        {where}
+        ORDER BY c.trial_result_id, c.index_order
+    """
+    parts = {"set_key": [], "participants": [], "stimuli": [], "best": [], "worst": []}
+    for df in db_manager.read_query_chunks(query, params, chunksize):
+        parts["set_key"].append(df["trial_result_id"].to_numpy(dtype=np.int64))
+        parts["participants"].append(df["participant_id"].to_numpy(dtype=np.int32))
+        parts["stimuli"].append(df["stimuli_id"].to_numpy(dtype=np.int32))
+        parts["best"].append(df["best_stimulus"].to_numpy(dtype=np.float64))
+        parts["worst"].append(df["worst_stimulus"].to_numpy(dtype=np.float64))
+    if not parts["set_key"]:
+        return _empty_choice_data()
+    return choice_data_from_arrays(**{name: np.concatenate(chunks) for name, chunks in parts.items()})
+
+
+def _segment_log_softmax(v, data):
+    """Log-softmax of v within each choice set (ragged sets allowed)."""
+    if data.uniform_size:
+        z = v.reshape(-1, data.uniform_size)
+        z = z - z.max(axis=1, keepdims=True)
+        return (z - np.log(np.exp(z).sum(axis=1, keepdims=True))).ravel()
+
+    offsets, set_of_alt = data.offsets, data.set_of_alt
+    seg_max = np.maximum.reduceat(v, offsets[:-1])
+    z = v - seg_max[set_of_alt]
+    ez = np.exp(z)
+    log_norm = np.log(np.add.reduceat(ez, offsets[:-1]))
+    return z - log_norm[set_of_alt]
+
+
+def utility_gradient(u, data, weights=None):
+    """
+    Negative log-likelihood of MaxDiff choices given per-alternative utilities
+    `u`, and its gradient with respect to `u`.
+
+    Parameters:
+        u (np.ndarray): Utility of each alternative, shape (n_alternatives,).
+        data (ChoiceData): The choice sets.
+        weights (np.ndarray, optional): Weight per choice set (bootstrap counts).
+
+    Returns:
+        (float, np.ndarray): NLL and d NLL / d u.
+    """
+    log_p_best = _segment_log_softmax(u, data)
+    v = -u
+    v[data.best_pos] = -np.inf  # worst is picked among the remaining alternatives
+    log_p_worst = _segment_log_softmax(v, data)
+
+    if weights is None:
+        nll = -(log_p_best[data.best_pos].sum() + log_p_worst[data.worst_pos].sum())
+    else:
+        nll = -(weights @ log_p_best[data.best_pos] + weights @ log_p_worst[data.worst_pos])
+
+    # d(-log p_best)/du = p_best - onehot(best); d(-log p_worst)/du = onehot(worst) - p_worst
+    grad = np.exp(log_p_best) - np.exp(log_p_worst)
+    grad[data.best_pos] -= 1.0
+    grad[data.worst_pos] += 1.0
+    if weights is not None:
+        grad *= weights[data.set_of_alt]
+    return nll, grad
+
+
+def fit_maxdiff(data, weights=None, init=None, ridge=1e-3, design=None, max_iter=500):
+    """
+    Maximum (ridge-penalised) likelihood fit of MaxDiff utilities.
+
+    Parameters:
+        data (ChoiceData): The choice sets.
+        weights (np.ndarray, optional): Weight per choice set.
+        init (np.ndarray, optional): Starting parameters (warm start).
+        ridge (float or np.ndarray): L2 penalty (scalar or one per parameter);
+            also pins down the otherwise free location.
+        design (scipy.sparse matrix, optional): Alternative-by-parameter design
+            matrix. Defaults to the one-hot item design (one utility per item).
+        max_iter (int): L-BFGS iteration limit.
+
+    Returns:
+        np.ndarray: Fitted parameters. With the default design these are
+        item utilities, centered to mean zero.
+    """
+    X = data.design() if design is None else design
+    X_t = X.T.tocsr()
+    n_params = X.shape[1]
+    # Optimise the per-trial average so L-BFGS tolerances do not depend on data size
+    scale = 1.0 / max(data.n_sets if weights is None else float(weights.sum()), 1.0)
+
+    def objective(beta):
+        nll, grad_u = utility_gradient(X @ beta, data, weights)
+        penalty = ridge * beta
+        return scale * (nll + 0.5 * penalty @ beta), scale * (X_t @ grad_u + penalty)
+
+    x0 = np.zeros(n_params) if init is None else np.asarray(init, dtype=np.float64)
+    result = minimize(objective, x0, jac=True, method="L-BFGS-B", options={"maxiter": max_iter})
+    beta = result.x
+    if design is None:
+        beta = beta - beta.mean()
+    return beta
+
+
+def rank_scores(resource_ids, scores):
+    """Return a DataFrame of resource_id, final_score, rank_position (1 = best)."""
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    return pd.DataFrame({
+        "resource_id": np.asarray(resource_ids)[order],
+        "final_score": np.asarray(scores)[order],
+        "rank_position": np.arange(1, len(order) + 1),
+    })
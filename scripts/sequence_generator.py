@@ -1,8 +1,11 @@
+import os
 import pandas as pd
 import random
 import time
 from datetime import datetime
 from database_utils import DBManager
+from evaluate_design import check_report, evaluate_sets, format_report
+from trial_bundles import publish_sequence
 
 def create_sets_of_stimuli(stimuli_ids, repeats=3, set_size=5):
     """
@@ -41,6 +44,9 @@ def main():
     set_size = 5                        # How many distinct stimuli in each set
     sequence_id = 7                  # ID to log in sequence_info
     sequence_name = "Test Sequence Note"
+    design_attempts = 10                # regenerate a rejected design at most this often
+    adaptive = os.getenv("ADAPTIVE") == "1"  # adaptive mode: no fixed trials, chosen per participant
+    bundle_dir = os.getenv("BUNDLE_DIR")  # nginx's static trial bundles; unset = skip publishing
     
     db_manager = DBManager()
     try:
@@ -56,9 +62,38 @@ def main():
             print(f"No resources found in DB for folder path: {folder_path}")
             return
 
-        # 3) Use our new logic to create the sets
-        all_sets, leftover = create_sets_of_stimuli(stimuli_ids, repeats, set_size)
-        
+        # Adaptive mode: only "sequence_info", with n_trials = 0; the backend
+        # picks each participant's choice sets from the folder's resources
+        if adaptive:
+            if len(stimuli_ids) < set_size:
+                print(f"Adaptive mode needs at least {set_size} resources, found {len(stimuli_ids)}.")
+                return
+            db_manager.append_table("sequence_info", pd.DataFrame([{
+                "sequence_id": sequence_id,
+                "sequence_name": sequence_name,
+                "time_created": datetime.now(),
+                "folder_path": folder_path,
+                "choice_set_size": set_size,
+                "n_trials": 0,
+            }]))
+            print(f"Adaptive sequence {sequence_id} created over {len(stimuli_ids)} resources.")
+            return
+
+        # 3) Use our new logic to create the sets; a random draw can leave a
+        #    stimulus out, so poor designs are regenerated a few times before
+        #    giving up (nothing is stored or shown to participants then)
+        for attempt in range(1, design_attempts + 1):
+            all_sets, leftover = create_sets_of_stimuli(stimuli_ids, repeats, set_size)
+            report = evaluate_sets(all_sets, stimuli_ids)
+            failures = check_report(report)
+            if not failures:
+                break
+            print(f"Design attempt {attempt}/{design_attempts} rejected: {'; '.join(failures)}")
+        print(format_report(report))
+        if failures:
+            print("No acceptable design found, nothing was inserted.")
+            return
+
         if leftover:
             print("Warning: leftover items that could not form a complete set:", leftover)
 
@@ -95,6 +130,11 @@ def main():
 
         print("\nData inserted successfully into 'sequence_info' and 'sequences'.")
 
+        # 8) Publish the static /api/trials bundle so nginx serves it without the backend
+        if bundle_dir:
+            version = publish_sequence(db_manager, sequence_id, bundle_dir)
+            print(f"Published trial bundle (version {version}) to {bundle_dir}.")
+
     finally:
         # Ensure that the connection is closed even if an error occurs
         db_manager.close()
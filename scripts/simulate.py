@@ -0,0 +1,275 @@
+import argparse
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import kendalltau, spearmanr
+
+from database_utils import DBManager
+from evaluate_design import load_design
+from maxdiff import ChoiceData, fit_maxdiff
+from scoring import DeltaRuleScorer
+from sequence_generator import create_sets_of_stimuli
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Synthetic respondents: how many participants and trials give a stable ranking?
+################################################################################
+# Latent utilities are drawn per stimulus (N(0, 1)), plus per-participant
+# deviations N(0, tau^2). Every simulated participant answers the first
+# n_trials sets of the design under the same sequential best-worst MNL model
+# that maxdiff.py fits: with Gumbel noise g,
+#
+#   best  = argmax(u + g1)                  (softmax(u) over the set)
+#   worst = argmin(u - g2) without best     (softmax(-u) over the rest)
+#
+# All participants x trials x alternatives are drawn at once as NumPy arrays
+# (in participant blocks to bound memory), so millions of choices take seconds.
+# The answers are scored with the project's methods
+#
+#   counts    (best - worst) / times shown
+#   delta     DeltaRuleScorer replayed in submission order (trial by trial,
+#             the slowest method: pass --methods to skip it on huge runs)
+#   maxdiff   fit_maxdiff
+#
+# and each ranking is compared with the true population utilities. Replications
+# run in a process pool.
+
+METHODS = ("counts", "delta", "maxdiff")
+BLOCK_VALUES = 4_000_000  # utilities drawn per participant block
+
+
+def load_stimuli(db_manager, folder_path):
+    df = db_manager.read_query(
+        "SELECT id FROM resources WHERE folder_paths = :folder_path ORDER BY id",
+        params={"folder_path": folder_path},
+    )
+    return df["id"].tolist()
+
+
+def generated_design(stimuli_ids, repeats=3, set_size=5, seed=None):
+    """Design as sequence_generator.py would write it, as an (n_sets, set_size) array."""
+    random.seed(seed)
+    all_sets, _ = create_sets_of_stimuli(list(stimuli_ids), repeats, set_size)
+    return np.asarray(all_sets, dtype=np.int64)
+
+
+def simulate_choices(sets, n_participants, utilities, tau=0.0, rng=None):
+    """
+    Best and worst position within each set, for every participant and trial.
+
+    Parameters:
+        sets (np.ndarray): (n_trials, set_size) dense stimulus indices.
+        n_participants (int): Simulated participants (each answers every set).
+        utilities (np.ndarray): Population utility per stimulus.
+        tau (float): SD of the per-participant utility deviations.
+        rng (np.random.Generator, optional)
+
+    Returns:
+        (np.ndarray, np.ndarray): best and worst positions, (n_participants, n_trials).
+    """
+    rng = rng or np.random.default_rng()
+    n_trials, set_size = sets.shape
+    n_items = len(utilities)
+    best = np.empty((n_participants, n_trials), dtype=np.int64)
+    worst = np.empty((n_participants, n_trials), dtype=np.int64)
+    per_participant = n_trials * set_size + (n_items if tau > 0 else 0)
+    block = max(1, BLOCK_VALUES // max(per_participant, 1))
+
+    for start in range(0, n_participants, block):
+        stop = min(start + block, n_participants)
+        if tau > 0:
+            u_block = utilities + tau * rng.standard_normal((stop - start, n_items))
+            u = u_block[:, sets]                                    # (B, T, k)
+        else:
+            u = np.broadcast_to(utilities[sets], (stop - start, n_trials, set_size))
+        best_block = np.argmax(u + rng.gumbel(size=u.shape), axis=2)
+        worst_u = u - rng.gumbel(size=u.shape)
+        np.put_along_axis(worst_u, best_block[..., None], np.inf, axis=2)
+        best[start:stop] = best_block
+        worst[start:stop] = np.argmin(worst_u, axis=2)
+    return best, worst
+
+
+def to_choice_data(sets, best, worst):
+    """ChoiceData straight from the simulated arrays (no DataFrame round trip)."""
+    n_participants, n_trials = best.shape
+    set_size = sets.shape[1]
+    n_sets = n_participants * n_trials
+    offsets = np.arange(n_sets + 1, dtype=np.int64) * set_size
+    items = np.broadcast_to(sets, (n_participants, n_trials, set_size)).ravel()
+    n_items = int(sets.max()) + 1
+    return ChoiceData(
+        items=items,
+        offsets=offsets,
+        best_pos=offsets[:-1] + best.ravel(),
+        worst_pos=offsets[:-1] + worst.ravel(),
+        participant=np.repeat(np.arange(n_participants), n_trials),
+        resource_ids=np.arange(n_items),
+        participant_ids=np.arange(n_participants),
+    )
+
+
+def score(method, sets, best, worst, n_items):
+    """Scores per dense stimulus index (stimuli never shown score 0)."""
+    n_participants, n_trials = best.shape
+    rows = np.broadcast_to(np.arange(n_trials), best.shape)
+    best_items = sets[rows, best]
+    worst_items = sets[rows, worst]
+    if method == "counts":
+        shown = n_participants * np.bincount(sets.ravel(), minlength=n_items)
+        net = np.bincount(best_items.ravel(), minlength=n_items) - np.bincount(worst_items.ravel(), minlength=n_items)
+        return net / np.maximum(shown, 1)
+    if method == "delta":
+        # Submission order: everyone answers trial 0, then trial 1, ...
+        scorer = DeltaRuleScorer(np.arange(n_items))
+        order = np.argsort(rows.ravel(), kind="stable")
+        trials = sets[rows.ravel()[order]]
+        scorer.replay(trials, best_items.ravel()[order], worst_items.ravel()[order])
+        return scorer.values
+    if method == "maxdiff":
+        return fit_maxdiff(to_choice_data(sets, best, worst))
+    raise ValueError(f"Unknown scoring method: {method}")
+
+
+def recovery_metrics(true_utilities, scores, top_fraction=0.1):
+    """How well `scores` recover the ranking of `true_utilities`."""
+    n = len(true_utilities)
+    k = max(1, int(round(n * top_fraction)))
+    true_rank = np.argsort(np.argsort(-true_utilities, kind="stable"), kind="stable")
+    est_rank = np.argsort(np.argsort(-scores, kind="stable"), kind="stable")
+    top_true = set(np.argsort(-true_utilities, kind="stable")[:k].tolist())
+    top_est = set(np.argsort(-scores, kind="stable")[:k].tolist())
+    return {
+        "spearman": float(spearmanr(true_utilities, scores)[0]),
+        "kendall": float(kendalltau(true_utilities, scores)[0]),
+        "top_recall": len(top_true & top_est) / k,
+        "mean_abs_rank_error": float(np.abs(true_rank - est_rank).mean()),
+    }
+
+
+def run_replication(seed, sets, n_participants, n_trials, tau, methods):
+    """One replication: fresh utilities and answers, every method scored."""
+    rng = np.random.default_rng(seed)
+    sets = sets[:n_trials]
+    n_items = int(sets.max()) + 1
+    utilities = rng.standard_normal(n_items)
+
+    started = time.perf_counter()
+    best, worst = simulate_choices(sets, n_participants, utilities, tau, rng)
+    simulate_seconds = time.perf_counter() - started
+
+    shown = np.bincount(sets.ravel(), minlength=n_items) > 0  # stimuli outside the truncated design
+    rows = []
+    for method in methods:
+        started = time.perf_counter()
+        scores = score(method, sets, best, worst, n_items)
+        rows.append({
+            "participants": n_participants,
+            "trials": len(sets),
+            "method": method,
+            **recovery_metrics(utilities[shown], np.asarray(scores)[shown]),
+            "choices": best.size,
+            "simulate_s": simulate_seconds,
+            "score_s": time.perf_counter() - started,
+        })
+    return rows
+
+
+def simulate_study(sets, participants, trials, replications=20, tau=0.0, methods=METHODS,
+                   workers=None, seed=None):
+    """
+    Run `replications` simulations for every (participants, trials) combination.
+
+    Parameters:
+        sets (np.ndarray): (n_sets, set_size) resource ids of the design.
+        participants (list of int): Participant counts to try.
+        trials (list of int): Trials per participant to try (first n sets; None = all).
+        replications (int): Replications per combination.
+        tau (float): SD of the per-participant utility deviations.
+        methods (tuple of str): Scoring methods (see METHODS).
+        workers (int, optional): Worker processes. Defaults to os.cpu_count().
+        seed (int, optional): Seed for reproducible runs.
+
+    Returns:
+        pd.DataFrame: One row per replication and method.
+    """
+    _, dense_sets = np.unique(sets, return_inverse=True)
+    dense_sets = dense_sets.reshape(sets.shape)
+    combos = [(p, t or len(dense_sets)) for p in participants for t in trials]
+    seeds = np.random.SeedSequence(seed).spawn(len(combos) * replications)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [
+            pool.submit(run_replication, seeds[i * replications + r], dense_sets, p, t, tau, methods)
+            for i, (p, t) in enumerate(combos)
+            for r in range(replications)
+        ]
+        rows = [row for future in futures for row in future.result()]
+    return pd.DataFrame(rows)
+
+
+def summarize(df_results):
+    """Mean and SD of the recovery metrics per participants/trials/method."""
+    metrics = ["spearman", "kendall", "top_recall", "mean_abs_rank_error"]
+    summary = df_results.groupby(["participants", "trials", "method"], sort=True)[metrics].agg(["mean", "std"])
+    summary.columns = [f"{metric}_{stat}" for metric, stat in summary.columns]
+    return summary.reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate participants to size a study and compare scoring methods.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--sequence-id", type=int, help="Use the design of this sequence.")
+    group.add_argument("--folder-path", help="Generate a design over the resources in this folder.")
+    group.add_argument("--n-stimuli", type=int, help="Generate a design over this many synthetic stimuli.")
+    parser.add_argument("--repeats", type=int, default=3, help="Generated designs: appearances per stimulus.")
+    parser.add_argument("--set-size", type=int, default=5, help="Generated designs: stimuli per set.")
+    parser.add_argument("--participants", type=int, nargs="+", default=[20])
+    parser.add_argument("--trials", type=int, nargs="+", default=None,
+                        help="Trials per participant to try (default: the whole design).")
+    parser.add_argument("--replications", type=int, default=20)
+    parser.add_argument("--tau", type=float, default=0.0, help="SD of participant deviations from the population.")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Write every replication to this CSV file.")
+    args = parser.parse_args()
+
+    if args.n_stimuli is not None:
+        sets = generated_design(range(args.n_stimuli), args.repeats, args.set_size, args.seed)
+    else:
+        db_manager = DBManager()
+        try:
+            db_manager.connect()
+            if args.sequence_id is not None:
+                sets = load_design(db_manager, args.sequence_id)
+            else:
+                stimuli_ids = load_stimuli(db_manager, args.folder_path)
+                sets = generated_design(stimuli_ids, args.repeats, args.set_size, args.seed) if stimuli_ids else None
+        finally:
+            db_manager.close()
+    if sets is None or len(sets) == 0:
+        print("No design found.")
+        return
+    logger.info(f"Design: {len(sets)} sets of {sets.shape[1]} over {len(np.unique(sets))} stimuli")
+
+    started = time.perf_counter()
+    df_results = simulate_study(sets, args.participants, args.trials or [None], args.replications,
+                                args.tau, tuple(args.methods), args.workers, args.seed)
+    n_choices = df_results.drop_duplicates(["participants", "trials"])["choices"].sum() * args.replications
+    logger.info(f"Simulated {n_choices} choices and scored them in {time.perf_counter() - started:.1f}s")
+
+    print(summarize(df_results).to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    if args.output:
+        df_results.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
@@ -4,17 +4,21 @@ import random
 import pandas as pd
 import datetime
 
-from PyQt5.QtCore import Qt, QUrl
-from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
+from PyQt5.QtCore import Qt, QUrl, QBuffer, QByteArray, QIODevice
+from PyQt5.QtMultimedia import QAudio, QAudioFormat, QAudioOutput, QMediaPlayer, QMediaContent
+from sqlalchemy.exc import IntegrityError
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QTableWidget,
     QTableWidgetItem, QPushButton, QLabel, QMessageBox, QRadioButton,
     QButtonGroup, QInputDialog
 )
 
+from audio_cache import AudioCache
 from database_utils import DBManager  # Your DB manager
+from scoring import DeltaRuleScorer
 
 ALPHA = 0.1  # Learning rate
+AUDIO_CACHE_BYTES = 256 * 1024 * 1024  # decoded PCM kept in memory
 
 class ExperimentWindow(QMainWindow):
     def __init__(self, sequence_id=1):
@@ -25,7 +29,7 @@ class ExperimentWindow(QMainWindow):
         self.sequence_id = sequence_id
 
         # 1) Connect to DB and ask for participant name
-        engine = self.db_manager.connect()
+        self.db_manager.connect()
         participant_name, ok = QInputDialog.getText(self, "Participant Name", "Please enter your name:")
         if not ok or not participant_name.strip():
             QMessageBox.critical(self, "Error", "A participant name is required!")
@@ -33,9 +37,12 @@ class ExperimentWindow(QMainWindow):
         self.participant_name = participant_name.strip()
         self.participant_id = self.get_or_create_participant(self.participant_name)
 
-        # 2) Read from 'sequence_view' and filter for sequence_id
-        df_view = self.db_manager.read_table("sequence_view", engine)
-        df_view = df_view[df_view["sequence_id"] == sequence_id].copy()
+        # 2) Read only this sequence from 'sequence_view'
+        df_view = self.db_manager.read_query(
+            "SELECT trial, index_order, resource_id, folder_path, resource_filenames "
+            "FROM sequence_view WHERE sequence_id = :sequence_id ORDER BY trial, index_order",
+            params={"sequence_id": sequence_id},
+        )
         if df_view.empty:
             QMessageBox.critical(self, "Error", f"No rows found in 'sequence_view' for sequence_id={sequence_id}")
             sys.exit(1)
@@ -50,28 +57,26 @@ class ExperimentWindow(QMainWindow):
             full_path = os.path.join(folder_path, filename)
             self.audio_map[res_id] = full_path
 
-        # 4) Sort by trial/index_order and group
-        df_view.sort_values(["trial", "index_order"], inplace=True)
-        df_view.reset_index(drop=True, inplace=True)
-
+        # 4) Group by trial (the query already sorted by trial/index_order)
         # Build a list of trials: each trial is a list of resource IDs
-        self.trials = []
-        grouped = df_view.groupby("trial")
-        for trial_id, group_df in grouped:
-            group_df = group_df.sort_values("index_order")
-            resource_ids_this_trial = list(group_df["resource_id"])
-            self.trials.append(resource_ids_this_trial)
-
-        # 5) Initialize self.V keyed by resource_id (one entry per unique resource)
+        self.trials = [list(group_df["resource_id"]) for _, group_df in df_view.groupby("trial", sort=True)]
+
+        # 5) Initialize the delta-rule scores (one entry per unique resource)
         unique_res_ids = df_view["resource_id"].unique()
-        self.V = {res_id: 0 for res_id in unique_res_ids}
+        self.scorer = DeltaRuleScorer(unique_res_ids, alpha=ALPHA)
 
-        # 6) Trial counters, etc.
-        self.current_trial_index = 0
+        # 6) Trial counters, etc. A participant who already answered part of
+        #    the sequence resumes after their answers (replayed into the scores)
         self.N_TRIALS = len(self.trials)
+        self.answered = self.replay_answered_trials()
+        self.current_trial_index = self.next_unanswered_trial(0)
         print(self.trials)
 
-        # 7) Set up UI
+        # 7) Set up audio: decoded clips are preloaded in the background and
+        #    played from memory; QMediaPlayer is only the fallback for non-WAV files
+        self.audio_cache = AudioCache(AUDIO_CACHE_BYTES)
+        self.audio_output = None
+        self.audio_buffer = None
         self.player = QMediaPlayer()
         self.player.setVolume(100)
 
@@ -96,35 +101,75 @@ class ExperimentWindow(QMainWindow):
         self.update_display_for_trial()
 
     def __del__(self):
+        self.audio_cache.close()
         self.db_manager.close()
 
+    def find_participant(self, participant_name):
+        """
+        Look up a participant by name (indexed). Returns its id or None.
+        """
+        df = self.db_manager.read_query(
+            "SELECT id FROM participants WHERE participant_name = :name ORDER BY id LIMIT 1",
+            params={"name": participant_name},
+            use_primary=True,
+        )
+        return None if df.empty else int(df.iloc[0]["id"])
+
     def get_or_create_participant(self, participant_name):
         """
         Look up a participant by name; if not found, insert a new row and return its id.
         """
-        df_participants = self.db_manager.read_table("participants")
-        existing = df_participants[df_participants["participant_name"] == participant_name]
-        if not existing.empty:
-            participant_id = int(existing.iloc[0]["id"])
-        else:
+        participant_id = self.find_participant(participant_name)
+        if participant_id is None:
             new_participant_df = pd.DataFrame([{"participant_name": participant_name}])
             self.db_manager.append_table("participants", new_participant_df)
-            df_participants = self.db_manager.read_table("participants")
-            new_entry = df_participants[df_participants["participant_name"] == participant_name]
-            if new_entry.empty:
+            participant_id = self.find_participant(participant_name)
+            if participant_id is None:
                 raise Exception("Failed to add new participant.")
-            participant_id = int(new_entry.iloc[0]["id"])
         return participant_id
 
+    def replay_answered_trials(self):
+        """
+        Replay this participant's stored answers for the sequence into the
+        scores. Returns the set of answered trial indices.
+        """
+        df_results = self.db_manager.read_query(
+            "SELECT trial_index, best_stimulus, worst_stimulus FROM trial_results "
+            "WHERE participant_id = :participant_id AND sequence_id = :sequence_id "
+            "AND trial_index < :n_trials ORDER BY id",
+            params={"participant_id": self.participant_id, "sequence_id": self.sequence_id,
+                    "n_trials": self.N_TRIALS},
+            use_primary=True,
+        )
+        if not df_results.empty:
+            self.scorer.replay(
+                [self.trials[i] for i in df_results["trial_index"]],
+                df_results["best_stimulus"].to_numpy(dtype=float),
+                df_results["worst_stimulus"].to_numpy(dtype=float),
+            )
+        return set(df_results["trial_index"].astype(int))
+
+    def next_unanswered_trial(self, start):
+        """First trial index >= start this participant has not answered (N_TRIALS if none)."""
+        return next((i for i in range(start, self.N_TRIALS) if i not in self.answered), self.N_TRIALS)
+
+    def preload_trials(self):
+        """
+        Queue the current and the next trial's stimuli for background decoding.
+        """
+        upcoming = self.trials[self.current_trial_index:self.current_trial_index + 2]
+        self.audio_cache.prefetch([self.audio_map[res_id] for trial in upcoming for res_id in trial])
+
     def update_display_for_trial(self):
         """
         Show the stimuli in the current trial as rows in the table.
         """
-        self.player.stop()
+        self.stop_sound()
 
         if self.current_trial_index >= self.N_TRIALS:
             self.show_final_results()
             return
+        self.preload_trials()
 
         # resource_ids_for_this_trial is a list of resource IDs
         resource_ids_for_this_trial = self.trials[self.current_trial_index]
@@ -161,10 +206,48 @@ class ExperimentWindow(QMainWindow):
         self.table_widget.resizeColumnsToContents()
 
     def play_sound(self, path):
-        url = QUrl.fromLocalFile(path)
-        print(url)
-        self.player.setMedia(QMediaContent(url))
-        self.player.play()
+        """
+        Play a stimulus from the in-memory cache (decoded PCM through
+        QAudioOutput). Clips that are not decoded yet, and files that are not
+        plain WAV, are streamed through QMediaPlayer so the UI never waits.
+        """
+        self.stop_sound()
+        clip = self.audio_cache.get(path)
+        if clip is None:
+            url = QUrl(path) if path.startswith(("http://", "https://")) else QUrl.fromLocalFile(path)
+            self.player.setMedia(QMediaContent(url))
+            self.player.play()
+            return
+
+        audio_format = QAudioFormat()
+        audio_format.setSampleRate(clip.sample_rate)
+        audio_format.setChannelCount(clip.channels)
+        audio_format.setSampleSize(8 * clip.sample_width)
+        audio_format.setCodec("audio/pcm")
+        audio_format.setByteOrder(QAudioFormat.LittleEndian)
+        # WAV stores 8-bit samples unsigned, wider ones signed
+        audio_format.setSampleType(QAudioFormat.UnSignedInt if clip.sample_width == 1 else QAudioFormat.SignedInt)
+
+        # Reuse the open output device while the format stays the same
+        if self.audio_output is None or self.audio_output.format() != audio_format:
+            if self.audio_output is not None:
+                self.audio_output.deleteLater()
+            self.audio_output = QAudioOutput(audio_format, self)
+            self.audio_output.setVolume(1.0)
+
+        self.audio_buffer = QBuffer(self)
+        self.audio_buffer.setData(QByteArray(clip.pcm))
+        self.audio_buffer.open(QIODevice.ReadOnly)
+        self.audio_output.start(self.audio_buffer)
+
+    def stop_sound(self):
+        self.player.stop()
+        if self.audio_output is not None and self.audio_output.state() != QAudio.StoppedState:
+            self.audio_output.stop()
+        if self.audio_buffer is not None:
+            self.audio_buffer.close()
+            self.audio_buffer.deleteLater()
+            self.audio_buffer = None
 
     def submit_choice(self):
         if self.current_trial_index >= self.N_TRIALS:
@@ -188,34 +271,38 @@ class ExperimentWindow(QMainWindow):
         best_res_id = resource_ids_for_this_trial[best_row]
         worst_res_id = resource_ids_for_this_trial[worst_row]
 
-        # Update 'best'
-        for other_res_id in resource_ids_for_this_trial:
-            if other_res_id != best_res_id:
-                error = 1 - (self.V[best_res_id] - self.V[other_res_id])
-                self.V[best_res_id] += ALPHA * error
-
-        # Update 'worst'
-        for other_res_id in resource_ids_for_this_trial:
-            if other_res_id != worst_res_id:
-                error = 0 - (self.V[worst_res_id] - self.V[other_res_id])
-                self.V[worst_res_id] += ALPHA * error
-
-        # Insert into trial_results
-        df_trial = pd.DataFrame([{
-            "participant_id": self.participant_id,
-            "sequence_id": self.sequence_id,
-            "trial_index": self.current_trial_index,
-            "best_stimulus": best_res_id,
-            "worst_stimulus": worst_res_id,
-            "submitted_at": datetime.datetime.now()
-        }])
-        self.db_manager.append_table("trial_results", df_trial)
-
-        self.current_trial_index += 1
+        # Insert into trial_results; the unique (participant, sequence, trial)
+        # index rejects a trial this participant already answered elsewhere
+        try:
+            self.db_manager.execute_query(
+                "INSERT INTO trial_results "
+                "(participant_id, sequence_id, trial_index, best_stimulus, worst_stimulus, submitted_at) "
+                "VALUES (:participant_id, :sequence_id, :trial_index, :best_stimulus, :worst_stimulus, :submitted_at)",
+                params={
+                    "participant_id": self.participant_id,
+                    "sequence_id": self.sequence_id,
+                    "trial_index": self.current_trial_index,
+                    "best_stimulus": int(best_res_id),
+                    "worst_stimulus": int(worst_res_id),
+                    "submitted_at": datetime.datetime.now(),
+                },
+            )
+        except IntegrityError:
+            QMessageBox.information(
+                self, "Already Answered",
+                f"Trial {self.current_trial_index + 1} was already submitted for {self.participant_name}; "
+                "continuing with the next unanswered trial.",
+            )
+        else:
+            # Update 'best' and 'worst' in one vectorized step
+            self.scorer.update(resource_ids_for_this_trial, best_res_id, worst_res_id)
+
+        self.answered.add(self.current_trial_index)
+        self.current_trial_index = self.next_unanswered_trial(self.current_trial_index + 1)
         self.update_display_for_trial()
 
     def show_final_results(self):
-        self.player.stop()
+        self.stop_sound()
 
         # Clear layout
         for i in reversed(range(self.main_layout.count())):
@@ -226,9 +313,8 @@ class ExperimentWindow(QMainWindow):
         final_label = QLabel("Final Ranking (Best to Worst):")
         self.main_layout.addWidget(final_label)
 
-        # Sort self.V by descending strength
-        sorted_stimuli = sorted(self.V.items(), key=lambda x: x[1], reverse=True)
-        print(self.V)
+        # Sort scores by descending strength
+        sorted_stimuli = self.scorer.ranking()
         print(sorted_stimuli)
         # e.g. [(resource_id, final_score), ...]
 
@@ -0,0 +1,170 @@
+# trial_bundles.py
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from wire_format import brotli, compact_trials
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Static pre-published trial bundles
+################################################################################
+# A generated sequence never changes, so its /api/trials/<sequence_id> payload
+# can be rendered once and served by nginx straight from disk:
+#
+#   <bundle_dir>/trials/<sequence_id>.json                  full payload
+#   <bundle_dir>/trials/<sequence_id>.compact.json          ?format=compact
+#   <bundle_dir>/trials/<sequence_id>-<version>[.compact].json   immutable copies
+#
+# each with .gz (nginx gzip_static) and, when brotli is installed, .br siblings.
+# <version> is a hash of the compact payload; the unversioned names are swapped
+# in atomically (os.replace), so a re-publish never serves a half-written file.
+# When a bundle is missing nginx falls back to the Flask endpoint.
+
+BUNDLE_DIR = os.getenv("BUNDLE_DIR")
+
+
+def load_trials(db_manager, sequence_id):
+    """
+    Read one sequence from "sequence_view" and return (trials, audio_map),
+    or (None, None) if the sequence has no rows.
+    """
+    df_view = db_manager.read_query(
+        "SELECT trial, index_order, resource_id, resource_folder_paths "
+        "FROM sequence_view WHERE sequence_id = :sequence_id ORDER BY trial, index_order",
+        params={"sequence_id": sequence_id},
+    )
+    if df_view.empty:
+        return None, None
+
+    # Each trial: [resource_id1, resource_id2, ...]
+    trials = [gdf["resource_id"].tolist() for _, gdf in df_view.groupby("trial", sort=True)]
+    audio_map = dict(zip(df_view["resource_id"].tolist(), df_view["resource_folder_paths"].tolist()))
+    return trials, audio_map
+
+
+def render_bundles(trials, audio_map):
+    """
+    Serialise the full and compact payloads exactly as the Flask endpoint does.
+
+    Returns:
+        (str, dict): version, and { suffix: json bytes } for "" and ".compact".
+    """
+    full = {"trials": trials, "audio_map": {str(k): v for k, v in audio_map.items()}}
+    compact = compact_trials(trials, audio_map)
+    bodies = {
+        "": json.dumps(full, separators=(",", ":")).encode("utf-8"),
+        ".compact": json.dumps(compact, separators=(",", ":")).encode("utf-8"),
+    }
+    version = hashlib.sha256(bodies[".compact"]).hexdigest()[:12]
+    return version, bodies
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_encoded(path, data):
+    """Write `data` plus its pre-compressed siblings. The plain file goes last:
+    nginx's try_files checks it, so the .gz/.br are in place once it exists."""
+    _write_atomic(f"{path}.gz", gzip.compress(data, compresslevel=9))
+    if brotli is not None:
+        _write_atomic(f"{path}.br", brotli.compress(data, quality=11))
+    _write_atomic(path, data)
+
+
+def publish_bundle(sequence_id, trials, audio_map, bundle_dir=None, overwrite=True):
+    """
+    Write the static bundles of one sequence under <bundle_dir>/trials/.
+
+    Parameters:
+        overwrite (bool): If False, leave an already published bundle alone.
+
+    Returns:
+        str: The bundle version, or None if no bundle directory is configured
+        (or the bundle exists and overwrite is False).
+    """
+    bundle_dir = bundle_dir or BUNDLE_DIR
+    if not bundle_dir:
+        return None
+
+    out_dir = os.path.join(bundle_dir, "trials")
+    if not overwrite and all(
+        os.path.exists(os.path.join(out_dir, f"{sequence_id}{suffix}.json")) for suffix in ("", ".compact")
+    ):
+        return None
+    os.makedirs(out_dir, exist_ok=True)
+    version, bodies = render_bundles(trials, audio_map)
+    for suffix, data in bodies.items():
+        versioned = os.path.join(out_dir, f"{sequence_id}-{version}{suffix}.json")
+        if not os.path.exists(versioned):
+            _write_encoded(versioned, data)
+        _write_encoded(os.path.join(out_dir, f"{sequence_id}{suffix}.json"), data)
+
+    logger.info(f"Published trial bundle for sequence {sequence_id} (version {version})")
+    return version
+
+
+def publish_sequence(db_manager, sequence_id, bundle_dir=None):
+    """Load a sequence from the database and publish its bundles (None if it has no rows)."""
+    trials, audio_map = load_trials(db_manager, sequence_id)
+    if trials is None:
+        return None
+    return publish_bundle(sequence_id, trials, audio_map, bundle_dir)
+
+
+def remove_bundle(sequence_id, bundle_dir=None):
+    """Delete every published file of a sequence so nginx falls back to Flask."""
+    bundle_dir = bundle_dir or BUNDLE_DIR
+    out_dir = os.path.join(bundle_dir or "", "trials")
+    if not bundle_dir or not os.path.isdir(out_dir):
+        return
+    prefixes = (f"{sequence_id}.", f"{sequence_id}-")
+    for name in os.listdir(out_dir):
+        if name.startswith(prefixes):
+            os.remove(os.path.join(out_dir, name))
+
+
+def main():
+    import argparse
+    from database_utils import DBManager
+
+    parser = argparse.ArgumentParser(description="Publish static /api/trials bundles for nginx.")
+    parser.add_argument("sequence_ids", type=int, nargs="*",
+                        help="Sequences to publish (default: every fixed sequence).")
+    parser.add_argument("--bundle-dir", default=BUNDLE_DIR, required=BUNDLE_DIR is None,
+                        help="Output directory (default: $BUNDLE_DIR).")
+    parser.add_argument("--remove", action="store_true", help="Delete the bundles instead.")
+    args = parser.parse_args()
+
+    db_manager = DBManager()
+    try:
+        db_manager.connect()
+        sequence_ids = args.sequence_ids
+        if not sequence_ids:
+            df = db_manager.read_query("SELECT sequence_id FROM sequence_info WHERE n_trials > 0")
+            sequence_ids = df["sequence_id"].astype(int).tolist()
+        for sequence_id in sequence_ids:
+            if args.remove:
+                remove_bundle(sequence_id, args.bundle_dir)
+                print(f"Removed bundle for sequence {sequence_id}.")
+                continue
+            version = publish_sequence(db_manager, sequence_id, args.bundle_dir)
+            if version is None:
+                print(f"No rows found for sequence_id={sequence_id}, skipped.")
+            else:
+                print(f"Published sequence {sequence_id} (version {version}).")
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,110 @@
+# wire_format.py
+
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+################################################################################
+# Compact trials payload
+################################################################################
+# The default payload repeats the full audio URL of every resource and nests
+# trials as lists of lists. The compact form factors out the common URL prefix
+# and sends trials as one flat array of indices into `resource_ids` plus offsets:
+#
+#   {
+#     "format": "compact-v1",
+#     "base_url": "https://dataset-guitar.s3.../Guitar/",
+#     "resource_ids": [11, 12, 13, ...],
+#     "paths": ["a.wav", "b.wav", ...],       # base_url + paths[i] = audio of resource_ids[i]
+#     "items": [0, 2, 5, 1, ...],             # indices into resource_ids
+#     "offsets": [0, 5, 10, ...]              # trial t = items[offsets[t]:offsets[t+1]]
+#   }
+
+COMPACT_FORMAT = "compact-v1"
+COMPACT_MEDIA_TYPE = "application/vnd.listenq.compact+json"
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_MEDIA_TYPES = ("application/json", COMPACT_MEDIA_TYPE)
+
+
+def wants_compact(request):
+    """True if the client asked for the compact format (?format=compact or Accept header)."""
+    if request.args.get("format") == "compact":
+        return True
+    return COMPACT_MEDIA_TYPE in request.headers.get("Accept", "")
+
+
+def compact_trials(trials, audio_map):
+    """Encode (trials, audio_map) as the compact payload described above."""
+    resource_ids = sorted({int(r) for r in audio_map} | {int(r) for trial in trials for r in trial})
+    position = {res_id: i for i, res_id in enumerate(resource_ids)}
+    paths = [str(audio_map.get(res_id, "")) for res_id in resource_ids]
+
+    # Common prefix, cut back to the last "/" so it stays a directory/URL base
+    base_url = os.path.commonprefix(paths) if len(paths) > 1 else ""
+    base_url = base_url[:base_url.rfind("/") + 1]
+
+    items, offsets = [], [0]
+    for trial in trials:
+        items.extend(position[int(r)] for r in trial)
+        offsets.append(len(items))
+
+    return {
+        "format": COMPACT_FORMAT,
+        "base_url": base_url,
+        "resource_ids": resource_ids,
+        "paths": [p[len(base_url):] for p in paths],
+        "items": items,
+        "offsets": offsets,
+    }
+
+
+################################################################################
+# Response compression
+################################################################################
+def _accepted_encodings(request):
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def compress_response(request, response):
+    """
+    Compress JSON responses above COMPRESS_MIN_BYTES with brotli (if installed
+    and accepted) or gzip. Meant to be registered as a Flask after_request hook.
+    """
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code >= 300
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESS_MEDIA_TYPES
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    accepted = _accepted_encodings(request)
+    if brotli is not None and "br" in accepted:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers["Content-Encoding"] = "br"
+    elif "gzip" in accepted:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        return response
+
+    response.headers["Content-Length"] = str(len(response.get_data()))
+    response.vary.add("Accept-Encoding")
+    return response
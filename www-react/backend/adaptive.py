@@ -0,0 +1,173 @@
+# adaptive.py
+
+import math
+import numpy as np
+
+################################################################################
+# Adaptive (active-learning) trial selection
+################################################################################
+# Instead of walking through a fixed list of trials from the "sequences" table,
+# an adaptive session keeps a Gaussian estimate (mean + variance) of every
+# stimulus utility for one participant and picks the next choice set that is
+# expected to teach us the most about those utilities.
+#
+# Model: best is chosen with softmax(u) over the set, worst with softmax(-u).
+# After each answer the estimates get one diagonal Laplace (assumed-density)
+# update. The expected information gain of a candidate set S is
+#
+#     sum_{i in S} 0.5 * log(1 + var_i * fisher_i)
+#
+# where fisher_i = p_best_i * (1 - p_best_i) + p_worst_i * (1 - p_worst_i).
+# All candidates are scored at once as (n_candidates, set_size) arrays.
+#
+# Stopping: the precision target is what the fixed design of
+# sequence_generator.py gives (DEFAULT_REPEATS appearances per stimulus in sets
+# of equally liked stimuli, fisher = 2/k * (1 - 1/k)). A session ends once the
+# best candidate set is expected to teach less than a set whose stimuli are all
+# at that precision (min_gain), or every SD is below it (sd_tolerance). Sets of
+# stimuli with very different utilities carry little information, so stimuli
+# that are clearly at the top or bottom stop being asked about first.
+# max_trials (DEFAULT_MAX_REPEATS appearances per stimulus) is only a safety cap.
+
+DEFAULT_N_CANDIDATES = 256
+DEFAULT_PRIOR_VAR = 1.0
+DEFAULT_REPEATS = 3      # Precision target: the fixed design of sequence_generator.py
+DEFAULT_MAX_REPEATS = 6  # Hard cap on the session length
+
+
+def target_variance(set_size, prior_var=DEFAULT_PRIOR_VAR, repeats=DEFAULT_REPEATS):
+    """Posterior variance of a stimulus after `repeats` appearances among equally liked stimuli."""
+    p = 1.0 / set_size
+    return 1.0 / (1.0 / prior_var + repeats * 2.0 * p * (1.0 - p))
+
+
+def _softmax(x, axis=-1):
+    z = x - x.max(axis=axis, keepdims=True)
+    np.exp(z, out=z)
+    z /= z.sum(axis=axis, keepdims=True)
+    return z
+
+
+def expected_information_gain(mu, var, candidates):
+    """
+    Score candidate choice sets by expected information gain.
+
+    Parameters:
+        mu (np.ndarray): Current utility means, shape (n_stimuli,).
+        var (np.ndarray): Current utility variances, shape (n_stimuli,).
+        candidates (np.ndarray): Dense stimulus indices, shape (n_candidates, set_size).
+
+    Returns:
+        np.ndarray: Gain per candidate, shape (n_candidates,).
+    """
+    u = mu[candidates]
+    p_best = _softmax(u, axis=1)
+    p_worst = _softmax(-u, axis=1)
+    fisher = p_best * (1.0 - p_best) + p_worst * (1.0 - p_worst)
+    return 0.5 * np.log1p(var[candidates] * fisher).sum(axis=1)
+
+
+def sample_candidate_sets(var, set_size, n_candidates, rng):
+    """
+    Draw `n_candidates` sets of `set_size` distinct stimuli, favouring the
+    stimuli we are least sure about (weighted sampling without replacement,
+    Efraimidis-Spirakis keys, one argpartition over the whole matrix).
+
+    Returns:
+        np.ndarray: Dense stimulus indices, shape (n_candidates, set_size).
+    """
+    weights = np.sqrt(var)
+    keys = np.log(rng.random((n_candidates, var.shape[0]))) / weights
+    return np.argpartition(-keys, set_size - 1, axis=1)[:, :set_size]
+
+
+class AdaptiveSession:
+    """
+    Per-participant state for adaptive trial selection over a pool of resources.
+    """
+    def __init__(self, resource_ids, set_size, max_trials=None, min_trials=None,
+                 prior_var=DEFAULT_PRIOR_VAR, sd_tolerance=None,
+                 min_gain=None, n_candidates=DEFAULT_N_CANDIDATES, seed=None):
+        self.resource_ids = np.asarray(resource_ids, dtype=np.int64)
+        n_stimuli = self.resource_ids.shape[0]
+        if n_stimuli < set_size:
+            raise ValueError(f"Pool has {n_stimuli} resources, fewer than set_size={set_size}.")
+
+        self.index = {int(res_id): i for i, res_id in enumerate(self.resource_ids)}
+        self.set_size = int(set_size)
+        self.max_trials = max_trials or math.ceil(DEFAULT_MAX_REPEATS * n_stimuli / set_size)
+        self.min_trials = min_trials if min_trials is not None else math.ceil(n_stimuli / set_size)
+        # Defaults: stop at the precision of the fixed design (see the module comment)
+        var_target = target_variance(set_size, prior_var)
+        p = 1.0 / set_size
+        self.sd_tolerance = sd_tolerance if sd_tolerance is not None else math.sqrt(var_target)
+        self.min_gain = min_gain if min_gain is not None else (
+            0.5 * set_size * math.log1p(var_target * 2.0 * p * (1.0 - p))
+        )
+        self.n_candidates = n_candidates
+        self.rng = np.random.default_rng(seed)
+
+        self.mu = np.zeros(n_stimuli)
+        self.var = np.full(n_stimuli, float(prior_var))
+        self.trial_count = 0
+        self.pending = None      # resource ids of the set handed out but not yet answered
+        self.last_gain = np.inf  # gain of the most recently selected set
+
+    def next_set(self):
+        """
+        Return the resource ids of the next choice set, or None once the
+        estimates have converged. Repeated calls without an answer return
+        the same pending set.
+        """
+        if self.pending is not None:
+            return self.pending
+        if self.is_converged():
+            return None
+
+        candidates = sample_candidate_sets(self.var, self.set_size, self.n_candidates, self.rng)
+        gains = expected_information_gain(self.mu, self.var, candidates)
+        best = int(np.argmax(gains))
+        self.last_gain = float(gains[best])
+        if self.trial_count >= self.min_trials and self.last_gain < self.min_gain:
+            return None
+
+        self.pending = [int(r) for r in self.resource_ids[candidates[best]]]
+        return self.pending
+
+    def observe(self, resource_ids, best_res_id, worst_res_id):
+        """
+        Update the estimates with one answered trial. A skipped trial
+        (best/worst missing) still counts towards the trial budget.
+        """
+        self.trial_count += 1
+        self.pending = None
+        if best_res_id is None or worst_res_id is None:
+            return
+
+        idx = np.fromiter((self.index[int(r)] for r in resource_ids), dtype=np.int64)
+        u = self.mu[idx]
+        v = self.var[idx]
+        best_mask = idx == self.index[int(best_res_id)]
+        worst_mask = idx == self.index[int(worst_res_id)]
+
+        p_best = _softmax(u)
+        p_worst = _softmax(-u)
+        grad = (best_mask - p_best) - (worst_mask - p_worst)
+        fisher = p_best * (1.0 - p_best) + p_worst * (1.0 - p_worst)
+
+        v_new = 1.0 / (1.0 / v + fisher)
+        self.var[idx] = v_new
+        self.mu[idx] = u + v_new * grad
+
+    def is_converged(self):
+        if self.trial_count >= self.max_trials:
+            return True
+        if self.trial_count < self.min_trials:
+            return False
+        return float(np.sqrt(self.var).max()) < self.sd_tolerance
+
+    def ranking(self):
+        """Return [(resource_id, utility, sd), ...] sorted best to worst."""
+        order = np.argsort(-self.mu)
+        sd = np.sqrt(self.var)
+        return [(int(self.resource_ids[i]), float(self.mu[i]), float(sd[i])) for i in order]
@@ -0,0 +1,145 @@
+# admission.py
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import jsonify, request
+
+################################################################################
+# Admission control for the write endpoints
+################################################################################
+# A burst of submissions (a whole class pressing Submit together) should not
+# all pile onto the database at once. Each guarded endpoint gets:
+#
+#   - at most `max_concurrent` requests executing at a time (per worker),
+#   - a short wait queue of at most `max_queue` requests, each waiting no
+#     longer than `queue_timeout` seconds for a slot,
+#   - per-participant token buckets (`rate` requests/s, `burst` deep).
+#
+# Requests that cannot be admitted are answered at once with 503 (overloaded)
+# or 429 (this participant is too fast), both with a Retry-After header, and
+# the frontend retries them with jitter (src/fetchWithRetry.js).
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2.0"))
+PARTICIPANT_RATE = float(os.getenv("PARTICIPANT_RATE", "2.0"))    # requests per second
+PARTICIPANT_BURST = float(os.getenv("PARTICIPANT_BURST", "5"))
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted; carries the HTTP status and Retry-After."""
+    def __init__(self, status, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.message = message
+
+
+class AdmissionGate:
+    """
+    Bounded concurrency with a bounded, deadline-limited wait queue.
+    """
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    def _retry_after(self):
+        # Rough time for the queue ahead to drain, at least one second
+        return max(1, math.ceil(self.queue_timeout * (self.waiting + 1) / max(self.max_concurrent, 1)))
+
+    def acquire(self):
+        with self._cond:
+            if self.active < self.max_concurrent:
+                self.active += 1
+                return
+            if self.waiting >= self.max_queue:
+                raise Rejected(503, self._retry_after(), "Server busy, please retry")
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Rejected(503, self._retry_after(), "Server busy, please retry")
+                    self._cond.wait(remaining)
+                self.active += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class TokenBuckets:
+    """
+    One token bucket per key (participant), kept in a bounded LRU so idle
+    participants do not accumulate.
+    """
+    def __init__(self, rate=PARTICIPANT_RATE, burst=PARTICIPANT_BURST, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, last refill time)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Consume one token for `key`, or raise Rejected(429) with the wait time."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1.0:
+                self._buckets[key] = (tokens, now)
+                raise Rejected(429, max(1, math.ceil((1.0 - tokens) / self.rate)), "Too many requests, slow down")
+            self._buckets[key] = (tokens - 1.0, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+
+def participant_key():
+    """Rate-limit key of the current request: its participant_name, else the client address."""
+    data = request.get_json(silent=True) or {}
+    return data.get("participant_name") or request.headers.get("X-Real-IP") or request.remote_addr
+
+
+def admission_controlled(gate=None, buckets=None, key_func=participant_key):
+    """
+    Decorator for Flask views: rate-limit per participant, then wait for a
+    slot in `gate` (a fresh AdmissionGate per endpoint by default).
+    """
+    gate = gate or AdmissionGate()
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                if buckets is not None:
+                    buckets.take(key_func())
+                gate.acquire()
+            except Rejected as e:
+                response = jsonify({"error": e.message, "retry_after": e.retry_after})
+                response.status_code = e.status
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response
+            try:
+                return view(*args, **kwargs)
+            finally:
+                gate.release()
+
+        wrapper.admission_gate = gate
+        return wrapper
+
+    return decorator
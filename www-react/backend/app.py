@@ -5,7 +5,16 @@ import datetime
 import pandas as pd
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from sqlalchemy.exc import IntegrityError
 from database_utils import DBManager  # Your existing DB logic
+from adaptive import AdaptiveSession
+from admission import TokenBuckets, admission_controlled
+from cache import MISSING, SharedCache
+from live import LiveHub
+from profiling import init_profiling
+from scoring import DeltaRuleScorer
+from trial_bundles import load_trials, publish_bundle
+from wire_format import compact_trials, compress_response, wants_compact
 
 import statsmodels.api as sm
 import numpy as np
@@ -21,86 +30,260 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS so React can call this API from a different domain/port
+app.after_request(lambda response: compress_response(request, response))  # gzip/brotli large JSON
+app.teardown_request(lambda exc: db_manager.reset_read_pin())  # read-your-writes is per request
+init_profiling(app)  # opt-in per request (X-Profile header) or sampled, see profiling.py
 
 db_manager = DBManager()
 ALPHA = 0.1
+SCORE_REORDER_WINDOW = 256  # latest trial_results rows kept to re-apply late ones in id order
+TRIALS_CACHE_TTL = int(os.getenv("TRIALS_CACHE_TTL", "300"))  # seconds
 
 ################################################################################
-# 1) In-memory or DB storage for V (stimuli “value”)
+# 1) Shared storage for V (stimuli “value”) and other per-sequence state
 ################################################################################
-# For a real production app, you'd store these in a database table
-# so that you don't lose them if the server restarts. Here is an in-memory dict:
-V_values = {}  
-# Example: V_values[sequence_id] = { resource_id_1: 0.0, resource_id_2: 0.0, ... }
+# Everything below lives in the cross-worker cache (cache.py), so several
+# worker processes on one host see the same state:
+#
+#   "trials:<sequence_id>"          (trials, audio_map), immutable, TTL'd
+#   "sequence_info:<sequence_id>"   folder_path, choice_set_size, n_trials, TTL'd
+#   "participant:<name>"            participant id
+#   "scores:<sequence_id>"          running delta-rule scores, see load_sequence_scorer()
+#   "adaptive:<sequence_id>:<participant_id>"   AdaptiveSession
+#   "adaptive_pool:<sequence_id>"   { resource_id: audio_path } of the adaptive pool
+#
+# All of it can be rebuilt from the database, so an evicted entry (or a
+# restart) only costs a replay.
+cache = SharedCache()
+
+# Per-participant rate limits, shared by the write endpoints (see admission.py)
+participant_buckets = TokenBuckets()
+
+# One trial_results change feed per sequence, shared by all live dashboards (see live.py)
+live_hub = LiveHub(db_manager)
 
 
 ################################################################################
 # 2) Utility: get or create participant
 ################################################################################
+def find_participant(participant_name):
+    """
+    Look up participant in DB by name (indexed). Returns its ID or None.
+    Found ids are cached (they never change); misses are not.
+    """
+    def query():
+        df = db_manager.read_query(
+            "SELECT id FROM participants WHERE participant_name = :name ORDER BY id LIMIT 1",
+            params={"name": participant_name},
+            use_primary=True,  # a replica lagging behind would make us create a duplicate
+        )
+        return None if df.empty else int(df.iloc[0]["id"])
+
+    return cache.get_or_compute(f"participant:{participant_name}", query)
+
+
 def get_or_create_participant(participant_name):
     """
     Look up participant in DB by name; if not found, create and return its ID.
     """
     db_manager.connect()
-    df_participants = db_manager.read_table("participants")
-    existing = df_participants[df_participants["participant_name"] == participant_name]
-    if not existing.empty:
-        participant_id = int(existing.iloc[0]["id"])
-    else:
+    participant_id = find_participant(participant_name)
+    if participant_id is None:
         new_row = pd.DataFrame([{"participant_name": participant_name}])
         db_manager.append_table("participants", new_row)
-        df_participants = db_manager.read_table("participants")
-        new_entry = df_participants[df_participants["participant_name"] == participant_name]
-        if new_entry.empty:
+        participant_id = find_participant(participant_name)
+        if participant_id is None:
             raise Exception("Failed to add new participant.")
-        participant_id = int(new_entry.iloc[0]["id"])
     return participant_id
 
 
+################################################################################
+# 2b) Utility: delta-rule scores for a sequence, replayed from trial_results
+################################################################################
+def _replayed(blob, rows):
+    """DeltaRuleScorer.loads(blob) with `rows` ((id, trial, best, worst), id order) applied."""
+    scorer = DeltaRuleScorer.loads(blob)
+    if rows:
+        scorer.replay(
+            [row[1] for row in rows],
+            np.array([np.nan if row[2] is None else row[2] for row in rows], dtype=float),
+            np.array([np.nan if row[3] is None else row[3] for row in rows], dtype=float),
+        )
+    return scorer
+
+
+def load_sequence_scorer(sequence_id, resource_ids, trials):
+    """
+    Create a DeltaRuleScorer for the sequence and replay its stored
+    trial_results (in submission order) so scores survive a restart.
+
+    Returns:
+        dict: The cached state:
+            "scorer"          scorer.dumps() with every row applied
+            "last_result_id"  highest trial_results id applied (0 if none)
+            "base", "base_id" the scores up to row base_id
+            "recent"          the rows after base_id, (id, trial, best, worst) in id
+                              order, at most SCORE_REORDER_WINDOW; a row that
+                              arrives late is slotted in here and only these
+                              rows are re-applied
+    """
+    scorer = DeltaRuleScorer(resource_ids, alpha=ALPHA)
+    df_results = db_manager.read_query(
+        "SELECT id, trial_index, best_stimulus, worst_stimulus FROM trial_results "
+        "WHERE sequence_id = :sequence_id AND trial_index < :n_trials ORDER BY id",
+        params={"sequence_id": sequence_id, "n_trials": len(trials)},
+        use_primary=True,  # a lagging replica would miss rows that later updates skip over
+    )
+    split = max(0, len(df_results) - SCORE_REORDER_WINDOW)
+    df_base = df_results.iloc[:split]
+    if not df_base.empty:
+        scorer.replay(
+            [trials[i] for i in df_base["trial_index"]],
+            df_base["best_stimulus"].to_numpy(dtype=float),
+            df_base["worst_stimulus"].to_numpy(dtype=float),
+        )
+    recent = [
+        (int(row.id), trials[row.trial_index],
+         None if pd.isna(row.best_stimulus) else int(row.best_stimulus),
+         None if pd.isna(row.worst_stimulus) else int(row.worst_stimulus))
+        for row in df_results.iloc[split:].itertuples(index=False)
+    ]
+    base = scorer.dumps()
+    return {
+        "scorer": _replayed(base, recent).dumps(),
+        "last_result_id": recent[-1][0] if recent else 0,
+        "base": base,
+        "base_id": int(df_base["id"].iloc[-1]) if not df_base.empty else 0,
+        "recent": recent,
+    }
+
+
+def get_sequence_scorer(sequence_id):
+    """
+    The sequence's DeltaRuleScorer from the shared cache, replayed from
+    trial_results on a miss. Returns None if the sequence has no trials.
+    """
+    def replay():
+        trials, audio_map = build_trials_payload(sequence_id)
+        if trials is None:
+            return None
+        return load_sequence_scorer(sequence_id, list(audio_map), trials)
+
+    state = cache.get_or_compute(f"scores:{sequence_id}", replay, local=False)
+    return None if state is None else DeltaRuleScorer.loads(state["scorer"])
+
+
+def apply_score_update(sequence_id, result_id, resources_in_trial, best_res_id, worst_res_id):
+    """
+    Fold one submitted trial (trial_results row `result_id`) into the cached
+    scores. With no cached state there is nothing to do, the next replay
+    includes the row.
+
+    The delta rule depends on order, and rows can arrive out of id order
+    (concurrent submits on other workers, or a replay that ran before this
+    row committed). A late row is slotted into the recent rows in id order,
+    and only those rows are re-applied on top of the base scores. A row that
+    is already part of the recent rows is not applied twice. Only a row older
+    than the whole window drops the state, so the next read replays
+    everything.
+    """
+    def apply(state):
+        if state is MISSING:
+            return MISSING
+        recent = state["recent"]
+        if any(row[0] == result_id for row in recent):
+            return MISSING  # a replay already included it
+        if result_id <= state["base_id"]:
+            cache.delete(f"scores:{sequence_id}")
+            return MISSING
+
+        row = (result_id, list(resources_in_trial), best_res_id, worst_res_id)
+        if result_id > state["last_result_id"]:
+            scorer = DeltaRuleScorer.loads(state["scorer"])
+            scorer.update(resources_in_trial, best_res_id, worst_res_id)
+            recent = recent + [row]
+        else:
+            recent = sorted(recent + [row], key=lambda r: r[0])
+            scorer = _replayed(state["base"], recent)
+
+        base, base_id = state["base"], state["base_id"]
+        if len(recent) > SCORE_REORDER_WINDOW:
+            settled, recent = recent[:-SCORE_REORDER_WINDOW], recent[-SCORE_REORDER_WINDOW:]
+            base, base_id = _replayed(base, settled).dumps(), settled[-1][0]
+        return {
+            "scorer": scorer.dumps(),
+            "last_result_id": max(result_id, state["last_result_id"]),
+            "base": base,
+            "base_id": base_id,
+            "recent": recent,
+        }
+
+    cache.update(f"scores:{sequence_id}", apply)
+
+
 ################################################################################
 # 3) Endpoint: fetch or init trials for a given sequence_id
 ################################################################################
+def build_trials_payload(sequence_id):
+    """
+    Read the sequence from "sequence_view" and return (trials, audio_map),
+    or (None, None) if the sequence has no rows. Cached for TRIALS_CACHE_TTL.
+    """
+    # Only this sequence's rows of "sequence_view" (like in the PyQt code)
+    def query():
+        trials, audio_map = load_trials(db_manager, sequence_id)
+        return None if trials is None else (trials, audio_map)
+
+    payload = cache.get_or_compute(f"trials:{sequence_id}", query, ttl=TRIALS_CACHE_TTL)
+    return (None, None) if payload is None else payload
+
+
+def get_sequence_info(sequence_id):
+    """
+    The sequence's sequence_info row as a dict (folder_path, choice_set_size,
+    n_trials; n_trials = 0 means adaptive mode), or None if there is none.
+    Cached for TRIALS_CACHE_TTL; misses are not cached.
+    """
+    def query():
+        df = db_manager.read_query(
+            "SELECT folder_path, choice_set_size, n_trials FROM sequence_info "
+            "WHERE sequence_id = :sequence_id LIMIT 1",
+            params={"sequence_id": sequence_id},
+        )
+        if df.empty:
+            return None
+        row = df.iloc[0]
+        return {
+            "folder_path": row["folder_path"],
+            "choice_set_size": int(row["choice_set_size"]),
+            "n_trials": int(row["n_trials"]),
+        }
+
+    return cache.get_or_compute(f"sequence_info:{sequence_id}", query, ttl=TRIALS_CACHE_TTL)
+
+
 @app.route("/api/trials/<int:sequence_id>", methods=["GET"])
 def get_trials(sequence_id):
     """
     Returns the list of trials for the given sequence_id, including
-    each trial’s resource_ids in order. Also ensures V_values exist.
-    """
-    engine = db_manager.connect()
-    # Read from your "sequence_view" (like in the PyQt code)
-    df_view = db_manager.read_table("sequence_view")
-    df_view = df_view[df_view["sequence_id"] == sequence_id].copy()
+    each trial’s resource_ids in order.
+    With ?format=compact (or the compact Accept type) see wire_format.py.
 
-    if df_view.empty:
+    nginx normally serves this from the static bundles (trial_bundles.py);
+    reaching Flask means the bundle is missing, so it is published here.
+    """
+    db_manager.connect()
+    trials, audio_map = build_trials_payload(sequence_id)
+    if trials is None:
         return jsonify({"error": f"No rows found for sequence_id={sequence_id}"}), 404
 
-    # Sort by trial, index_order
-    df_view.sort_values(["trial", "index_order"], inplace=True)
-
-    # Initialize V_values if needed
-    unique_res_ids = df_view["resource_id"].unique()
-    if sequence_id not in V_values:
-        V_values[sequence_id] = {res_id: 0.0 for res_id in unique_res_ids}
-
-    # Group into a list of trials
-    # Each trial: [resource_id1, resource_id2, ...]
-    trials = []
-    for trial_id, gdf in df_view.groupby("trial"):
-        trial_resources = gdf.sort_values("index_order")["resource_id"].tolist()
-        trials.append(trial_resources)
-
-    # Also build an “audio_map” so the frontend can display correct audio paths
-    # (The React app can then do <audio src=... /> or something similar)
-    audio_map = {}
-    for _, row in df_view.iterrows():
-        res_id = row["resource_id"]
-        folder_path = row["folder_path"]
-        filename = row["resource_filenames"]
-        # audio_path = os.path.join(folder_path, filename)
-        
-        audio_path = row["resource_folder_paths"]
-        audio_map[res_id] = audio_path
-        logging.info(f"audio_map: {audio_map}")
+    try:
+        publish_bundle(sequence_id, trials, audio_map, overwrite=False)
+    except OSError as e:
+        logger.warning(f"Could not publish trial bundle for sequence {sequence_id}: {e}")
+
+    if wants_compact(request):
+        return jsonify(compact_trials(trials, audio_map))
 
     return jsonify({
         "trials": trials,                # list of lists
@@ -108,10 +291,78 @@ def get_trials(sequence_id):
     })
 
 
+################################################################################
+# 3b) Endpoint: resume — how far has this participant got?
+################################################################################
+def submitted_trial_indices(participant_id, sequence_id):
+    """
+    Sorted trial indices this participant already submitted for the sequence.
+    Served by idx_trial_results_participant_sequence (covering index).
+    """
+    df = db_manager.read_query(
+        "SELECT DISTINCT trial_index FROM trial_results "
+        "WHERE participant_id = :participant_id AND sequence_id = :sequence_id "
+        "ORDER BY trial_index",
+        params={"participant_id": participant_id, "sequence_id": sequence_id},
+        use_primary=True,  # the participant's own latest submissions must be visible
+    )
+    return df["trial_index"].astype(int).tolist()
+
+
+@app.route("/api/trials/<int:sequence_id>/progress", methods=["GET"])
+def get_progress(sequence_id):
+    """
+    GET /api/trials/<sequence_id>/progress?participant_name=Alice
+    Returns the submitted trial indices, the next pending trial and the
+    trials payload from that trial on:
+      {
+        "submitted": [0, 1, 2],
+        "next_trial": 3,
+        "n_trials": 40,
+        "trials": [[...], ...],   # trials[next_trial:]
+        "audio_map": {...}        # only the resources of those trials
+      }
+    With ?format=compact, "trials"/"audio_map" are replaced by the compact
+    encoding of the remaining trials (see wire_format.py). With
+    ?include_trials=0 only the progress fields are returned; the questionnaire
+    then takes the trials from the static bundle of /api/trials/<sequence_id>.
+    """
+    participant_name = request.args.get("participant_name")
+    if not participant_name:
+        return jsonify({"error": "Missing participant_name"}), 400
+
+    db_manager.connect()
+    trials, audio_map = build_trials_payload(sequence_id)
+    if trials is None:
+        return jsonify({"error": f"No rows found for sequence_id={sequence_id}"}), 404
+
+    participant_id = find_participant(participant_name)
+    submitted = [] if participant_id is None else submitted_trial_indices(participant_id, sequence_id)
+
+    # First trial not yet submitted (skips count as submitted)
+    done = set(submitted)
+    next_trial = next((i for i in range(len(trials)) if i not in done), len(trials))
+
+    remaining = trials[next_trial:]
+    remaining_ids = {res_id for trial in remaining for res_id in trial}
+    remaining_audio = {res_id: path for res_id, path in audio_map.items() if res_id in remaining_ids}
+    progress = {
+        "submitted": submitted,
+        "next_trial": next_trial,
+        "n_trials": len(trials),
+    }
+    if request.args.get("include_trials") == "0":
+        return jsonify(progress)
+    if wants_compact(request):
+        return jsonify({**progress, **compact_trials(remaining, remaining_audio)})
+    return jsonify({**progress, "trials": remaining, "audio_map": remaining_audio})
+
+
 ################################################################################
 # 4) Endpoint: submit best/worst for a single trial
 ################################################################################
 @app.route("/api/trials/<int:sequence_id>/<int:trial_index>/submit", methods=["POST"])
+@admission_controlled(buckets=participant_buckets)
 def submit_trial(sequence_id, trial_index):
     """
     Receives JSON:
@@ -122,6 +373,7 @@ def submit_trial(sequence_id, trial_index):
         "resources_in_trial": [123, 456, 789]
       }
     Then updates “V” for best/worst, saves trial results in DB.
+    Under overload answers 503/429 with Retry-After (admission.py).
     """
     data = request.json
     participant_name = data.get("participant_name")
@@ -137,21 +389,238 @@ def submit_trial(sequence_id, trial_index):
 
     participant_id = get_or_create_participant(participant_name)
 
-    # Insert row into “trial_results”
+    info = get_sequence_info(sequence_id)
+    if info is not None and info["n_trials"] == 0:
+        return submit_adaptive_trial(sequence_id, trial_index, participant_id, best_res_id, worst_res_id)
+
+    result_id = insert_trial_result(sequence_id, trial_index, participant_id, best_res_id, worst_res_id)
+    if result_id is None:
+        return jsonify({"error": "Trial already submitted", "trial_index": trial_index}), 409
+
+    # Live delta-rule scores for the sequence (ALPHA learning rate)
+    if resources_in_trial:
+        try:
+            apply_score_update(sequence_id, result_id, resources_in_trial, best_res_id, worst_res_id)
+        except KeyError as e:
+            logger.warning(f"Score update skipped for sequence_id={sequence_id}: {e}")
+
+    return jsonify({"message": "Submitted successfully"})
+
+
+def insert_trial_result(sequence_id, trial_index, participant_id, best_res_id, worst_res_id):
+    """
+    Insert one row into “trial_results” and return its id, or None if the
+    trial was already submitted (page reload, double click, concurrent
+    retries): the unique (participant, sequence, trial) index rejects the
+    second row, so it is never written twice.
+    """
     db_manager.connect()
-    df_trial = pd.DataFrame([{
-        "participant_id": participant_id,
-        "sequence_id": sequence_id,
-        "trial_index": trial_index,
-        "best_stimulus": best_res_id,
-        "worst_stimulus": worst_res_id,
-        "submitted_at": datetime.datetime.now()
-    }])
-    db_manager.append_table("trial_results", df_trial)
+    try:
+        db_manager.execute_query(
+            "INSERT INTO trial_results "
+            "(participant_id, sequence_id, trial_index, best_stimulus, worst_stimulus, submitted_at) "
+            "VALUES (:participant_id, :sequence_id, :trial_index, :best_stimulus, :worst_stimulus, :submitted_at)",
+            params={
+                "participant_id": participant_id,
+                "sequence_id": sequence_id,
+                "trial_index": trial_index,
+                "best_stimulus": best_res_id,
+                "worst_stimulus": worst_res_id,
+                "submitted_at": datetime.datetime.now(),
+            },
+        )
+    except IntegrityError:
+        return None
+    df_inserted = db_manager.read_query(
+        "SELECT id FROM trial_results WHERE participant_id = :participant_id "
+        "AND sequence_id = :sequence_id AND trial_index = :trial_index ORDER BY id DESC LIMIT 1",
+        params={"participant_id": participant_id, "sequence_id": sequence_id, "trial_index": trial_index},
+    )
+    return int(df_inserted.iloc[0]["id"])
+
+
+def submit_adaptive_trial(sequence_id, trial_index, participant_id, best_res_id, worst_res_id):
+    """
+    Submit the answer to the participant's pending adaptive set and feed it
+    into their estimates. The answer is checked against the pending set before
+    anything is written: a stimulus that was not shown would fail (unknown id)
+    or silently distort the estimates (known id, other set).
+    """
+    key = f"adaptive:{sequence_id}:{participant_id}"
+    with cache.lock(key):
+        session = cache.get(key, local=False)
+        if session is None:
+            session, result = load_adaptive_session(sequence_id, participant_id)
+            if session is None:
+                return jsonify({"error": result}), 404
+
+        if trial_index < session.trial_count:
+            return jsonify({"error": "Trial already submitted", "trial_index": trial_index}), 409
+        if session.pending is None or trial_index != session.trial_count:
+            return jsonify({"error": f"trial_index={trial_index} is not the pending adaptive trial"}), 400
+        shown = set(session.pending)
+        if any(res_id is not None and res_id not in shown for res_id in (best_res_id, worst_res_id)):
+            return jsonify({"error": "best_stimulus/worst_stimulus are not in the pending set"}), 400
+
+        if insert_trial_result(sequence_id, trial_index, participant_id, best_res_id, worst_res_id) is None:
+            return jsonify({"error": "Trial already submitted", "trial_index": trial_index}), 409
+        session.observe(session.pending, best_res_id, worst_res_id)
+        cache.set(key, session, local=False)
 
     return jsonify({"message": "Submitted successfully"})
 
 
+@app.route("/api/trials/<int:sequence_id>/scores", methods=["GET"])
+def get_scores(sequence_id):
+    """
+    Returns the current delta-rule ranking for the sequence (all participants).
+    """
+    scorer = get_sequence_scorer(sequence_id)
+    if scorer is None:
+        return jsonify({"error": f"No scores yet for sequence_id={sequence_id}"}), 404
+    return jsonify({
+        "scores": [
+            {"resource_id": res_id, "score": score}
+            for res_id, score in scorer.ranking()
+        ]
+    })
+
+
+@app.route("/api/sequences/<int:sequence_id>/live", methods=["GET"])
+def live_results(sequence_id):
+    """
+    Server-sent events for experimenters: a snapshot of the best/worst counts
+    and participant progress, then coalesced deltas as results arrive.
+    """
+    db_manager.connect()
+    return live_hub.stream(sequence_id)
+
+
+################################################################################
+# 4b) Adaptive mode: choose the next choice set from the folder's resource pool
+################################################################################
+def load_adaptive_session(sequence_id, participant_id):
+    """
+    Build an AdaptiveSession for the resource pool of `sequence_info.folder_path`
+    and replay whatever this participant already answered.
+    Returns (session, audio_map), or (None, error_message).
+    """
+    info = get_sequence_info(sequence_id)
+    if info is None:
+        return None, f"No sequence_info found for sequence_id={sequence_id}"
+    if info["n_trials"] > 0:
+        return None, f"sequence_id={sequence_id} has fixed trials; use /api/trials/{sequence_id}"
+
+    # Pool: resources stored under the sequence's folder_path (exact match as in
+    # sequence_generator.py, or per-file URLs below that folder as in fetch_audio.py).
+    # The LIKE prefix is a range scan on idx_resources_folder_paths; "_" and "%"
+    # in the path match too broadly there, so the prefix is checked exactly after.
+    folder_path = info["folder_path"]
+    df_pool = db_manager.read_query(
+        "SELECT id, folder_paths FROM resources WHERE folder_paths LIKE :pattern ORDER BY id",
+        params={"pattern": f"{folder_path}%"},
+    )
+    df_pool = df_pool[df_pool["folder_paths"].str.startswith(folder_path)]
+    if len(df_pool) < info["choice_set_size"]:
+        return None, f"Not enough resources under {folder_path} for sequence_id={sequence_id}"
+
+    session = AdaptiveSession(df_pool["id"].tolist(), info["choice_set_size"])
+    audio_map = dict(zip(df_pool["id"].astype(int), df_pool["folder_paths"]))
+
+    # Replay previous answers, in trial order
+    params = {"sequence_id": sequence_id, "participant_id": participant_id}
+    df_sets = db_manager.read_query(
+        "SELECT trial_index, index_order, stimuli_id FROM adaptive_trials "
+        "WHERE participant_id = :participant_id AND sequence_id = :sequence_id "
+        "ORDER BY trial_index, index_order",
+        params=params,
+        use_primary=True,  # the participant's own latest sets and answers must be visible
+    )
+    if not df_sets.empty:
+        df_results = db_manager.read_query(
+            "SELECT trial_index, best_stimulus, worst_stimulus FROM trial_results "
+            "WHERE participant_id = :participant_id AND sequence_id = :sequence_id",
+            params=params,
+            use_primary=True,
+        ).set_index("trial_index")
+
+        for trial_index, gdf in df_sets.groupby("trial_index", sort=True):
+            resources = gdf["stimuli_id"].astype(int).tolist()
+            if trial_index not in df_results.index:
+                session.pending = resources
+                break
+            row = df_results.loc[trial_index]
+            best = None if pd.isna(row["best_stimulus"]) else int(row["best_stimulus"])
+            worst = None if pd.isna(row["worst_stimulus"]) else int(row["worst_stimulus"])
+            session.observe(resources, best, worst)
+
+    return session, audio_map
+
+
+@app.route("/api/adaptive/<int:sequence_id>/next", methods=["POST"])
+@admission_controlled(buckets=participant_buckets)
+def adaptive_next(sequence_id):
+    """
+    Receives JSON: { "participant_name": "Alice" }
+    Returns the next adaptive choice set, or "done": true with the current
+    ranking once the estimates have converged. Answers are submitted through
+    the usual /api/trials/<sequence_id>/<trial_index>/submit endpoint.
+    """
+    data = request.json or {}
+    participant_name = data.get("participant_name")
+    if not participant_name:
+        return jsonify({"error": "Missing participant_name"}), 400
+
+    participant_id = get_or_create_participant(participant_name)
+
+    # One request per participant at a time across workers: the session is
+    # read, advanced and written back under its cache lease
+    key = f"adaptive:{sequence_id}:{participant_id}"
+    with cache.lock(key):
+        session = cache.get(key, local=False)
+        audio_map = cache.get(f"adaptive_pool:{sequence_id}")
+        if session is None or audio_map is None:
+            session, result = load_adaptive_session(sequence_id, participant_id)
+            if session is None:
+                return jsonify({"error": result}), 404
+            audio_map = result
+            cache.set(f"adaptive_pool:{sequence_id}", audio_map, ttl=TRIALS_CACHE_TTL)
+
+        was_pending = session.pending is not None
+        resources = session.next_set()
+        cache.set(key, session, local=False)
+    if resources is None:
+        return jsonify({
+            "done": True,
+            "trial_index": session.trial_count,
+            "ranking": [
+                {"resource_id": r, "score": mu, "sd": sd}
+                for r, mu, sd in session.ranking()
+            ],
+        })
+
+    # Record the set so the answer can be interpreted later
+    if not was_pending:
+        df_set = pd.DataFrame([
+            {
+                "participant_id": participant_id,
+                "sequence_id": sequence_id,
+                "trial_index": session.trial_count,
+                "stimuli_id": res_id,
+                "index_order": order_idx,
+            }
+            for order_idx, res_id in enumerate(resources)
+        ])
+        db_manager.append_table("adaptive_trials", df_set)
+
+    return jsonify({
+        "done": False,
+        "trial_index": session.trial_count,
+        "resources": resources,
+        "audio_map": {res_id: audio_map[res_id] for res_id in resources},
+    })
+
+
 ################################################################################
 # 5) Endpoint: finalize and compute final ranking
 ################################################################################
@@ -0,0 +1,350 @@
+# cache.py
+
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+################################################################################
+# Two-tier cache shared by every worker process on one host
+################################################################################
+#   tier 1: in-process LRU (OrderedDict), bounded by entry count
+#   tier 2: a SQLite file in WAL mode, read through mmap, bounded by total bytes
+#
+# Values are pickled into tier 2, so N gunicorn/uwsgi workers see the same
+# entries. Tier 1 only keeps entries stored with local=True (immutable data
+# such as trial payloads); anything that other workers can change (running
+# scores, adaptive sessions) lives in tier 2 only and is changed through
+# update(), which is an atomic read-modify-write.
+#
+# get_or_compute()/update() take a per-key lease row in the shared file, so
+# on a miss exactly one worker computes the value while the others wait for
+# it (no stampede). Leases expire, so a worker that dies mid-compute does not
+# block the key forever.
+#
+# Values are unpickled, so whoever can write the file (or its -wal/-shm files
+# next to it) can run code in the workers. The file lives in a directory of
+# its own, the default one is created private to the app's user (0700), and
+# the cache refuses a directory or file that another user owns or can write.
+
+CACHE_PATH = os.getenv(
+    "CACHE_PATH", os.path.join(tempfile.gettempdir(), f"bws_cache-{os.getuid()}", "cache.sqlite3")
+)
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_LOCAL_ENTRIES = int(os.getenv("CACHE_LOCAL_ENTRIES", "1024"))
+
+LEASE_SECONDS = 30.0
+TOUCH_INTERVAL = 60.0  # refresh accessed_at at most this often (it costs a write)
+
+MISSING = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries(accessed_at);
+CREATE TABLE IF NOT EXISTS cache_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    total_bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_meta (id, total_bytes) VALUES (0, 0);
+CREATE TABLE IF NOT EXISTS cache_leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class LocalLRU:
+    """
+    Thread-safe in-process LRU of key -> (expires_at, value).
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+            expires_at, value = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _check_private(path, st):
+    if st.st_uid not in (os.getuid(), 0) or st.st_mode & 0o022:
+        raise PermissionError(
+            f"Refusing cache path {path}: it must be owned by this user and not group/world writable"
+        )
+
+
+def prepare_cache_file(path):
+    """
+    Create the cache file (0600) and its directory (0700) if missing, and
+    check that no other user owns or can write either of them.
+
+    Raises:
+        PermissionError: If the directory or the file is not private.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    _check_private(directory, os.stat(directory))
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        _check_private(path, os.fstat(fd))
+    finally:
+        os.close(fd)
+
+
+class SharedCache:
+    """
+    Two-tier cache (see above).
+
+    Parameters:
+        path (str): SQLite file shared by the workers (same host).
+        max_bytes (int): Size budget of the shared tier; least recently used
+            entries are evicted beyond it.
+        local_entries (int): Capacity of the in-process LRU tier.
+        default_ttl (float, optional): Seconds until entries expire (None = never).
+    """
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES,
+                 local_entries=CACHE_LOCAL_ENTRIES, default_ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.local = LocalLRU(local_entries)
+        self._conns = threading.local()
+        prepare_cache_file(path)
+        self._conn().executescript(_SCHEMA)
+
+    ############################################################################
+    # Connections: one per thread and per process (never shared across fork)
+    ############################################################################
+    def _conn(self):
+        conn = getattr(self._conns, "conn", None)
+        if conn is None or self._conns.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={max(self.max_bytes * 2, 64 * 1024 * 1024)}")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._conns.conn = conn
+            self._conns.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _expires_at(self, ttl):
+        ttl = self.default_ttl if ttl is None else ttl
+        return None if ttl is None else time.time() + ttl
+
+    ############################################################################
+    # Plain get / set / delete
+    ############################################################################
+    def get(self, key, default=None, local=True):
+        """Value stored under `key`, or `default` if absent or expired."""
+        value = self._get(key, local)
+        return default if value is MISSING else value
+
+    def _get(self, key, local=True):
+        if local:
+            value = self.local.get(key)
+            if value is not MISSING:
+                return value
+
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return MISSING
+        blob, expires_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            return MISSING
+        if now - accessed_at > TOUCH_INTERVAL:
+            self._conn().execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+
+        value = pickle.loads(blob)
+        if local:
+            self.local.set(key, value, expires_at)
+        return value
+
+    def set(self, key, value, ttl=None, local=True):
+        """Store `value` under `key` in both tiers (shared tier only if local=False)."""
+        expires_at = self._expires_at(ttl)
+        with self._transaction() as conn:
+            self._store(conn, key, value, expires_at)
+        if local:
+            self.local.set(key, value, expires_at)
+        else:
+            self.local.delete(key)
+
+    def delete(self, key):
+        self.local.delete(key)
+        with self._transaction() as conn:
+            row = conn.execute("SELECT size FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                self._add_bytes(conn, -row[0])
+
+    def clear(self):
+        self.local.clear()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cache_entries")
+            conn.execute("DELETE FROM cache_leases")
+            conn.execute("UPDATE cache_meta SET total_bytes = 0 WHERE id = 0")
+
+    def _store(self, conn, key, value, expires_at):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        row = conn.execute("SELECT size FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, size, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, blob, len(blob), expires_at, time.time()),
+        )
+        self._add_bytes(conn, len(blob) - (row[0] if row else 0))
+        self._evict(conn)
+
+    def _add_bytes(self, conn, delta):
+        conn.execute("UPDATE cache_meta SET total_bytes = total_bytes + ? WHERE id = 0", (delta,))
+
+    def _evict(self, conn):
+        """
+        Once over max_bytes: drop expired entries, then the least recently used
+        ones, down to 90% of max_bytes (so we do not evict on every set).
+        """
+        total = conn.execute("SELECT total_bytes FROM cache_meta WHERE id = 0").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        now = time.time()
+        freed = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (now,),
+        ).fetchone()[0]
+        conn.execute("DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+        target = total - int(self.max_bytes * 0.9)
+        if freed < target:
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM cache_entries ORDER BY accessed_at"):
+                victims.append((key,))
+                freed += size
+                if freed >= target:
+                    break
+            conn.executemany("DELETE FROM cache_entries WHERE key = ?", victims)
+        self._add_bytes(conn, -freed)
+
+    ############################################################################
+    # Per-key leases: atomic get-or-compute and read-modify-write
+    ############################################################################
+    def _owner(self):
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def _try_lease(self, key, lease_seconds):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM cache_leases WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] > now and row[0] != self._owner():
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self._owner(), now + lease_seconds),
+            )
+            return True
+
+    def _release(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cache_leases WHERE key = ? AND owner = ?", (key, self._owner()))
+
+    @contextmanager
+    def lock(self, key, timeout=LEASE_SECONDS, lease_seconds=LEASE_SECONDS):
+        """
+        Hold the lease of `key` (cross-process). Raises TimeoutError if it
+        cannot be taken within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.002
+        while not self._try_lease(key, lease_seconds):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Cache lease for {key!r} not acquired within {timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def get_or_compute(self, key, compute, ttl=None, local=True, timeout=LEASE_SECONDS):
+        """
+        Return the cached value of `key`, computing and storing it on a miss.
+        Only one worker computes a missing key; concurrent callers wait for
+        its result. A `None` result is returned but not cached.
+        """
+        value = self._get(key, local)
+        if value is not MISSING:
+            return value
+
+        with self.lock(key, timeout=timeout):
+            value = self._get(key, local)  # another worker may have filled it meanwhile
+            if value is not MISSING:
+                return value
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl=ttl, local=local)
+        return value
+
+    def update(self, key, fn, ttl=None, timeout=LEASE_SECONDS):
+        """
+        Atomically replace the value of `key` with fn(value). `fn` receives
+        MISSING when the key is absent and may return MISSING to leave it
+        unchanged. Updated keys are kept in the shared tier only.
+
+        Returns:
+            The new value (or MISSING).
+        """
+        with self.lock(key, timeout=timeout):
+            value = fn(self._get(key, local=False))
+            if value is not MISSING:
+                self.set(key, value, ttl=ttl, local=False)
+        return value
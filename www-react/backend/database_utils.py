@@ -1,9 +1,13 @@
 import os
+import itertools
 import logging
+import threading
 import time
+from contextvars import ContextVar
 import pandas as pd
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import InterfaceError, OperationalError
 
 # Configure logging
 logging.basicConfig(
@@ -19,61 +23,154 @@ def require_env(var_name):
         raise ValueError(f"Required environment variable '{var_name}' is not set.")
     return value
 
+# Read-your-writes: once the current request/context has written, its reads
+# go to the primary too (replicas may lag). Reset with reset_read_pin().
+_pinned_to_primary = ContextVar("pinned_to_primary", default=False)
+
+REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+
 class DBManager:
     """
     A modular database manager using SQLAlchemy for connecting to the MySQL database.
+
+    Writes (execute_query, append_table) always go to the primary. Reads go
+    round-robin to the read replicas, if any are configured, except after a
+    write in the same request/context (read-your-writes) or when a replica is
+    unreachable; a failed replica is skipped for DB_REPLICA_RETRY_SECONDS and
+    its reads fall back to the next replica or the primary.
+
+    Parameters:
+        primary_uri (str, optional): SQLAlchemy URI of the primary. Defaults to
+            the MySQL URI built from DB_HOST/DB_PORT/DB_NAME/DB_USER/DB_PASSWORD.
+        replica_uris (list of str, optional): URIs of read replicas. Defaults to
+            the comma-separated DB_REPLICA_URIS environment variable.
     """
-    def __init__(self):
+    def __init__(self, primary_uri=None, replica_uris=None):
         # Load environment variables from the .env file in the project root
         load_dotenv()
-        try:
-            self.db_host = require_env("DB_HOST")
-            self.db_port = require_env("DB_PORT")  # Keep as string for URI
-            self.db_name = require_env("DB_NAME")
-            self.db_user = require_env("DB_USER")
-            self.db_password = require_env("DB_PASSWORD")
-        except ValueError as e:
-            logger.error(e)
-            raise
+        if primary_uri is None:
+            try:
+                self.db_host = require_env("DB_HOST")
+                self.db_port = require_env("DB_PORT")  # Keep as string for URI
+                self.db_name = require_env("DB_NAME")
+                self.db_user = require_env("DB_USER")
+                self.db_password = require_env("DB_PASSWORD")
+            except ValueError as e:
+                logger.error(e)
+                raise
 
-        logger.info("All required environment variables are set:")
-        logger.info(f"DB_HOST: {self.db_host}")
-        logger.info(f"DB_PORT: {self.db_port}")
-        logger.info(f"DB_NAME: {self.db_name}")
-        logger.info(f"DB_USER: {self.db_user}")
+            logger.info("All required environment variables are set:")
+            logger.info(f"DB_HOST: {self.db_host}")
+            logger.info(f"DB_PORT: {self.db_port}")
+            logger.info(f"DB_NAME: {self.db_name}")
+            logger.info(f"DB_USER: {self.db_user}")
 
-        # Construct the SQLAlchemy connection URI
-        self.connection_uri = (
-            f"mysql+mysqlconnector://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
-            f"?charset=utf8mb4&collation=utf8mb4_general_ci"
-        )
-        self.engine = None
+            # Construct the SQLAlchemy connection URI
+            primary_uri = (
+                f"mysql+mysqlconnector://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
+                f"?charset=utf8mb4&collation=utf8mb4_general_ci"
+            )
+        if replica_uris is None:
+            replica_uris = [uri.strip() for uri in os.getenv("DB_REPLICA_URIS", "").split(",") if uri.strip()]
+
+        self.connection_uri = primary_uri
+        self.replica_uris = list(replica_uris)
+        self.engine = None             # primary
+        self.replica_engines = []
+        self._replica_down_until = {}  # replica index -> time.monotonic() when to retry it
+        self._replica_cycle = itertools.count()
+        self._lock = threading.Lock()
+
+    def _create_engine(self, uri):
+        connect_args = {}
+        if uri.startswith("mysql"):
+            connect_args["init_command"] = "SET NAMES utf8mb4 COLLATE utf8mb4_general_ci"
+        return create_engine(uri, echo=False, pool_pre_ping=True, connect_args=connect_args)
 
     def connect(self):
-        """Create a SQLAlchemy engine to connect to the database."""
-        try:
-            self.engine = create_engine(
-                self.connection_uri,
-                echo=False,
-                connect_args={"init_command": "SET NAMES utf8mb4 COLLATE utf8mb4_general_ci"}
-            )
-            logger.info("SQLAlchemy engine created and connected to the database.")
+        """
+        Create the SQLAlchemy engines (primary and replicas). Engines are
+        reused if they already exist, so calling this per request is cheap.
+        """
+        if self.engine is not None:
             return self.engine
-        except Exception as e:
-            logger.error(f"Error creating SQLAlchemy engine: {e}")
-            raise
+        with self._lock:
+            if self.engine is not None:
+                return self.engine
+            try:
+                self.replica_engines = [self._create_engine(uri) for uri in self.replica_uris]
+                self.engine = self._create_engine(self.connection_uri)
+                logger.info(
+                    f"SQLAlchemy engine created and connected to the database "
+                    f"({len(self.replica_engines)} read replicas)."
+                )
+                return self.engine
+            except Exception as e:
+                logger.error(f"Error creating SQLAlchemy engine: {e}")
+                raise
 
     def close(self):
-        """Dispose of the SQLAlchemy engine and close all connections."""
+        """Dispose of the SQLAlchemy engines and close all connections."""
+        for engine in self.replica_engines:
+            engine.dispose()
+        self.replica_engines = []
         if self.engine:
             self.engine.dispose()
+            self.engine = None
             logger.info("SQLAlchemy engine disposed, connection closed.")
-    def read_query(self, query):
+
+    ############################################################################
+    # Read/write routing
+    ############################################################################
+    def pin_reads_to_primary(self):
+        """Send the remaining reads of this request/context to the primary."""
+        _pinned_to_primary.set(True)
+
+    def reset_read_pin(self):
+        """Call at the end of a request so the next one may read from replicas again."""
+        _pinned_to_primary.set(False)
+
+    def _read_engines(self, use_primary=False):
+        """Engines to try for a read, in order: healthy replicas round-robin, then the primary."""
+        if use_primary or _pinned_to_primary.get() or not self.replica_engines:
+            return [self.engine]
+        now = time.monotonic()
+        n = len(self.replica_engines)
+        start = next(self._replica_cycle) % n
+        order = [(start + i) % n for i in range(n)]
+        healthy = [i for i in order if self._replica_down_until.get(i, 0.0) <= now]
+        return [self.replica_engines[i] for i in healthy] + [self.engine]
+
+    def _mark_down(self, engine, error):
+        if engine is self.engine:
+            return
+        i = self.replica_engines.index(engine)
+        self._replica_down_until[i] = time.monotonic() + REPLICA_RETRY_SECONDS
+        logger.warning(f"Read replica {i} unavailable, skipping it for {REPLICA_RETRY_SECONDS:.0f}s: {error}")
+
+    def _read_connection(self, use_primary=False):
+        """
+        Open a connection on the first reachable read engine. Only failing to
+        connect fails over; errors of the query itself are not retried.
+        """
+        engines = self._read_engines(use_primary)
+        for engine in engines:
+            try:
+                return engine.connect()
+            except (OperationalError, InterfaceError) as e:
+                if engine is engines[-1]:
+                    raise
+                self._mark_down(engine, e)
+
+    def read_query(self, query, params=None, use_primary=False):
         """
         Execute a SQL SELECT query using pandas and return the result as a DataFrame.
         
         Parameters:
             query (str): The SQL query to execute.
+            params (dict, optional): Parameter dictionary for parameterized queries (":name" style).
+                Without params the query is sent as is, so literal colons need no escaping.
+            use_primary (bool): Read from the primary even if replicas are configured.
             
         Returns:
             pd.DataFrame: The query result.
@@ -81,12 +178,37 @@ class DBManager:
         if not self.engine:
             raise Exception("Engine not connected. Call connect() first.")
         try:
-            df = pd.read_sql(query, self.engine)
-            return df
+            with self._read_connection(use_primary) as conn:
+                return pd.read_sql(text(query) if params else query, conn, params=params or None)
         except Exception as e:
             logger.error(f"Error executing query: {e}")
             raise
         
+    def read_query_chunks(self, query, params=None, chunksize=50000, use_primary=False):
+        """
+        Execute a SQL SELECT query and yield the result in DataFrame chunks,
+        streaming rows from the server instead of loading them all at once.
+        
+        Parameters:
+            query (str): The SQL query to execute.
+            params (dict, optional): Parameter dictionary for parameterized queries (":name" style).
+            chunksize (int): Number of rows per chunk.
+            use_primary (bool): Read from the primary even if replicas are configured.
+            
+        Yields:
+            pd.DataFrame: Consecutive chunks of the query result.
+        """
+        if not self.engine:
+            raise Exception("Engine not connected. Call connect() first.")
+        try:
+            with self._read_connection(use_primary).execution_options(stream_results=True) as conn:
+                sql = text(query) if params else query
+                for chunk in pd.read_sql(sql, conn, params=params or None, chunksize=chunksize):
+                    yield chunk
+        except Exception as e:
+            logger.error(f"Error executing query: {e}")
+            raise
+
     def read_table(self, table, columns=None):
         """
         Read specific columns (or all columns) from a table into a DataFrame.
@@ -125,6 +247,7 @@ class DBManager:
         """
         if not self.engine:
             raise Exception("Engine not connected. Call connect() first.")
+        self.pin_reads_to_primary()
         try:
             with self.engine.begin() as conn:
                 result = conn.execute(text(query), params or {})
@@ -133,7 +256,28 @@ class DBManager:
             logger.error(f"Error executing query: {e}")
             raise
 
-    def append_table(self, table_name, df, if_exists='append', index=False):
+    def execute_transaction(self, statements):
+        """
+        Execute several SQL statements in one transaction on the primary:
+        either all of them take effect or none does.
+        
+        Parameters:
+            statements (list of (str, dict)): (query, params) pairs, run in order.
+            
+        Returns:
+            list of int: Rows affected by each statement.
+        """
+        if not self.engine:
+            raise Exception("Engine not connected. Call connect() first.")
+        self.pin_reads_to_primary()
+        try:
+            with self.engine.begin() as conn:
+                return [conn.execute(text(query), params or {}).rowcount for query, params in statements]
+        except Exception as e:
+            logger.error(f"Error executing transaction: {e}")
+            raise
+
+    def append_table(self, table_name, df, if_exists='append', index=False, method=None, chunksize=None):
         """
         Append a Pandas DataFrame to a specific table in the database.
         
@@ -143,15 +287,21 @@ class DBManager:
             if_exists (str): What to do if the table already exists. 
                              Common values: 'append', 'replace', 'fail'.
             index (bool): Whether to write the DataFrame index as a column.
+            method (str, optional): Passed to DataFrame.to_sql; 'multi' sends
+                             multi-row INSERT statements (much faster for bulk loads).
+            chunksize (int, optional): Rows per INSERT batch.
         """
         if not self.engine:
             raise Exception("Engine not connected. Call connect() first.")
+        self.pin_reads_to_primary()
         try:
             df.to_sql(
                 name=table_name,
                 con=self.engine,
                 if_exists=if_exists,
-                index=index
+                index=index,
+                method=method,
+                chunksize=chunksize
             )
             logger.info(f"Data appended to table '{table_name}'.")
         except Exception as e:
@@ -0,0 +1,320 @@
+# live.py
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from flask import Response, stream_with_context
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Live results of a sequence as server-sent events
+################################################################################
+# GET /api/sequences/<id>/live streams:
+#
+#   event: snapshot   totals so far: best/worst counts per resource and
+#                     answered trials per participant
+#   event: delta      what changed in the last window: best/worst increments
+#                     per resource, new totals of the participants who answered
+#
+# Every SSE "id:" is the feed's version, which goes up with each delta. A
+# delta is only sent if it is newer than the last snapshot the subscriber
+# got, so applying the snapshot and then each delta never counts a row twice.
+#
+# Rows do not become visible in id order: concurrent submits commit in any
+# order, so a row can appear after a higher id has been seen. The feed
+# therefore re-reads a trailing window instead of only id > max seen id.
+# Every row above the horizon is read again on each poll, and rows already
+# counted are skipped by id. The horizon is the highest id that has been
+# visible for LIVE_SETTLE_SECONDS; every lower id is assumed committed by
+# then. Polls read the primary, so replica lag cannot hide rows.
+#
+# Each worker runs at most one change feed per sequence, however many
+# dashboards are connected: a thread that polls trial_results above the
+# horizon every LIVE_POLL_INTERVAL seconds (an index range scan on the
+# sequence_id foreign-key index) and fans one coalesced delta per window
+# out to all subscribers. The feed stops once nobody has listened for
+# LIVE_IDLE_SECONDS.
+#
+# Subscriber queues hold at most LIVE_QUEUE_SIZE events. A subscriber that
+# falls that far behind is not waited for: its queue is dropped and it gets a
+# fresh snapshot instead of the deltas it missed.
+
+LIVE_POLL_INTERVAL = float(os.getenv("LIVE_POLL_INTERVAL", "1.0"))
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "64"))
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", "15"))
+LIVE_IDLE_SECONDS = float(os.getenv("LIVE_IDLE_SECONDS", "30"))
+LIVE_SETTLE_SECONDS = float(os.getenv("LIVE_SETTLE_SECONDS", "30"))
+LIVE_BATCH_ROWS = 5000
+
+RESYNC = object()  # queued in place of the deltas a slow subscriber missed
+
+
+class LiveFeed:
+    """
+    Change feed of one sequence's trial_results, shared by all subscribers.
+    """
+    def __init__(self, db_manager, sequence_id, interval=LIVE_POLL_INTERVAL,
+                 queue_size=LIVE_QUEUE_SIZE, idle_seconds=LIVE_IDLE_SECONDS,
+                 settle_seconds=LIVE_SETTLE_SECONDS, on_stop=None):
+        self.db_manager = db_manager
+        self.sequence_id = sequence_id
+        self.interval = interval
+        self.queue_size = queue_size
+        self.idle_seconds = idle_seconds
+        self.settle_seconds = settle_seconds
+        self.on_stop = on_stop
+        self.version = 0        # bumped by every delta
+        self.last_id = 0        # highest trial_results.id counted
+        self._horizon = 0       # every row with id <= horizon has been counted
+        self._recent = {}       # id -> time first seen, for counted rows above the horizon
+        self.best = {}          # resource_id -> times chosen best
+        self.worst = {}         # resource_id -> times chosen worst
+        self.progress = {}      # participant_id -> answered trials
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopped = False
+        self._idle_since = None
+        self._thread = threading.Thread(target=self._run, name=f"live-feed-{sequence_id}", daemon=True)
+
+    ############################################################################
+    # Subscribers
+    ############################################################################
+    def start(self):
+        self._thread.start()
+
+    def subscribe(self):
+        """
+        Returns:
+            queue.Queue of events, or None if the feed is stopping (ask the hub again).
+        """
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self._stopped:
+                return None
+            self._subscribers.add(q)
+            self._idle_since = None
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+            if not self._subscribers:
+                self._idle_since = time.monotonic()
+
+    def snapshot(self):
+        """Current totals as an event (waits for the feed's first load)."""
+        self._ready.wait()
+        with self._lock:
+            return self._event("snapshot", {
+                "best": self.best, "worst": self.worst, "progress": self.progress,
+            })
+
+    def _event(self, name, data):
+        """(version, SSE text) of an event."""
+        payload = {"sequence_id": self.sequence_id, "version": self.version, "last_id": self.last_id, **data}
+        body = json.dumps(payload, separators=(",", ":"), default=int)
+        return self.version, f"id: {self.version}\nevent: {name}\ndata: {body}\n\n"
+
+    def _publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Too slow: drop what it has not read and let it resync from a snapshot
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+                q.put_nowait(RESYNC)
+
+    ############################################################################
+    # Polling
+    ############################################################################
+    def _load_totals(self):
+        """
+        Initial totals, with aggregate queries up to a fixed id. Rows of the
+        last LIVE_SETTLE_SECONDS (by submitted_at) start out above the
+        horizon, so rows below them that commit later are still picked up.
+        """
+        params = {"sequence_id": self.sequence_id}
+        df_max = self.db_manager.read_query(
+            "SELECT MAX(id) AS max_id FROM trial_results WHERE sequence_id = :sequence_id",
+            params=params, use_primary=True,
+        )
+        max_id = df_max.iloc[0]["max_id"]
+        if pd.isna(max_id):  # no results yet
+            return
+        params["max_id"] = int(max_id)
+        totals = {}
+        for column, key in (("best_stimulus", "best"), ("worst_stimulus", "worst"), ("participant_id", "progress")):
+            df = self.db_manager.read_query(
+                f"SELECT {column} AS k, COUNT(*) AS n FROM trial_results "
+                f"WHERE sequence_id = :sequence_id AND id <= :max_id AND {column} IS NOT NULL GROUP BY {column}",
+                params=params, use_primary=True,
+            )
+            totals[key] = dict(zip(df["k"].astype(int).tolist(), df["n"].astype(int).tolist()))
+
+        params["settled_before"] = datetime.now() - timedelta(seconds=self.settle_seconds)
+        df_horizon = self.db_manager.read_query(
+            "SELECT MAX(id) AS horizon FROM trial_results "
+            "WHERE sequence_id = :sequence_id AND id <= :max_id AND submitted_at < :settled_before",
+            params=params, use_primary=True,
+        )
+        horizon = df_horizon.iloc[0]["horizon"]
+        params["horizon"] = 0 if pd.isna(horizon) else int(horizon)
+        df_recent = self.db_manager.read_query(
+            "SELECT id FROM trial_results WHERE sequence_id = :sequence_id AND id > :horizon AND id <= :max_id",
+            params=params, use_primary=True,
+        )
+        now = time.monotonic()
+        with self._lock:
+            self.best, self.worst, self.progress = totals["best"], totals["worst"], totals["progress"]
+            self.last_id = params["max_id"]
+            self._horizon = params["horizon"]
+            self._recent = {int(row_id): now for row_id in df_recent["id"]}
+
+    def _poll(self):
+        """Fold new rows into the totals; returns the delta, or None if nothing arrived."""
+        best, worst, participants = {}, {}, set()
+        after = self._horizon
+        now = time.monotonic()
+        while True:
+            df = self.db_manager.read_query(
+                "SELECT id, participant_id, best_stimulus, worst_stimulus FROM trial_results "
+                "WHERE sequence_id = :sequence_id AND id > :after ORDER BY id LIMIT :limit",
+                params={"sequence_id": self.sequence_id, "after": after, "limit": LIVE_BATCH_ROWS},
+                use_primary=True,  # a lagging replica would show rows late (or, after the horizon passed them, never)
+            )
+            if df.empty:
+                break
+            with self._lock:
+                for row in df.itertuples(index=False):
+                    row_id = int(row.id)
+                    if row_id in self._recent:  # already counted
+                        continue
+                    self._recent[row_id] = now
+                    if pd.notna(row.best_stimulus):  # NULL = skipped trial
+                        res_id = int(row.best_stimulus)
+                        best[res_id] = best.get(res_id, 0) + 1
+                        self.best[res_id] = self.best.get(res_id, 0) + 1
+                    if pd.notna(row.worst_stimulus):
+                        res_id = int(row.worst_stimulus)
+                        worst[res_id] = worst.get(res_id, 0) + 1
+                        self.worst[res_id] = self.worst.get(res_id, 0) + 1
+                    participant_id = int(row.participant_id)
+                    self.progress[participant_id] = self.progress.get(participant_id, 0) + 1
+                    participants.add(participant_id)
+                after = int(df["id"].iloc[-1])
+                self.last_id = max(self.last_id, after)
+            if len(df) < LIVE_BATCH_ROWS:
+                break
+
+        with self._lock:
+            # Advance the horizon to the highest id visible for settle_seconds
+            settled = [row_id for row_id, seen in self._recent.items() if now - seen >= self.settle_seconds]
+            if settled:
+                self._horizon = max(self._horizon, max(settled))
+                self._recent = {row_id: seen for row_id, seen in self._recent.items() if row_id > self._horizon}
+            if not participants:
+                return None
+            self.version += 1
+            progress = {pid: self.progress[pid] for pid in participants}
+            return self._event("delta", {"best": best, "worst": worst, "progress": progress})
+
+    def _should_stop(self):
+        with self._lock:
+            if self._idle_since is not None and time.monotonic() - self._idle_since >= self.idle_seconds:
+                self._stopped = True
+        return self._stopped
+
+    def _run(self):
+        try:
+            self._load_totals()
+        except Exception as e:
+            logger.error(f"Live feed for sequence_id={self.sequence_id}: initial load failed: {e}")
+        self._ready.set()
+        while not self._should_stop():
+            time.sleep(self.interval)  # the coalescing window
+            try:
+                event = self._poll()
+            except Exception as e:
+                logger.warning(f"Live feed for sequence_id={self.sequence_id}: poll failed: {e}")
+                continue
+            if event is not None:
+                self._publish(event)
+        if self.on_stop is not None:
+            self.on_stop(self)
+
+
+class LiveHub:
+    """
+    The feeds of this worker, one per sequence, started on first subscription.
+    """
+    def __init__(self, db_manager, **feed_options):
+        self.db_manager = db_manager
+        self.feed_options = feed_options
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def _forget(self, feed):
+        with self._lock:
+            if self._feeds.get(feed.sequence_id) is feed:
+                del self._feeds[feed.sequence_id]
+
+    def subscribe(self, sequence_id):
+        """
+        Returns:
+            (LiveFeed, queue.Queue): the feed and this subscriber's queue.
+        """
+        while True:
+            with self._lock:
+                feed = self._feeds.get(sequence_id)
+                if feed is None:
+                    feed = LiveFeed(self.db_manager, sequence_id, on_stop=self._forget, **self.feed_options)
+                    self._feeds[sequence_id] = feed
+                    feed.start()
+            q = feed.subscribe()
+            if q is not None:
+                return feed, q
+            self._forget(feed)  # it stopped between lookup and subscribe
+
+    def stream(self, sequence_id, heartbeat=LIVE_HEARTBEAT):
+        """Flask response streaming the live events of `sequence_id`."""
+        feed, q = self.subscribe(sequence_id)
+
+        def generate():
+            try:
+                yield "retry: 3000\n\n"
+                seen_version, text = feed.snapshot()
+                yield text
+                while True:
+                    try:
+                        event = q.get(timeout=heartbeat)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"  # keeps proxies from closing an idle stream
+                        continue
+                    if event is RESYNC:
+                        seen_version, text = feed.snapshot()
+                        yield text
+                    elif event[0] > seen_version:  # deltas already folded into the last snapshot are skipped
+                        seen_version, text = event
+                        yield text
+            finally:
+                feed.unsubscribe(q)  # client went away (GeneratorExit) or the server stopped
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
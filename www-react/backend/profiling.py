@@ -0,0 +1,182 @@
+# profiling.py
+
+import cProfile
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+################################################################################
+# Opt-in request profiling
+################################################################################
+# Off unless asked for, per request or for a sample of traffic:
+#
+#   X-Profile: stack      sample the request thread's stack every few ms
+#   X-Profile: cprofile   deterministic cProfile of the request
+#   PROFILE_SAMPLE_RATE   fraction of requests profiled in "stack" mode
+#
+# The X-Profile header is ignored unless PROFILE_TOKEN is set, and then only
+# counts when X-Profile-Token matches it (profiling is expensive, so arbitrary
+# clients must not be able to turn it on). Only the endpoints in
+# PROFILE_ENDPOINTS are profiled.
+#
+# Output goes to PROFILE_DIR, keeping the newest PROFILE_MAX_FILES files:
+#   <time>-<endpoint>-<ms>ms.collapsed   "frame;frame;frame count" lines, for
+#                                        flamegraph.pl / speedscope / inferno
+#   <time>-<endpoint>-<ms>ms.prof        pstats dump (snakeviz, gprof2dot)
+# The file name is returned in the X-Profile-File response header.
+#
+# When profiling is not requested the cost is one header lookup per request.
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "bws_profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))  # seconds between stack samples
+PROFILE_ENDPOINTS = set(
+    os.getenv("PROFILE_ENDPOINTS", "get_trials,get_progress,submit_trial,get_scores,adaptive_next").split(",")
+)
+
+MODES = ("stack", "cprofile")
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack from a background thread and counts
+    the collapsed stacks (root first, ";"-separated).
+    """
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _prune(directory, max_files):
+    """Keep only the newest `max_files` profiles (a ring of files)."""
+    entries = [e for e in os.scandir(directory) if e.is_file()]
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime_ns)
+    for entry in entries[:len(entries) - max_files]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # another worker pruned it first
+
+
+@contextmanager
+def profiling_session(label, mode="stack", out_dir=None, max_files=None):
+    """
+    Profile the enclosed block (current thread) and write the result to the
+    ring directory. Usable outside Flask too, e.g. around a scoring run.
+    Yields a dict whose "path" is set once the block has finished.
+    """
+    out_dir = out_dir or PROFILE_DIR
+    result = {"path": None}
+    started = time.perf_counter()
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active (Python 3.12+ allows only one)
+            mode = "stack"
+    if mode != "cprofile":
+        profiler = StackSampler(threading.get_ident())
+        profiler.start()
+    try:
+        yield result
+    finally:
+        if mode == "cprofile":
+            profiler.disable()
+        else:
+            profiler.stop()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+            stamp = time.strftime("%Y%m%dT%H%M%S") + f"{time.time() % 1:.3f}"[1:]
+            ext = "prof" if mode == "cprofile" else "collapsed"
+            path = os.path.join(out_dir, f"{stamp}-{os.getpid()}-{label}-{elapsed_ms:.0f}ms.{ext}")
+            if mode == "cprofile":
+                profiler.dump_stats(path)
+            else:
+                profiler.write(path)
+            _prune(out_dir, max_files or PROFILE_MAX_FILES)
+            result["path"] = path
+        except OSError as e:
+            logger.warning(f"Could not write profile for {label}: {e}")
+
+
+def _requested_mode():
+    """Profiling mode asked for by the current request, or None."""
+    mode = request.headers.get("X-Profile")
+    if mode is not None and PROFILE_TOKEN and request.headers.get("X-Profile-Token") == PROFILE_TOKEN:
+        return mode if mode in MODES else "stack"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "stack"
+    return None
+
+
+def init_profiling(app):
+    """Register the before/after request hooks on a Flask app."""
+
+    @app.before_request
+    def _start_profile():
+        if request.endpoint not in PROFILE_ENDPOINTS:
+            return
+        mode = _requested_mode()
+        if mode is None:
+            return
+        g.profile_session = profiling_session(request.endpoint, mode)
+        g.profile_result = g.profile_session.__enter__()
+
+    @app.after_request
+    def _stop_profile(response):
+        session = g.pop("profile_session", None)
+        if session is not None:
+            session.__exit__(None, None, None)
+            path = g.pop("profile_result")["path"]
+            if path:
+                response.headers["X-Profile-File"] = os.path.basename(path)
+        return response
+
+    @app.teardown_request
+    def _abort_profile(exc):
+        # Request failed before after_request ran: still stop the sampler
+        session = g.pop("profile_session", None)
+        if session is not None:
+            session.__exit__(None, None, None)
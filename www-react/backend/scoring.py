@@ -0,0 +1,142 @@
+# scoring.py
+
+import struct
+import numpy as np
+
+################################################################################
+# Online delta-rule scoring
+################################################################################
+# Same rule as the original PyQt client (scripts/test_bws.py):
+#
+#   for each other stimulus o in the trial:  V[best]  += ALPHA * (1 - (V[best]  - V[o]))
+#   for each other stimulus o in the trial:  V[worst] += ALPHA * (0 - (V[worst] - V[o]))
+#
+# Each loop only changes V[best] (resp. V[worst]), so it is a linear recurrence
+# v <- (1 - ALPHA) * v + ALPHA * (target + V[o]) and unrolls to
+#
+#   v_m = (1 - ALPHA)^m * v_0 + ALPHA * sum_j (1 - ALPHA)^(m - 1 - j) * (target + V[o_j])
+#
+# which we evaluate with one dot product per update. Results are identical to
+# the loop, including its dependence on the order of stimuli within a trial.
+# This file is kept identical in scripts/ and www-react/backend/.
+
+_HEADER = struct.Struct("<dI")  # alpha, number of resources
+
+
+class DeltaRuleScorer:
+    """
+    Delta-rule scores over a fixed set of resource ids, stored as dense NumPy arrays.
+    """
+    def __init__(self, resource_ids, alpha=0.1, values=None):
+        ids = np.asarray(resource_ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        self.resource_ids = ids[order]
+        if np.any(self.resource_ids[1:] == self.resource_ids[:-1]):
+            raise ValueError("resource_ids must be unique.")
+        self.alpha = float(alpha)
+        if values is None:
+            self.values = np.zeros(len(ids))
+        else:
+            self.values = np.asarray(values, dtype=np.float64)[order].copy()
+        self._decay = np.ones(0)
+
+    def __len__(self):
+        return len(self.resource_ids)
+
+    def indices(self, resource_ids):
+        """
+        Map resource ids to dense indices.
+
+        Raises:
+            KeyError: If any id is not part of this scorer.
+        """
+        ids = np.asarray(resource_ids, dtype=np.int64)
+        idx = np.searchsorted(self.resource_ids, ids)
+        idx_clipped = np.minimum(idx, len(self.resource_ids) - 1)
+        if len(self.resource_ids) == 0 or np.any(self.resource_ids[idx_clipped] != ids):
+            missing = ids[self.resource_ids[idx_clipped] != ids] if len(self.resource_ids) else ids
+            raise KeyError(f"Unknown resource ids: {missing.tolist()}")
+        return idx
+
+    def _decay_weights(self, m):
+        # (1 - alpha)^(m-1), ..., (1 - alpha)^0
+        if len(self._decay) < m + 1:
+            self._decay = (1.0 - self.alpha) ** np.arange(m + 1)
+        return self._decay[m - 1::-1] if m else self._decay[:0], self._decay[m]
+
+    def _pull(self, trial_idx, target_idx, target):
+        others = self.values[trial_idx[trial_idx != target_idx]]
+        weights, carry = self._decay_weights(len(others))
+        self.values[target_idx] = (
+            carry * self.values[target_idx]
+            + self.alpha * (weights @ (target + others))
+        )
+
+    def update_indices(self, trial_idx, best_idx, worst_idx):
+        """Apply one trial given dense indices (see update())."""
+        self._pull(trial_idx, best_idx, 1.0)
+        self._pull(trial_idx, worst_idx, 0.0)
+
+    def update(self, resources_in_trial, best_res_id, worst_res_id):
+        """
+        Apply the best and worst update for one choice set.
+        Skipped trials (best or worst is None) leave the scores unchanged.
+        """
+        if best_res_id is None or worst_res_id is None:
+            return
+        trial_idx = self.indices(resources_in_trial)
+        best_idx, worst_idx = self.indices([best_res_id, worst_res_id])
+        self.update_indices(trial_idx, best_idx, worst_idx)
+
+    def replay(self, trials, best, worst):
+        """
+        Apply a stored history of trials in order.
+
+        Parameters:
+            trials (list of lists or np.ndarray): Resource ids of each trial.
+            best (array-like): Best resource id per trial (None/NaN = skipped).
+            worst (array-like): Worst resource id per trial (None/NaN = skipped).
+        """
+        best = np.asarray(best, dtype=np.float64)
+        worst = np.asarray(worst, dtype=np.float64)
+        answered = ~(np.isnan(best) | np.isnan(worst))
+        if not answered.any():
+            return
+
+        # Map everything to dense indices in one go
+        lengths = np.fromiter((len(t) for t in trials), dtype=np.int64, count=len(trials))
+        flat = self.indices(np.concatenate([np.asarray(t, dtype=np.int64) for t in trials]))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        best_idx = np.zeros(len(best), dtype=np.int64)
+        worst_idx = np.zeros(len(worst), dtype=np.int64)
+        best_idx[answered] = self.indices(best[answered].astype(np.int64))
+        worst_idx[answered] = self.indices(worst[answered].astype(np.int64))
+
+        for t in np.flatnonzero(answered):
+            self.update_indices(flat[offsets[t]:offsets[t + 1]], best_idx[t], worst_idx[t])
+
+    def scores(self):
+        """Return { resource_id: score }."""
+        return dict(zip(self.resource_ids.tolist(), self.values.tolist()))
+
+    def ranking(self):
+        """Return [(resource_id, score), ...] sorted best to worst (ties keep id order)."""
+        order = np.argsort(-self.values, kind="stable")
+        return list(zip(self.resource_ids[order].tolist(), self.values[order].tolist()))
+
+    def dumps(self):
+        """Serialize to a compact bytes blob (16 bytes per resource + header)."""
+        return (
+            _HEADER.pack(self.alpha, len(self.resource_ids))
+            + self.resource_ids.astype("<i8").tobytes()
+            + self.values.astype("<f8").tobytes()
+        )
+
+    @classmethod
+    def loads(cls, blob):
+        """Inverse of dumps()."""
+        alpha, n = _HEADER.unpack_from(blob)
+        start = _HEADER.size
+        ids = np.frombuffer(blob, dtype="<i8", count=n, offset=start)
+        values = np.frombuffer(blob, dtype="<f8", count=n, offset=start + 8 * n)
+        return cls(ids, alpha=alpha, values=values)
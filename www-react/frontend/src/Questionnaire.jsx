@@ -23,13 +23,17 @@ import {
 import ReactAudioPlayer from "react-h5-audio-player";
 import "react-h5-audio-player/src/styles.scss";
 import CheckIcon from "@mui/icons-material/Check";
-import Cookies from "js-cookie";
 import { useTranslation } from "react-i18next";
+import { expandTrialsPayload } from "./trialsPayload";
+import { fetchWithRetry } from "./fetchWithRetry";
 
 function Questionnaire({ sequenceId, participantName }) {
     const { t } = useTranslation();
 
+    // trials holds the trials from trialOffset on (what the server says is still pending)
     const [trials, setTrials] = useState([]);
+    const [trialOffset, setTrialOffset] = useState(0);
+    const [nTrials, setNTrials] = useState(0);
     const [audioMap, setAudioMap] = useState({});
     const [currentTrialIndex, setCurrentTrialIndex] = useState(0);
     const [bestChoice, setBestChoice] = useState(null);
@@ -52,19 +56,6 @@ function Questionnaire({ sequenceId, participantName }) {
             .padStart(2, "0")}`;
     };
 
-    // Load persisted state on component mount
-    useEffect(() => {
-        const savedTrialIndex = Cookies.get("currentTrialIndex");
-        if (savedTrialIndex) {
-            setCurrentTrialIndex(parseInt(savedTrialIndex, 10));
-        }
-    }, []);
-
-    // Persist currentTrialIndex whenever it changes
-    useEffect(() => {
-        Cookies.set("currentTrialIndex", currentTrialIndex, { expires: 7 });
-    }, [currentTrialIndex]);
-
     // Timer update
     useEffect(() => {
         const timerId = setInterval(() => {
@@ -73,16 +64,26 @@ function Questionnaire({ sequenceId, participantName }) {
         return () => clearInterval(timerId);
     }, []);
 
-    // Fetch trials and audio info
+    // Fetch the trials (static bundle served by nginx) and this participant's
+    // progress in parallel; resumes where the participant left off
     useEffect(() => {
         setLoading(true);
-        fetch(`/api/trials/${sequenceId}`)
-            .then((res) => res.json())
-            .then((data) => {
-                if (data.error) {
-                    showSnackbar(data.error, "error");
+        const params = new URLSearchParams({ participant_name: participantName, include_trials: "0" });
+        Promise.all([
+            fetch(`/api/trials/${sequenceId}?format=compact`)
+                .then((res) => res.json())
+                .then(expandTrialsPayload),
+            fetch(`/api/trials/${sequenceId}/progress?${params}`).then((res) => res.json()),
+        ])
+            .then(([data, progress]) => {
+                const error = data.error || progress.error;
+                if (error) {
+                    showSnackbar(error, "error");
                 } else {
-                    setTrials(data.trials);
+                    setTrials(data.trials.slice(progress.next_trial));
+                    setTrialOffset(progress.next_trial);
+                    setNTrials(progress.n_trials);
+                    setCurrentTrialIndex(progress.next_trial);
                     const updatedAudioMap = Object.fromEntries(
                         Object.entries(data.audio_map).map(([key, path]) => [
                             key,
@@ -97,7 +98,7 @@ function Questionnaire({ sequenceId, participantName }) {
                 console.error(err);
             })
             .finally(() => setLoading(false));
-    }, [sequenceId]);
+    }, [sequenceId, participantName]);
 
     function showSnackbar(message, severity = "info") {
         setSnackbar({ open: true, message, severity });
@@ -137,19 +138,21 @@ function Questionnaire({ sequenceId, participantName }) {
 
     function handleSkipTrial() {
         setLoading(true);
-        fetch(`/api/trials/${sequenceId}/${currentTrialIndex}/submit`, {
+        fetchWithRetry(`/api/trials/${sequenceId}/${currentTrialIndex}/submit`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify({
                 participant_name: participantName,
                 best_stimulus: null,
                 worst_stimulus: null,
-                resources_in_trial: trials[currentTrialIndex],
+                resources_in_trial: trials[currentTrialIndex - trialOffset],
             }),
         })
-            .then((res) => res.json())
+            .then((res) => res.json().then((data) => ({ ...data, alreadySubmitted: res.status === 409 })))
             .then((data) => {
-                if (data.error) {
+                if (data.alreadySubmitted) {
+                    setCurrentTrialIndex((i) => i + 1);
+                } else if (data.error) {
                     showSnackbar(t("questionnaire.errorSkipping"), "error");
                 } else {
                     showSnackbar(t("questionnaire.trialSkipped"), "success");
@@ -174,19 +177,23 @@ function Questionnaire({ sequenceId, participantName }) {
         }
 
         setLoading(true);
-        fetch(`/api/trials/${sequenceId}/${currentTrialIndex}/submit`, {
+        fetchWithRetry(`/api/trials/${sequenceId}/${currentTrialIndex}/submit`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify({
                 participant_name: participantName,
                 best_stimulus: bestChoice,
                 worst_stimulus: worstChoice,
-                resources_in_trial: trials[currentTrialIndex],
+                resources_in_trial: trials[currentTrialIndex - trialOffset],
             }),
         })
-            .then((res) => res.json())
+            .then((res) => res.json().then((data) => ({ ...data, alreadySubmitted: res.status === 409 })))
             .then((data) => {
-                if (data.error) {
+                if (data.alreadySubmitted) {
+                    setBestChoice(null);
+                    setWorstChoice(null);
+                    setCurrentTrialIndex((i) => i + 1);
+                } else if (data.error) {
                     showSnackbar(t("questionnaire.errorSubmitting"), "error");
                 } else {
                     showSnackbar(t("questionnaire.trialSubmitted"), "success");
@@ -226,9 +233,8 @@ function Questionnaire({ sequenceId, participantName }) {
     }
 
     if (finalResults) {
-        // Reset only the trial progress cookie and reload the page
+        // Progress lives on the server now; reloading resumes from there
         const handleRestart = () => {
-            Cookies.remove("currentTrialIndex");
             window.location.reload();
         };
 
@@ -313,10 +319,8 @@ function Questionnaire({ sequenceId, participantName }) {
     }
 
 
-    if (currentTrialIndex >= trials.length && trials.length > 0) {
-        // Add a function to reset the cookie
+    if (currentTrialIndex >= nTrials && nTrials > 0) {
         const handleRestart = () => {
-            Cookies.remove("currentTrialIndex");
             window.location.reload();
         };
 
@@ -370,7 +374,7 @@ function Questionnaire({ sequenceId, participantName }) {
         );
     }
 
-    if (trials.length === 0) {
+    if (nTrials === 0) {
         return (
             <Container maxWidth="md" sx={{ mt: 5 }}>
                 <Typography variant="h6">
@@ -380,9 +384,9 @@ function Questionnaire({ sequenceId, participantName }) {
         );
     }
 
-    const resourcesInCurrentTrial = trials[currentTrialIndex];
+    const resourcesInCurrentTrial = trials[currentTrialIndex - trialOffset];
     const progressValue =
-        ((currentTrialIndex + 1) / trials.length) * 100;
+        ((currentTrialIndex + 1) / nTrials) * 100;
 
     return (
         <Container maxWidth="md" sx={{ mt: 5 }}>
@@ -397,7 +401,7 @@ function Questionnaire({ sequenceId, participantName }) {
                 <Typography variant="body2">
                     {t("questionnaire.trialInfo", {
                         current: currentTrialIndex + 1,
-                        total: trials.length,
+                        total: nTrials,
                     })}
                 </Typography>
                 <Typography variant="body2" color="primary">
@@ -0,0 +1,29 @@
+// fetchWithRetry.js
+
+const RETRY_STATUSES = new Set([429, 503]);
+
+function sleep(ms) {
+    return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+// fetch() that retries overload answers (429/503) and network errors with
+// exponential backoff and full jitter, honouring the server's Retry-After.
+// Only use it for requests that are safe to repeat (submissions are: the
+// backend answers 409 for a trial that was already stored).
+export async function fetchWithRetry(url, options = {}, { retries = 4, baseDelayMs = 300, maxDelayMs = 5000 } = {}) {
+    for (let attempt = 0; ; attempt++) {
+        let res;
+        try {
+            res = await fetch(url, options);
+        } catch (err) {
+            if (attempt >= retries) throw err;
+        }
+        if (res && (!RETRY_STATUSES.has(res.status) || attempt >= retries)) {
+            return res;
+        }
+
+        const cap = Math.min(maxDelayMs, baseDelayMs * 2 ** attempt);
+        const retryAfterMs = res ? Number(res.headers.get("Retry-After")) * 1000 || 0 : 0;
+        await sleep(retryAfterMs + Math.random() * cap);
+    }
+}
@@ -0,0 +1,27 @@
+// trialsPayload.js
+
+// Expand the compact trials payload (?format=compact, see backend/wire_format.py)
+// into the { trials, audio_map } shape the questionnaire works with.
+export function expandTrialsPayload(data) {
+    if (data.format !== "compact-v1") {
+        return data;
+    }
+
+    const { base_url, resource_ids, paths, items, offsets } = data;
+
+    const audio_map = {};
+    resource_ids.forEach((resId, i) => {
+        audio_map[resId] = base_url + paths[i];
+    });
+
+    const trials = [];
+    for (let t = 0; t + 1 < offsets.length; t++) {
+        const trial = [];
+        for (let j = offsets[t]; j < offsets[t + 1]; j++) {
+            trial.push(resource_ids[items[j]]);
+        }
+        trials.push(trial);
+    }
+
+    return { ...data, trials, audio_map };
+}